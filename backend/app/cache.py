@@ -1,40 +1,69 @@
 from __future__ import annotations
-from typing import Any, Optional
+from typing import Any, Optional, Tuple
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import threading
 import hashlib
 import json
+from .config import settings
+from .metrics import count_cache
 
 
 class SimpleCache:
-    def __init__(self, ttl_hours: int = 24):
+    def __init__(self, ttl_hours: int = 24, name: str = "cache", max_entries: Optional[int] = None):
+        self.name = name
         self._lock = threading.Lock()
-        self._cache: Dict[str, Tuple[Any, datetime]] = {}
+        # key -> (value, момент истечения); порядок - от давно не использованных к недавним (LRU)
+        self._cache: "OrderedDict[str, Tuple[Any, datetime]]" = OrderedDict()
         self._ttl = timedelta(hours=ttl_hours)
+        self.max_entries = max_entries or settings.cache_max_entries
+        self.evictions = 0
     
     def get(self, key: str) -> Optional[Any]:
         with self._lock:
             if key not in self._cache:
+                count_cache(self.name, False)
                 return None
             
-            value, timestamp = self._cache[key]
-            if datetime.utcnow() - timestamp > self._ttl:
+            value, expires_at = self._cache[key]
+            if datetime.utcnow() > expires_at:
                 del self._cache[key]
+                count_cache(self.name, False)
                 return None
             
+            self._cache.move_to_end(key)
+            count_cache(self.name, True)
             return value
     
-    def set(self, key: str, value: Any) -> None:
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        """Сохраняет значение; ttl в секундах переопределяет TTL кэша."""
+        expires_at = datetime.utcnow() + (timedelta(seconds=ttl) if ttl is not None else self._ttl)
         with self._lock:
-            self._cache[key] = (value, datetime.utcnow())
+            if key not in self._cache and len(self._cache) >= self.max_entries:
+                self._evict()
+            self._cache[key] = (value, expires_at)
+            self._cache.move_to_end(key)
+
+    def _evict(self) -> None:
+        """Кэш полон: удаляем истёкшие записи, а если их мало - давно не использованные
+        до 90% ёмкости, чтобы полный проход по словарю был раз на max_entries/10 вставок.
+        Часто читаемые записи (счётчики отпечатков устройств) так не вытесняются."""
+        now = datetime.utcnow()
+        for key in [key for key, (_, expires_at) in self._cache.items() if now > expires_at]:
+            del self._cache[key]
+        excess = len(self._cache) - int(self.max_entries * 0.9)
+        if excess > 0:
+            for _ in range(excess):
+                self._cache.popitem(last=False)
+            self.evictions += excess
     
     def cleanup(self) -> None:
         """Удаляет устаревшие записи."""
         now = datetime.utcnow()
         with self._lock:
             expired_keys = [
-                key for key, (_, timestamp) in self._cache.items()
-                if now - timestamp > self._ttl
+                key for key, (_, expires_at) in self._cache.items()
+                if now > expires_at
             ]
             for key in expired_keys:
                 del self._cache[key]
@@ -45,6 +74,6 @@ class SimpleCache:
 
 
 # Глобальные кэши
-geo_cache = SimpleCache(ttl_hours=24)
-bin_cache = SimpleCache(ttl_hours=24)
-device_cache = SimpleCache(ttl_hours=1)  # Короткий TTL для device fingerprint
+geo_cache = SimpleCache(ttl_hours=24, name="geo")
+bin_cache = SimpleCache(ttl_hours=24, name="bin")
+device_cache = SimpleCache(ttl_hours=1, name="device")  # Короткий TTL для device fingerprint
@@ -0,0 +1,137 @@
+"""
+Сессии проверки на чекауте: start при загрузке страницы, update по мере
+заполнения email/карты, finalize на submit.
+
+Lookup'ы (geo, BIN, email) запускаются, как только готовы их входы, и
+хранятся вместе с этими входами. Финальная проверка берёт предрасчитанный
+результат, только если входы совпадают с итоговым запросом. Velocity и
+blacklist не предрасчитываются: сессия живёт до TTL, за это время появляются
+новые попытки и записи blacklist - их считает сама финальная проверка.
+Сессии живут в памяти воркера: если сессии нет (истекла, другой воркер),
+finalize просто считает всё сам.
+"""
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import secrets
+import time
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from .config import settings
+from .rule_engine import CheckContext, rule_engine
+from .schemas import CheckRequest
+
+logger = logging.getLogger("antifraud.sessions")
+
+# Правило -> поля CheckRequest, от которых зависит его результат
+PRECOMPUTED_RULES: Dict[str, Tuple[str, ...]] = {
+    "ip_country": ("ip",),
+    "bin_country": ("bin",),
+    "email": ("email",),
+}
+
+
+class CheckSession:
+    def __init__(self, session_id: str, expires_at: float):
+        self.session_id = session_id
+        self.expires_at = expires_at
+        self.fields: Dict[str, Any] = {}
+        # правило -> (значения входов, задача)
+        self.lookups: Dict[str, Tuple[Tuple[Any, ...], asyncio.Task]] = {}
+
+    def cancel(self) -> None:
+        for _, task in self.lookups.values():
+            task.cancel()
+
+
+async def _run_lookup(name: str, fields: Dict[str, Any], bind: Engine) -> Any:
+    # Частичный запрос без валидации: правило читает только свои входы
+    payload = CheckRequest.model_construct(**fields)
+    with Session(bind=bind) as db:
+        return await rule_engine.run_rule(name, CheckContext(payload, db))
+
+
+class CheckSessionStore:
+    def __init__(self, ttl_seconds: int = 900, max_sessions: int = 10000):
+        self.ttl = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions: Dict[str, CheckSession] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        for session_id in [sid for sid, s in self._sessions.items() if s.expires_at <= now]:
+            self._sessions.pop(session_id).cancel()
+
+    def start(self) -> CheckSession:
+        self._sweep()
+        if len(self._sessions) >= self.max_sessions:
+            # Вытесняем самую старую сессию (dict хранит порядок вставки)
+            self._sessions.pop(next(iter(self._sessions))).cancel()
+        session = CheckSession(secrets.token_urlsafe(16), time.monotonic() + self.ttl)
+        self._sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id: str) -> Optional[CheckSession]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if session.expires_at <= time.monotonic():
+            self._sessions.pop(session_id).cancel()
+            return None
+        return session
+
+    def update(self, session: CheckSession, fields: Dict[str, Any], bind: Engine) -> List[str]:
+        """Запоминает поля и запускает lookup'ы с готовыми (или изменившимися) входами."""
+        session.fields.update({k: v for k, v in fields.items() if v is not None})
+        session.expires_at = time.monotonic() + self.ttl
+        started = []
+        for name, inputs in PRECOMPUTED_RULES.items():
+            values = tuple(session.fields.get(field) for field in inputs)
+            if any(value is None for value in values):
+                continue
+            current = session.lookups.get(name)
+            if current is not None and current[0] == values:
+                continue
+            if current is not None:
+                current[1].cancel()
+            session.lookups[name] = (values, asyncio.ensure_future(_run_lookup(name, dict(session.fields), bind)))
+            started.append(name)
+        return started
+
+    async def finalize(self, session_id: str, payload: CheckRequest, deadline: Optional[float] = None) -> Dict[str, Any]:
+        """Закрывает сессию и возвращает результаты, входы которых совпали с итоговым запросом.
+
+        Незавершённые lookup'ы ждём не дольше deadline (loop.time()); не успевшие
+        доделывают работу в фоне (прогрев кэша), а правило выполнит финальная проверка.
+        """
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return {}
+        matched: Dict[str, asyncio.Task] = {}
+        for name, (values, task) in session.lookups.items():
+            if tuple(getattr(payload, field) for field in PRECOMPUTED_RULES[name]) == values:
+                matched[name] = task
+            else:
+                task.cancel()
+        pending = [task for task in matched.values() if not task.done()]
+        if pending:
+            timeout = None if deadline is None else max(0.0, deadline - asyncio.get_running_loop().time())
+            await asyncio.wait(pending, timeout=timeout)
+        results: Dict[str, Any] = {}
+        for name, task in matched.items():
+            if not task.done() or task.cancelled():
+                continue
+            if task.exception() is not None:
+                # Ошибка предрасчёта - правило выполнится в финальной проверке
+                logger.error("Session lookup %s failed: %s", name, task.exception())
+                continue
+            results[name] = task.result()
+        return results
+
+
+# Глобальное хранилище сессий проверки
+check_sessions = CheckSessionStore(ttl_seconds=settings.check_session_ttl_seconds, max_sessions=settings.check_session_max)
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import List
+from typing import Dict, List, Literal
 
 
 class Settings(BaseSettings):
@@ -22,6 +22,10 @@ class Settings(BaseSettings):
     rate_limit_ip: int = 60
     rate_limit_email: int = 20
 
+    # Подмена хостов внешних geo/BIN API, например
+    # PROVIDER_BASE_URLS='{"ipapi.co": "http://127.0.0.1:9101"}' (заглушки в load_test.py)
+    provider_base_urls: Dict[str, str] = {}
+
     # Scoring weights
     score_geo_mismatch: int = 30
     score_temp_email: int = 25
@@ -38,10 +42,121 @@ class Settings(BaseSettings):
 
     # Cache TTL
     cache_ttl_hours: int = 24
+    # Предел записей в каждом in-memory кэше (geo/bin/device/idempotency) на воркер
+    cache_max_entries: int = 100000
 
     # Log retention
     log_retention_days: int = 90
 
+    # Пул потоков для блокирующих (DB) правил
+    rule_executor_workers: int = 8
+
+    # Бюджет /api/check в мс (0 - без дедлайна) и бюджеты отдельных правил,
+    # например RULE_BUDGETS_MS='{"ip_country": 150, "bin_country": 150}'
+    check_deadline_ms: int = 0
+    rule_budgets_ms: Dict[str, int] = {}
+
+    # Размер LRU на каждое мемоизируемое правило (0 - мемоизация выключена)
+    rule_memo_size: int = 4096
+
+    # Доверенные постоянные клиенты (email + устройство + BIN): сколько проверок подряд
+    # со score <= trust_max_score нужно за окно для сокращённого набора правил (0 - выключено);
+    # в серию идут проверки не чаще раза в trust_min_spacing_hours, а каждая
+    # trust_full_every-я проверка доверенной связки - снова полным набором
+    trust_min_checks: int = 5
+    trust_window_hours: int = 720
+    trust_max_score: int = 20
+    trust_max_entries: int = 100000
+    trust_min_spacing_hours: float = 24
+    trust_full_every: int = 10
+    # Индекс строится в фоне после старта по последним trust_rebuild_max_rows проверкам
+    # окна (0 - без ограничения), батчами по trust_rebuild_batch_size строк
+    trust_rebuild_max_rows: int = 200000
+    trust_rebuild_batch_size: int = 5000
+
+    # Server-Timing с числом и временем SQL/Redis/HTTP-вызовов запроса (выключен: по
+    # нему внешний клиент видит, какие lookup'ы сработали); запросы дольше
+    # slow_request_ms пишутся в лог со стоимостью (0 - не писать)
+    server_timing_enabled: bool = False
+    slow_request_ms: int = 500
+
+    # /api/check дольше порога (мс) попадает в буфер медленных проверок с разбивкой
+    # по правилам (GET /api/admin/slow-checks); 0 - не захватывать
+    slow_check_capture_ms: int = 250
+    slow_check_capture_max: int = 200
+
+    # Задержка event loop: период замера heartbeat в мс (0 - выключено). Отладочный
+    # режим дополнительно снимает стек, когда loop занят дольше порога, и запоминает
+    # кадр и эндпоинт (GET /api/admin/loop-blocks)
+    loop_lag_interval_ms: int = 100
+    loop_block_debug: bool = False
+    loop_block_threshold_ms: int = 100
+    loop_block_max: int = 200
+
+    # Трассировка запросов к trace_paths (точные пути через запятую): файл спанов Zipkin
+    # JSON с ротацией (пусто - выключено) и доля записываемых запросов
+    trace_file: str = ""
+    trace_sample_rate: float = 0.01
+    trace_paths: str = "/api/check"
+    trace_file_max_mb: int = 50
+    trace_file_backups: int = 5
+    # Не больше спанов на трассу (остальные отбрасываются и считаются в теге корня)
+    trace_max_spans: int = 500
+    # Сети (CIDR через запятую), чей traceparent с флагом sampled включает запись;
+    # от остальных клиентов флаг игнорируется (пусто - никому)
+    trace_trusted_networks: str = ""
+
+    @property
+    def trace_paths_tuple(self) -> tuple:
+        return tuple(x.strip() for x in self.trace_paths.split(",") if x.strip())
+
+    @property
+    def trace_trusted_networks_list(self) -> list:
+        return [x.strip() for x in self.trace_trusted_networks.split(",") if x.strip()]
+
+    # full - все правила (аудит); early_exit - дешёвые правила первыми и остановка,
+    # как только рекомендация не может измениться
+    evaluation_mode: Literal["full", "early_exit"] = "full"
+
+    # Файл декларативных правил (пусто - app/rules/default_rules.json) и период
+    # проверки его изменений в секундах (0 - только через POST /api/rules/reload)
+    rules_file: str = ""
+    rules_reload_seconds: int = 5
+
+    # Профиль пайплайна по умолчанию (lite / standard / full) и профили
+    # дополнительных API ключей, например API_KEY_PROFILES='{"search_key": "lite"}'
+    default_profile: str = "standard"
+    api_key_profiles: Dict[str, str] = {}
+
+    # Сессии проверки на чекауте: время жизни с последнего обновления и лимит на воркер
+    check_session_ttl_seconds: int = 900
+    check_session_max: int = 10000
+
+    # Двухфазный скоринг: одновременных фоновых пересчётов на воркер
+    enrichment_concurrency: int = 64
+
+    # Окно, в котором повтор той же проверки получает исходный ответ (0 - выключено)
+    idempotency_window_seconds: int = 300
+
+    # Максимальный размер /api/check/batch
+    batch_max_size: int = 500
+
+    # Потоковый NDJSON-скоринг: параллельных проверок и размер микро-батча записи
+    stream_concurrency: int = 32
+    stream_flush_size: int = 200
+    # Максимальная длина строки NDJSON, байты (длиннее - ошибка в выводе, строка не буферизуется)
+    stream_max_line_bytes: int = 65536
+
+    # Write-behind запись: размер микро-батча, макс. ожидание и размер очереди
+    write_behind_batch_size: int = 200
+    write_behind_flush_ms: int = 5
+    write_behind_queue_size: int = 10000
+
+    # ID воркера для snowflake ID проверок (0..63); не задан - процесс арендует
+    # свободный ID в таблице worker_id_leases (аренда продлевается в фоне)
+    worker_id: int | None = None
+    worker_id_lease_seconds: int = 300
+
     # Необязательные ключи
     emailrep_api_key: str | None = None
 
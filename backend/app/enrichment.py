@@ -0,0 +1,101 @@
+"""
+Двухфазный скоринг /api/check.
+
+Фаза 1 отвечает по локальным правилам (velocity - в памяти процесса), фаза 2
+в фоне дозапускает geo/BIN, DB velocity и ML для того же check_id, обновляет
+сохранённую проверку и рассылает пересмотренный вердикт, если он стал строже.
+"""
+from __future__ import annotations
+from typing import Any, Dict, Optional, Set
+import asyncio
+import logging
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from .config import settings
+from .logging_config import log_check_complete
+from .pipeline import ScoredCheck, score_check
+from .profiles import PipelineProfile
+from .rule_engine import rule_engine
+from .rules.velocity import check_velocity, recent_attempts
+from .schemas import CheckRequest
+from .trust import observe_check
+from .websocket_manager import websocket_manager
+from .write_behind import persistence_writer
+
+logger = logging.getLogger("antifraud.enrichment")
+
+RECOMMENDATION_SEVERITY = {"allow": 0, "review": 1, "block": 2}
+
+
+async def score_provisional(payload: CheckRequest, db: Session, profile: PipelineProfile, deadline: Optional[float] = None, results: Optional[Dict[str, Any]] = None) -> ScoredCheck:
+    """Фаза 1: правила профиля, velocity - по попыткам в памяти вместо запроса к БД
+    (если нет готового результата, например из сессии чекаута)."""
+    velocity = recent_attempts.hit(payload.email, payload.ip or "")
+    seeded = {"velocity": velocity, **(results or {})}
+    return await score_check(payload, db, seeded, deadline=deadline, profile=profile)
+
+
+class Enricher:
+    def __init__(self, concurrency: int = 64):
+        self._tasks: Set[asyncio.Task] = set()
+        # Ограничение фоновой нагрузки: при всплеске пересчёты ждут в очереди
+        self._slots = asyncio.Semaphore(concurrency)
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def schedule(self, provisional: ScoredCheck, bind: Engine) -> None:
+        task = asyncio.create_task(self._enrich(provisional, bind))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _enrich(self, provisional: ScoredCheck, bind: Engine) -> None:
+        async with self._slots:
+            try:
+                await self._rescore(provisional, bind)
+            except Exception:
+                logger.exception("Enrichment failed for check %s", provisional.check_id)
+
+    async def _rescore(self, provisional: ScoredCheck, bind: Engine) -> ScoredCheck:
+        # Результаты локальных правил переиспользуются (device уже учёл отпечаток),
+        # velocity пересчитывается по БД - она видит все воркеры
+        seeded = {name: value for name, value in provisional.results.items() if name != "velocity"}
+        profile = provisional.profile.final
+        if any(rule.name == "velocity" for rule in rule_engine.select(profile.rules)):
+            # Без самой предварительной строки: записана ли она уже, зависит от write-behind
+            seeded["velocity"] = await asyncio.get_running_loop().run_in_executor(None, self._velocity, provisional, bind)
+        with Session(bind=bind) as db:
+            final = await score_check(provisional.payload, db, seeded, profile=profile, check_id=provisional.check_id)
+
+        # Очередь write-behind упорядочена: обновление идёт после предварительной записи
+        await persistence_writer.submit(final.fraud_check_row(), bind=bind, merge=True)
+        # Тот же check_id: окончательный score заменяет предварительный, а не добавляет попытку
+        observe_check(final)
+        anomaly = final.anomaly_row()
+        if anomaly is not None:
+            await persistence_writer.submit(anomaly, bind=bind)
+
+        if RECOMMENDATION_SEVERITY[final.recommendation] > RECOMMENDATION_SEVERITY[provisional.recommendation]:
+            await websocket_manager.broadcast_verdict_revised({
+                **final.alert(),
+                "previous_recommendation": provisional.recommendation,
+                "previous_risk_score": provisional.score,
+            })
+        log_check_complete(final.check_id, final.score, final.flags, final.recommendation)
+        return final
+
+    @staticmethod
+    def _velocity(provisional: ScoredCheck, bind: Engine) -> Any:
+        payload = provisional.payload
+        with Session(bind=bind) as db:
+            return check_velocity(db, payload.email, payload.ip or "", exclude_id=provisional.check_id)
+
+    async def drain(self) -> None:
+        """Дожидается фоновых пересчётов (перед остановкой writer)."""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+
+# Глобальный фоновый пересчёт
+enricher = Enricher(concurrency=settings.enrichment_concurrency)
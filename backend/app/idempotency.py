@@ -0,0 +1,99 @@
+"""
+Кэш результатов для повторных отправок одной и той же проверки.
+
+Ключ - Idempotency-Key из заголовка или канонический хэш CheckRequest, в
+области хэша API ключа: один Idempotency-Key у разных клиентов не пересекается,
+и клиент не получит чужой ответ по угаданному ключу или телу запроса.
+В пределах окна повтор получает исходный CheckResponse (с тем же check_id)
+без прогона правил, записи в БД и роста velocity.
+"""
+from __future__ import annotations
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import json
+from .cache import SimpleCache
+from .config import settings
+from .redis_client import redis_client
+from .schemas import CheckRequest, CheckResponse
+
+
+class IdempotencyKeyConflict(Exception):
+    """Idempotency-Key повторно использован с другим телом запроса."""
+
+
+def request_fingerprint(payload: CheckRequest) -> str:
+    """Канонический хэш запроса: порядок ключей и отсутствующие поля не влияют."""
+    canonical = json.dumps(payload.model_dump(exclude_none=True), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def api_key_scope(api_key: Optional[str]) -> str:
+    """Хэш API ключа для ключей кэша (сам ключ не попадает в Redis)."""
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+
+
+class IdempotencyCache:
+    def __init__(self, window_seconds: int):
+        self.window_seconds = window_seconds
+        self._local = SimpleCache(ttl_hours=1)
+        # Одновременные одинаковые запросы ждут первый, а не считаются параллельно
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def _get(self, key: str) -> Optional[dict]:
+        entry = self._local.get(key)
+        if entry is None:
+            entry = await redis_client.get(key)
+        return entry
+
+    async def _set(self, key: str, entry: dict) -> None:
+        self._local.set(key, entry, ttl=self.window_seconds)
+        await redis_client.set(key, entry, ttl=self.window_seconds)
+
+    async def get_or_compute(
+        self,
+        payload: CheckRequest,
+        idempotency_key: Optional[str],
+        compute: Callable[[], Awaitable[CheckResponse]],
+        scope: str = "",
+        api_key: Optional[str] = None,
+    ) -> Tuple[CheckResponse, bool]:
+        """Возвращает (ответ, replayed); scope - например профиль пайплайна (разные ответы на один запрос),
+        api_key - ключ клиента, повторы ищутся только среди его запросов."""
+        if self.window_seconds <= 0:
+            return await compute(), False
+
+        fingerprint = request_fingerprint(payload)
+        scope = f"{api_key_scope(api_key)}:{scope}"
+        key = f"idem:{scope}:key:{idempotency_key}" if idempotency_key else f"idem:{scope}:req:{fingerprint}"
+
+        entry = await self._get(key)
+        if entry is None and key in self._inflight:
+            entry = await asyncio.shield(self._inflight[key])
+        if entry is not None:
+            if entry["fingerprint"] != fingerprint:
+                raise IdempotencyKeyConflict(idempotency_key)
+            return CheckResponse(**entry["response"]), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response = await compute()
+            entry = {"fingerprint": fingerprint, "response": response.model_dump(exclude_none=True)}
+            await self._set(key, entry)
+            future.set_result(entry)
+            return response, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Ошибку получат только ожидающие дубликаты - без предупреждения о неполученном исключении
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+
+# Глобальный кэш идемпотентности /api/check
+idempotency_cache = IdempotencyCache(window_seconds=settings.idempotency_window_seconds)
@@ -0,0 +1,177 @@
+"""
+Сортируемые по времени 64-битные ID (snowflake) для FraudCheck.
+
+Раскладка - 53 бита, чтобы ID без потерь читался как Number в дашборде (JS):
+41 бит - миллисекунды от EPOCH_MS (~69 лет), 6 бит - воркер, 6 бит - счётчик
+в пределах мс (64 ID/мс на воркер). В БД колонка 64-битная.
+
+ID воркера уникален на весь кластер: WORKER_ID из настроек или аренда
+свободного ID в таблице worker_id_leases (WorkerIdLease). Аренду продлевает
+фоновый поток; ID процесса, который не продлевал её дольше
+worker_id_lease_seconds, может занять другой процесс.
+"""
+from __future__ import annotations
+from typing import Optional
+from datetime import datetime, timedelta, timezone
+import atexit
+import logging
+import os
+import secrets
+import socket
+import threading
+import time
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .config import settings
+
+logger = logging.getLogger("antifraud.ids")
+
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+WORKER_BITS = 6
+SEQUENCE_BITS = 6
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+TIMESTAMP_SHIFT = WORKER_BITS + SEQUENCE_BITS
+
+
+class SnowflakeGenerator:
+    def __init__(self, worker_id: int):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id must be in 0..{MAX_WORKER_ID}")
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self) -> int:
+        with self._lock:
+            now_ms = int(time.time() * 1000)
+            # Часы ушли назад - продолжаем с последней метки, а не выдаём дубликаты
+            if now_ms < self._last_ms:
+                now_ms = self._last_ms
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # Счётчик исчерпан в этой мс - берём следующую, не дожидаясь часов
+                    # (под локом не ждём: после отката часов ожидание длилось бы до их возврата)
+                    now_ms = self._last_ms + 1
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return ((now_ms - EPOCH_MS) << TIMESTAMP_SHIFT) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+
+class WorkerIdLease:
+    """Аренда ID воркера в БД: строка WorkerIdLease с владельцем и сроком."""
+
+    def __init__(self, bind, ttl_seconds: int = 300):
+        self.bind = bind
+        self.ttl = ttl_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.worker_id: Optional[int] = None
+
+    def acquire(self) -> int:
+        """Занимает свободный или просроченный ID; RuntimeError, если заняты все."""
+        from .models import WorkerIdLease as Lease
+        Lease.__table__.create(self.bind, checkfirst=True)
+        # Начинаем с разных ID, чтобы одновременно стартующие процессы реже сталкивались
+        start = os.getpid() & MAX_WORKER_ID
+        for offset in range(MAX_WORKER_ID + 1):
+            worker_id = (start + offset) & MAX_WORKER_ID
+            now = datetime.utcnow()
+            expires_at = now + timedelta(seconds=self.ttl)
+            with Session(bind=self.bind) as db:
+                try:
+                    db.add(Lease(worker_id=worker_id, owner=self.owner, expires_at=expires_at))
+                    db.commit()
+                except IntegrityError:
+                    db.rollback()
+                    taken = db.execute(
+                        update(Lease)
+                        .where(Lease.worker_id == worker_id, Lease.expires_at < now)
+                        .values(owner=self.owner, expires_at=expires_at)
+                    ).rowcount
+                    db.commit()
+                    if not taken:
+                        continue
+            self.worker_id = worker_id
+            logger.info("Leased worker id %d (%s)", worker_id, self.owner)
+            return worker_id
+        raise RuntimeError(f"All {MAX_WORKER_ID + 1} worker ids are leased; set WORKER_ID explicitly")
+
+    def renew(self) -> bool:
+        """Продлевает аренду; False - её занял другой процесс (мы не продлевали дольше TTL)."""
+        from .models import WorkerIdLease as Lease
+        with Session(bind=self.bind) as db:
+            renewed = db.execute(
+                update(Lease)
+                .where(Lease.worker_id == self.worker_id, Lease.owner == self.owner)
+                .values(expires_at=datetime.utcnow() + timedelta(seconds=self.ttl))
+            ).rowcount
+            db.commit()
+        return bool(renewed)
+
+    def release(self) -> None:
+        from .models import WorkerIdLease as Lease
+        if self.worker_id is None:
+            return
+        with Session(bind=self.bind) as db:
+            db.execute(delete(Lease).where(Lease.worker_id == self.worker_id, Lease.owner == self.owner))
+            db.commit()
+        self.worker_id = None
+
+
+def _keep_lease(lease: WorkerIdLease, generator: SnowflakeGenerator) -> None:
+    """Фоновое продление аренды; потерянную аренду заменяет новой."""
+    while True:
+        time.sleep(lease.ttl / 3)
+        try:
+            if not lease.renew():
+                logger.error("Worker id %d lease lost, leasing a new one", lease.worker_id)
+                new_id = lease.acquire()
+                with generator._lock:
+                    generator.worker_id = new_id
+        except Exception as e:
+            logger.error("Worker id lease renewal failed: %s", e)
+
+
+def leased_generator() -> SnowflakeGenerator:
+    """Генератор с WORKER_ID из настроек или с арендованным в БД ID воркера."""
+    if settings.worker_id is not None:
+        return SnowflakeGenerator(settings.worker_id)
+    from .db import engine
+    lease = WorkerIdLease(engine, settings.worker_id_lease_seconds)
+    generator = SnowflakeGenerator(lease.acquire())
+    threading.Thread(target=_keep_lease, args=(lease, generator), name="worker-id-lease", daemon=True).start()
+    atexit.register(lease.release)
+    return generator
+
+
+def id_to_datetime(snowflake_id: int) -> datetime:
+    """Момент генерации ID."""
+    return datetime.fromtimestamp(((snowflake_id >> TIMESTAMP_SHIFT) + EPOCH_MS) / 1000, tz=timezone.utc)
+
+
+def min_id_at(moment: datetime) -> int:
+    """Наименьший ID, который мог быть выдан в момент moment - для range-сканов по PK."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0, int(moment.timestamp() * 1000) - EPOCH_MS) << TIMESTAMP_SHIFT
+
+
+# Глобальный генератор ID проверок
+_check_ids: Optional[SnowflakeGenerator] = None
+_check_ids_pid: Optional[int] = None
+_init_lock = threading.Lock()
+
+
+def next_check_id() -> int:
+    global _check_ids, _check_ids_pid
+    # После fork (воркеры uvicorn, пул rescore_checks.py) создаём генератор заново
+    if _check_ids_pid != os.getpid():
+        with _init_lock:
+            if _check_ids_pid != os.getpid():
+                _check_ids = leased_generator()
+                _check_ids_pid = os.getpid()
+    return _check_ids.next_id()
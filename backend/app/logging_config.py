@@ -26,6 +26,10 @@ class JSONFormatter(logging.Formatter):
             log_entry['score_delta'] = record.score_delta
         if hasattr(record, 'fraud_flag'):
             log_entry['fraud_flag'] = record.fraud_flag
+        # Медленный запрос: маршрут и его стоимость (request_cost); блокировка loop
+        for field in ('method', 'path', 'status', 'cost', 'loop_block'):
+            if hasattr(record, field):
+                log_entry[field] = getattr(record, field)
             
         return json.dumps(log_entry)
 
@@ -0,0 +1,219 @@
+"""
+Задержка и блокировки event loop.
+
+Heartbeat - задача, которая спит interval и меряет, насколько позже срока
+проснулась: это задержка loop (antifraud_event_loop_lag_seconds). Включена и
+в проде - по ней видно, что обработчики стопорят параллельные проверки.
+
+Отладочный режим (LOOP_BLOCK_DEBUG) добавляет поток-сторож: если heartbeat не
+проснулся дольше порога, сторож снимает стек потока loop (sys._current_frames)
+и запоминает, какой кадр держит loop и какой эндпоинт его вызвал (задачу
+запроса регистрирует LoopTaskMiddleware). Отчёты - в кольцевой буфер
+(GET /api/admin/loop-blocks), лог и счётчик antifraud_event_loop_blocks_total.
+"""
+from __future__ import annotations
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from .config import settings
+from .metrics import count_loop_block, observe_loop_lag
+
+logger = logging.getLogger("antifraud.loop")
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# ASGI middleware приложения - в стеке любого запроса, виновником не бывают
+MIDDLEWARE_FILES = {os.path.join(APP_DIR, name) for name in ("loop_monitor.py", "request_cost.py", "tracing.py")}
+
+
+def _frame_where(frame: Any) -> str:
+    """app/main.py:413:login - путь внутри пакета app, иначе имя файла."""
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(APP_DIR):
+        filename = os.path.relpath(filename, os.path.dirname(APP_DIR))
+    else:
+        filename = os.path.basename(filename)
+    return f"{filename}:{frame.f_lineno}:{code.co_name}"
+
+
+def _task_label(task: Optional[asyncio.Task]) -> str:
+    if task is None:
+        return "callback"
+    coro = task.get_coro()
+    return getattr(coro, "__qualname__", None) or task.get_name()
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = 0.1, threshold: float = 0.1, debug: bool = False, max_reports: int = 200, max_depth: int = 40):
+        self.interval = interval
+        self.threshold = threshold
+        self.debug = debug
+        self.max_depth = max_depth
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.blocks = 0
+        self._reports: Deque[Dict[str, Any]] = deque(maxlen=max_reports)
+        # Задача -> ASGI scope запроса, который в ней выполняется
+        self._scopes: Dict[asyncio.Task, Dict[str, Any]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # Срок, к которому heartbeat должен проснуться (monotonic), и незакрытый отчёт
+        self._due: Optional[float] = None
+        self._reported_due: Optional[float] = None
+        self._pending: Optional[Dict[str, Any]] = None
+
+    @property
+    def running(self) -> bool:
+        return self._heartbeat_task is not None
+
+    def start(self) -> None:
+        """Запуск из работающего loop (startup приложения)."""
+        if self.running or not self.interval:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat_task = self._loop.create_task(self._heartbeat(), name="loop-heartbeat")
+        if self.debug:
+            self._stop.clear()
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    async def stop(self) -> None:
+        task, self._heartbeat_task = self._heartbeat_task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        if self._watchdog is not None:
+            self._stop.set()
+            self._watchdog.join()
+            self._watchdog = None
+        self._due = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            due = time.monotonic() + self.interval
+            self._due = due
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - due)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            observe_loop_lag(lag)
+            if self._pending is not None:
+                self._close_report(lag)
+
+    def _watch(self) -> None:
+        poll = max(self.threshold / 4, 0.002)
+        while not self._stop.wait(poll):
+            due = self._due
+            if due is None or due == self._reported_due or time.monotonic() - due < self.threshold:
+                continue
+            # Loop не проснулся к сроку + порог: стек того, что его держит
+            self._reported_due = due
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                with self._lock:
+                    self._pending = self._describe(frame)
+
+    def _describe(self, frame: Any) -> Dict[str, Any]:
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        scope = self._scopes.get(task) if task is not None else None
+        stack: List[str] = []
+        app_frame = None
+        while frame is not None and len(stack) < self.max_depth:
+            stack.append(_frame_where(frame))
+            filename = frame.f_code.co_filename
+            if app_frame is None and filename.startswith(APP_DIR) and filename not in MIDDLEWARE_FILES:
+                app_frame = stack[-1]
+            frame = frame.f_back
+        endpoint = scope.get("endpoint") if scope else None
+        return {
+            "detected_at": time.time(),
+            "endpoint": getattr(endpoint, "__name__", None) or ("unrouted" if scope else _task_label(task)),
+            "method": (scope.get("method") or scope["type"].upper()) if scope else None,
+            "path": scope.get("path") if scope else None,
+            "frame": stack[0] if stack else None,
+            "app_frame": app_frame,
+            "stack": list(reversed(stack)),
+        }
+
+    def _close_report(self, lag: float) -> None:
+        with self._lock:
+            report, self._pending = self._pending, None
+        if report is None:
+            return
+        report["blocked_ms"] = round(lag * 1000, 1)
+        self.blocks += 1
+        self._reports.append(report)
+        count_loop_block(report["endpoint"])
+        logger.warning("Event loop blocked", extra={"method": report["method"], "path": report["path"], "loop_block": report})
+
+    def track(self, scope: Dict[str, Any]) -> Optional[asyncio.Task]:
+        task = asyncio.current_task()
+        if task is not None:
+            self._scopes[task] = scope
+        return task
+
+    def untrack(self, task: Optional[asyncio.Task]) -> None:
+        if task is not None:
+            self._scopes.pop(task, None)
+
+    def reports(self) -> List[Dict[str, Any]]:
+        """Последние блокировки, новые первыми."""
+        return list(reversed(self._reports))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "debug": self.debug,
+            "last_lag_ms": round(self.last_lag * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "blocks": self.blocks,
+        }
+
+    def clear(self) -> None:
+        self._reports.clear()
+        self.max_lag = 0.0
+
+
+class LoopTaskMiddleware:
+    """ASGI middleware: связывает задачу запроса с его scope для отчётов о блокировках."""
+
+    def __init__(self, app: Any, monitor: Optional[LoopMonitor] = None):
+        self.app = app
+        self.monitor = monitor or loop_monitor
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if not self.monitor.debug or scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        task = self.monitor.track(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor.untrack(task)
+
+
+# Глобальный монитор event loop воркера
+loop_monitor = LoopMonitor(
+    interval=settings.loop_lag_interval_ms / 1000,
+    threshold=settings.loop_block_threshold_ms / 1000,
+    debug=settings.loop_block_debug,
+    max_reports=settings.loop_block_max,
+)
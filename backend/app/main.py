@@ -4,25 +4,29 @@ from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
 import json
-from datetime import datetime
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import desc
 
 from .config import settings
 from .db import Base, engine, get_db
 from .models import FraudCheck, BlacklistIP, User, AuditLog, MLModel, AnomalyDetection
 from .cache import geo_cache, bin_cache, device_cache
-from .logging_config import log_check_start, log_rule_result, log_check_complete
+from .logging_config import log_check_start, log_check_complete
 from .redis_client import redis_client
-from .auth import create_access_token, verify_token, USERS
+from .auth import create_access_token, verify_token, verify_password, USERS
 from .websocket_manager import websocket_manager
 from .rate_limiter_redis import redis_rate_limiter
 from .ml_anomaly import anomaly_detector
 from .analytics import analytics_engine
 from .models import User, AuditLog, MLModel, AnomalyDetection
-from fastapi import WebSocket, WebSocketDisconnect, Depends, HTTPException, status
+from fastapi import WebSocket, WebSocketDisconnect, Depends, HTTPException, Request, Response, status
+from fastapi.responses import PlainTextResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from passlib.context import CryptContext
 import asyncio
-from .schemas import CheckRequest, CheckResponse
+from .schemas import CheckRequest, CheckResponse, BatchCheckRequest, BatchCheckResponse, CheckSessionUpdate, CheckSessionResponse
 from pydantic import BaseModel
 
 class LoginRequest(BaseModel):
@@ -44,17 +48,27 @@ class MetricsResponse(BaseModel):
     suspicious_ips: list
     hourly_metrics: list
     rule_performance: dict
+    rule_memo: dict
 
 class BlacklistRequest(BaseModel):
     ip: str
-from .rules.geo import check_geo_and_bin
-from .rules.timezone import check_timezone_mismatch
-from .rules.email import check_email_reputation
-from .rules.velocity import check_velocity
-from .rules.bot import check_bot_activity
-from .rules.device import check_device
-from .rules.blacklist import check_blacklist_ip
-from .risk_score import aggregate_score_and_flags, recommendation_from_score
+from .rule_engine import rule_engine
+from .pipeline import score_check, prefetch_batch
+from .write_behind import persistence_writer
+from .ids import next_check_id
+from .streaming import NDJSONStreamResponse, iter_lines, score_ndjson
+from .idempotency import idempotency_cache, IdempotencyKeyConflict
+from .rule_dsl import dsl_rules, RuleDSLError
+from .profiles import PipelineProfile, is_valid_api_key, resolve_profile
+from .enrichment import enricher, score_provisional
+from .check_sessions import check_sessions
+from .trust import trust_index, observe_check, select_profile
+from .metrics import Stage, count_check, instrument_engine, mark_process_dead, render_metrics
+from .request_cost import RequestCostMiddleware
+from .profiler import ProfilerBusy, sampling_profiler, slow_checks
+from .loop_monitor import LoopTaskMiddleware, loop_monitor
+from .tracing import TracingMiddleware
+from .memory import memory_accounting, tracemalloc_diff
 from .rate_limiter import rate_limiter
 from fastapi import HTTPException, Header
 from typing import Optional
@@ -70,19 +84,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Server-Timing: SQL, Redis и исходящий HTTP каждого запроса
+app.add_middleware(RequestCostMiddleware)
+
+# Эндпоинт в отчётах о блокировках event loop (только при LOOP_BLOCK_DEBUG)
+app.add_middleware(LoopTaskMiddleware)
+
+# Трассы /api/check в локальный файл (TRACE_FILE, head-based sampling)
+app.add_middleware(TracingMiddleware)
+
 
 # Создание таблиц
 Base.metadata.create_all(bind=engine)
 
+# Время SQL-запросов в /metrics
+instrument_engine(engine)
+
 # Инициализация Redis
 @app.on_event("startup")
 async def startup_event():
+    loop_monitor.start()
     await redis_client.connect()
+    await persistence_writer.start()
+    dsl_rules.start_watching(settings.rules_reload_seconds)
+    # ID воркера арендуется при старте, а не на первой проверке
+    await asyncio.get_running_loop().run_in_executor(None, next_check_id)
+    # Индекс доверия - по истории проверок за окно, в фоне: старт её не ждёт
+    trust_index.start_rebuild(engine)
     print("Redis connected")
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    dsl_rules.stop_watching()
+    trust_index.stop_rebuild()
+    await enricher.drain()
+    await persistence_writer.stop()
     await redis_client.disconnect()
+    rule_engine.shutdown()
+    await loop_monitor.stop()
+    mark_process_dead()
     print("Redis disconnected")
 
 # JWT Security
@@ -99,8 +139,13 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         )
     return payload
 
+async def get_admin_user(current_user: dict = Depends(get_current_user)):
+    if current_user.get("role") != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin role required")
+    return current_user
+
 # Audit logging
-def log_audit_action(db: Session, user_id: int, action: str, resource_type: str = None, resource_id: str = None, details: dict = None, ip_address: str = None, user_agent: str = None):
+async def log_audit_action(db: Session, user_id: int, action: str, resource_type: str = None, resource_id: str = None, details: dict = None, ip_address: str = None, user_agent: str = None):
     audit_log = AuditLog(
         user_id=user_id,
         action=action,
@@ -110,8 +155,8 @@ def log_audit_action(db: Session, user_id: int, action: str, resource_type: str
         ip_address=ip_address,
         user_agent=user_agent
     )
-    db.add(audit_log)
-    db.commit()
+    # Через очередь writer'а: при переполнении ждём места в ней (backpressure)
+    await persistence_writer.submit(audit_log, bind=db.get_bind())
 
 
 # Сидирование blacklist IP из .env при старте
@@ -131,116 +176,211 @@ bin_cache.cleanup()
 device_cache.cleanup()
 
 
-@app.post("/api/check", response_model=CheckResponse)
-async def api_check(
-    payload: CheckRequest, 
-    db: Session = Depends(get_db),
-    x_api_key: Optional[str] = Header(None)
-) -> CheckResponse:
-    # Проверка API ключа
-    if x_api_key != settings.api_key:
+def check_profile(x_api_key: Optional[str], x_pipeline_profile: Optional[str]) -> PipelineProfile:
+    """Проверка API ключа и выбор профиля пайплайна (заголовок X-Pipeline-Profile или профиль ключа)."""
+    if not is_valid_api_key(x_api_key):
         raise HTTPException(status_code=401, detail="Invalid API key")
-    
+    profile = resolve_profile(x_api_key, x_pipeline_profile)
+    if profile is None:
+        raise HTTPException(status_code=400, detail=f"Unknown pipeline profile: {x_pipeline_profile}")
+    return profile
+
+
+async def run_check(payload: CheckRequest, db: Session, profile: PipelineProfile, deadline: Optional[float], results: Optional[Dict[str, Any]] = None) -> CheckResponse:
+    """Rate limiting, правила, запись и алерты одной проверки; results - предрасчитанные результаты правил."""
+    started = time.perf_counter()
     # Redis rate limiting
-    if not await redis_rate_limiter.is_allowed(f"ip:{payload.ip or 'unknown'}", settings.rate_limit_ip):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded for IP")
-    
-    if payload.email and not await redis_rate_limiter.is_allowed(f"email:{payload.email}", settings.rate_limit_email):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded for email")
+    with Stage("rate_limit"):
+        if not await redis_rate_limiter.is_allowed(f"ip:{payload.ip or 'unknown'}", settings.rate_limit_ip):
+            raise HTTPException(status_code=429, detail="Rate limit exceeded for IP")
+        
+        if payload.email and not await redis_rate_limiter.is_allowed(f"email:{payload.email}", settings.rate_limit_email):
+            raise HTTPException(status_code=429, detail="Rate limit exceeded for email")
     
     # Логируем начало проверки
     log_check_start(0, payload.email, payload.ip or "unknown")  # check_id будет обновлён после сохранения
     
-    # Запуск правил
-    geo_res = await check_geo_and_bin(payload.bin, payload.ip)
-    log_rule_result("geo", geo_res.score_delta, geo_res.fraud_flag, geo_res.details)
+    # Доверенный постоянный клиент - сокращённый набор правил
+    profile = select_profile(payload, profile)
+
+    # Запуск правил: независимые - конкурентно, DB-правила - в пуле потоков;
+    # двухфазный профиль отвечает по локальным правилам, остальное - в фоне
+    with Stage("rules"):
+        if profile.enrich_with:
+            scored = await score_provisional(payload, db, profile, deadline=deadline, results=results)
+        else:
+            scored = await score_check(payload, db, results, deadline=deadline, profile=profile)
+
+    observe_check(scored)
+    count_check(profile.name, scored.recommendation)
+
+    # ID сгенерирован приложением - ответ не ждёт записи в БД
+    check_id = scored.check_id
+    with Stage("persist_enqueue"):
+        for row in scored.rows():
+            await persistence_writer.submit(row, bind=db.get_bind())
+    if profile.enrich_with:
+        enricher.schedule(scored, db.get_bind())
     
-    timezone_res = check_timezone_mismatch(geo_res.details.get("ip_country") if geo_res.details else None, payload.timezone)
-    log_rule_result("timezone", timezone_res.score_delta, timezone_res.fraud_flag)
-    email_res = check_email_reputation(payload.email)
-    log_rule_result("email", email_res.score_delta, email_res.fraud_flag)
-    velocity_res = check_velocity(db, payload.email, payload.ip or "")
-    log_rule_result("velocity", velocity_res.score_delta, velocity_res.fraud_flag)
-    bot_res = check_bot_activity(payload.session_duration_ms, payload.mouse_moves_count, payload.first_click_delay_ms, payload.typing_speed_ms_avg)
-    log_rule_result("bot", bot_res.score_delta, bot_res.fraud_flag)
-    device_res = check_device(payload.device_info, payload.user_agent)
-    log_rule_result("device", device_res.score_delta, device_res.fraud_flag)
-    blacklist_res = check_blacklist_ip(db, payload.ip)
-    log_rule_result("blacklist", blacklist_res.score_delta, blacklist_res.fraud_flag)
-
-    parts = [
-        (geo_res.score_delta, geo_res.fraud_flag),
-        (timezone_res.score_delta, timezone_res.fraud_flag),
-        (email_res.score_delta, email_res.fraud_flag),
-        (velocity_res.score_delta, velocity_res.fraud_flag),
-        (bot_res.score_delta, bot_res.fraud_flag),
-        (device_res.score_delta, device_res.fraud_flag),
-        (blacklist_res.score_delta, blacklist_res.fraud_flag),
-    ]
+    # WebSocket broadcast для high-risk транзакций
+    if scored.needs_alert:
+        await websocket_manager.broadcast_fraud_alert(scored.alert())
+    
+    # Логируем завершение проверки
+    log_check_complete(check_id, scored.score, scored.flags, scored.recommendation)
+    slow_checks.observe(scored, (time.perf_counter() - started) * 1000)
 
-    score, flags = aggregate_score_and_flags(parts)
-    rec = recommendation_from_score(score)
-
-    # Сохраняем лог
-    log = FraudCheck(
-        email=payload.email,
-        ip=payload.ip or "",
-        bin=(payload.bin or "")[:16],
-        user_agent=payload.user_agent or "",
-        ip_country=geo_res.details.get("ip_country") if geo_res.details else None,
-        bin_country=geo_res.details.get("bin_country") if geo_res.details else None,
-        timezone=payload.timezone,
-        language=payload.language,
-        session_duration_ms=payload.session_duration_ms,
-        typing_speed_ms_avg=payload.typing_speed_ms_avg,
-        mouse_moves_count=payload.mouse_moves_count,
-        first_click_delay_ms=payload.first_click_delay_ms,
-        device_info=json.dumps(payload.device_info or {}),
-        risk_score=score,
-        fraud_flags=json.dumps(flags),
-    )
-    db.add(log)
-    db.commit()
-    db.refresh(log)
-
-    # ML Anomaly Detection
-    check_data = {
-        "typing_speed_ms_avg": payload.typing_speed_ms_avg,
-        "session_duration_ms": payload.session_duration_ms,
-        "mouse_moves_count": payload.mouse_moves_count,
-        "first_click_delay_ms": payload.first_click_delay_ms,
-        "device_fingerprint_frequency": 1  # TODO: Get from cache
-    }
+    return scored.response()
+
+
+@app.post("/api/check", response_model=CheckResponse)
+async def api_check(
+    payload: CheckRequest, 
+    response: Response,
+    db: Session = Depends(get_db),
+    x_api_key: Optional[str] = Header(None),
+    x_pipeline_profile: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
+) -> CheckResponse:
+    # Дедлайн отсчитывается от начала запроса
+    deadline = asyncio.get_running_loop().time() + settings.check_deadline_ms / 1000 if settings.check_deadline_ms else None
     
-    anomaly_score, is_anomaly, anomaly_type = anomaly_detector.detect_anomalies(check_data)
+    # Проверка API ключа и профиль пайплайна
+    profile = check_profile(x_api_key, x_pipeline_profile)
+
+    # Повтор той же проверки в пределах окна - исходный ответ без правил, записи и velocity
+    try:
+        result, replayed = await idempotency_cache.get_or_compute(
+            payload, idempotency_key, lambda: run_check(payload, db, profile, deadline), scope=profile.name, api_key=x_api_key
+        )
+    except IdempotencyKeyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key reused with a different request body")
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+@app.post("/api/check/session", response_model=CheckSessionResponse)
+async def api_check_session_start(
+    payload: CheckSessionUpdate,
+    db: Session = Depends(get_db),
+    x_api_key: Optional[str] = Header(None)
+) -> CheckSessionResponse:
+    """Начало чекаута: lookup'ы по уже известным полям (обычно ip) стартуют сразу."""
+    if not is_valid_api_key(x_api_key):
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    session = check_sessions.start()
+    started = check_sessions.update(session, payload.model_dump(exclude_none=True), db.get_bind())
+    return CheckSessionResponse(session_id=session.session_id, expires_in=check_sessions.ttl, started=started)
+
+
+@app.patch("/api/check/session/{session_id}", response_model=CheckSessionResponse)
+async def api_check_session_update(
+    session_id: str,
+    payload: CheckSessionUpdate,
+    db: Session = Depends(get_db),
+    x_api_key: Optional[str] = Header(None)
+) -> CheckSessionResponse:
+    """Заполнено поле формы (email, карта) - запускаем lookup'ы, входы которых стали известны."""
+    if not is_valid_api_key(x_api_key):
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    session = check_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Check session not found or expired")
+    started = check_sessions.update(session, payload.model_dump(exclude_none=True), db.get_bind())
+    return CheckSessionResponse(session_id=session.session_id, expires_in=check_sessions.ttl, started=started)
+
+
+@app.post("/api/check/session/{session_id}/finalize", response_model=CheckResponse)
+async def api_check_session_finalize(
+    session_id: str,
+    payload: CheckRequest,
+    response: Response,
+    db: Session = Depends(get_db),
+    x_api_key: Optional[str] = Header(None),
+    x_pipeline_profile: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
+) -> CheckResponse:
+    """Submit: обычная проверка, но с результатами, посчитанными во время заполнения формы.
+    Нет сессии (истекла, другой воркер) - всё считается как в /api/check."""
+    deadline = asyncio.get_running_loop().time() + settings.check_deadline_ms / 1000 if settings.check_deadline_ms else None
+    profile = check_profile(x_api_key, x_pipeline_profile)
+
+    async def finalize_check() -> CheckResponse:
+        results = await check_sessions.finalize(session_id, payload, deadline)
+        return await run_check(payload, db, profile, deadline, results)
+
+    # Повторный submit (ретрай клиента) - исходный ответ, как в /api/check
+    try:
+        result, replayed = await idempotency_cache.get_or_compute(payload, idempotency_key, finalize_check, scope=profile.name, api_key=x_api_key)
+    except IdempotencyKeyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key reused with a different request body")
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+@app.post("/api/check/batch", response_model=BatchCheckResponse)
+async def api_check_batch(
+    payload: BatchCheckRequest,
+    db: Session = Depends(get_db),
+    x_api_key: Optional[str] = Header(None),
+    x_pipeline_profile: Optional[str] = Header(None)
+) -> BatchCheckResponse:
+    # Batch - офлайн: сразу окончательный профиль, без двухфазности
+    profile = check_profile(x_api_key, x_pipeline_profile).final
     
-    # Сохраняем anomaly detection результат
-    anomaly_record = AnomalyDetection(
-        check_id=log.id,
-        anomaly_score=anomaly_score,
-        anomaly_type=anomaly_type,
-        features=check_data,
-        is_anomaly=1 if is_anomaly else 0
-    )
-    db.add(anomaly_record)
-    db.commit()
+    checks = payload.checks
+    if len(checks) > settings.batch_max_size:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {settings.batch_max_size})")
     
-    # WebSocket broadcast для high-risk транзакций
-    if score >= settings.threshold_review:
-        await websocket_manager.broadcast_fraud_alert({
-            "check_id": log.id,
-            "email": payload.email,
-            "ip": payload.ip,
-            "risk_score": score,
-            "fraud_flags": flags,
-            "recommendation": rec,
-            "anomaly_score": anomaly_score
-        })
+    # Rate limiting всех ключей батча за один round trip
+    ip_hits = Counter(f"ip:{c.ip or 'unknown'}" for c in checks)
+    email_hits = Counter(f"email:{c.email}" for c in checks if c.email)
+    hits = {key: (settings.rate_limit_ip, count) for key, count in ip_hits.items()}
+    hits.update({key: (settings.rate_limit_email, count) for key, count in email_hits.items()})
+    denied = [key for key, allowed in (await redis_rate_limiter.is_allowed_many(hits)).items() if not allowed]
+    if denied:
+        raise HTTPException(status_code=429, detail=f"Rate limit exceeded for {', '.join(denied)}")
     
-    # Логируем завершение проверки
-    log_check_complete(log.id, score, flags, rec)
+    # Общие lookup'ы батча, затем локальные правила по каждому элементу
+    with Stage("batch_prefetch"):
+        prefetched = await prefetch_batch(checks, db, profile)
+    with Stage("batch_rules"):
+        scored_checks = await asyncio.gather(*(score_check(c, db, seeded, profile=profile) for c, seeded in zip(checks, prefetched)))
+    
+    # ID уже известны - строки уходят в write-behind, коммит не блокирует event loop
+    with Stage("batch_persist_enqueue"):
+        bind = db.get_bind()
+        for scored in scored_checks:
+            for row in scored.rows():
+                await persistence_writer.submit(row, bind=bind)
+    
+    for scored in scored_checks:
+        observe_check(scored)
+        count_check(profile.name, scored.recommendation)
+        if scored.needs_alert:
+            await websocket_manager.broadcast_fraud_alert(scored.alert())
+        log_check_complete(scored.check_id, scored.score, scored.flags, scored.recommendation)
+    
+    return BatchCheckResponse(results=[scored.response() for scored in scored_checks])
 
-    return CheckResponse(risk_score=score, fraud_flags=flags, recommendation=rec, check_id=log.id)
+
+@app.post("/api/check/stream")
+async def api_check_stream(
+    request: Request,
+    db: Session = Depends(get_db),
+    x_api_key: Optional[str] = Header(None),
+    x_pipeline_profile: Optional[str] = Header(None),
+    persist: bool = True
+) -> NDJSONStreamResponse:
+    """NDJSON CheckRequest -> NDJSON CheckResponse (+ номер строки) по мере готовности.
+    ?persist=false - перескоринг прошлых броней без записи (не влияет на velocity)."""
+    profile = check_profile(x_api_key, x_pipeline_profile).final
+    
+    # Сессия зависимости закрывается раньше, чем закончится стрим - берём только bind
+    lines = iter_lines(request.stream())
+    return NDJSONStreamResponse(score_ndjson(lines, db.get_bind(), profile=profile, persist=persist))
 
 
 @app.post("/api/blacklist")
@@ -261,6 +401,7 @@ def add_to_blacklist(
     blacklist_entry = BlacklistIP(ip=payload.ip)
     db.add(blacklist_entry)
     db.commit()
+    trust_index.invalidate_ip(payload.ip)
     
     return {"message": "IP added to blacklist", "ip": payload.ip}
 
@@ -292,6 +433,7 @@ def remove_from_blacklist(
     
     db.delete(ip_entry)
     db.commit()
+    trust_index.invalidate_ip(ip_entry.ip)
     
     return {"message": "IP removed from blacklist"}
 
@@ -320,11 +462,14 @@ async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
 async def websocket_endpoint(websocket: WebSocket, token: str = None):
     await websocket_manager.connect(websocket, token)
     try:
-        while True:
-            # Keep connection alive
+        # Keep connection alive; ошибка отправки уже отключила клиента
+        while websocket in websocket_manager.connection_metadata:
             await asyncio.sleep(30)
             await websocket_manager.send_personal_message({"type": "ping"}, websocket)
     except WebSocketDisconnect:
+        pass
+    finally:
+        # И при отмене задачи (shutdown), и при любой другой ошибке
         websocket_manager.disconnect(websocket)
 
 
@@ -381,7 +526,8 @@ async def get_enhanced_metrics(db: Session = Depends(get_db), current_user: dict
         top_fraud_flags=top_fraud_flags,
         suspicious_ips=suspicious_ips,
         hourly_metrics=hourly_metrics,
-        rule_performance=rule_performance
+        rule_performance=rule_performance,
+        rule_memo=rule_engine.memo_stats(),
     )
 
 
@@ -426,6 +572,65 @@ async def retrain_model(db: Session = Depends(get_db), current_user: dict = Depe
     return {"message": "Model retrained successfully", "baseline": baseline}
 
 
+@app.post("/api/rules/reload")
+async def reload_rules(db: Session = Depends(get_db), current_user: dict = Depends(get_admin_user)):
+    # Идущие проверки дорабатывают на своей версии правил
+    try:
+        reloaded = dsl_rules.reload(force=True)
+    except (OSError, RuleDSLError) as e:
+        raise HTTPException(status_code=422, detail=f"Rules not reloaded: {e}")
+    await log_audit_action(db, 0, "rules_reload", "rules", dsl_rules.current.version, details={"username": current_user.get("sub")})
+    return {"reloaded": reloaded, "version": dsl_rules.current.version}
+
+
+@app.post("/api/admin/profile", response_class=PlainTextResponse)
+async def profile_process(seconds: float = 10, interval_ms: float = 5, current_user: dict = Depends(get_admin_user)):
+    """Сэмплирует стеки всех потоков воркера seconds секунд; ответ - collapsed stacks для flamegraph."""
+    if not 0 < seconds <= 120 or not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=422, detail="seconds must be in (0, 120], interval_ms in [1, 1000]")
+    try:
+        sampling_profiler.start(interval_ms / 1000)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        collapsed = sampling_profiler.stop()
+    return PlainTextResponse(collapsed, headers={"X-Profile-Samples": str(sampling_profiler.samples)})
+
+
+@app.get("/api/admin/slow-checks")
+async def get_slow_checks(current_user: dict = Depends(get_admin_user)):
+    """Медленные /api/check этого воркера: время по правилам, стоимость, форма payload."""
+    return {"threshold_ms": slow_checks.threshold_ms, "checks": slow_checks.entries()}
+
+
+@app.get("/api/admin/loop-blocks")
+async def get_loop_blocks(current_user: dict = Depends(get_admin_user)):
+    """Задержка event loop воркера и блокировки дольше порога: кадр, эндпоинт, стек."""
+    return {**loop_monitor.stats(), "reports": loop_monitor.reports()}
+
+
+@app.get("/api/admin/memory")
+async def get_memory(current_user: dict = Depends(get_admin_user)):
+    """Приблизительная память долгоживущих структур воркера и её прирост с прошлого вызова."""
+    return memory_accounting.report(engine)
+
+
+@app.post("/api/admin/memory/snapshot")
+def take_memory_snapshot(top: int = 20, frames: int = 1, current_user: dict = Depends(get_admin_user)):
+    """Снимок tracemalloc: первый включает трассировку, следующие - top-N прироста с прошлого снимка."""
+    if not 1 <= top <= 200 or not 1 <= frames <= 50:
+        raise HTTPException(status_code=422, detail="top must be in [1, 200], frames in [1, 50]")
+    return tracemalloc_diff.snapshot(top, frames)
+
+
+@app.delete("/api/admin/memory/snapshot")
+def stop_memory_snapshots(current_user: dict = Depends(get_admin_user)):
+    """Выключает tracemalloc после снимков."""
+    return tracemalloc_diff.stop()
+
+
 # Audit log endpoint
 @app.get("/api/audit-logs")
 async def get_audit_logs(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
@@ -453,22 +658,9 @@ def health_check():
 
 @app.get("/metrics")
 def get_metrics():
-    # Простые метрики
-    with next(get_db()) as db:
-        total_checks = db.query(FraudCheck).count()
-        high_risk = db.query(FraudCheck).filter(FraudCheck.risk_score >= settings.threshold_review).count()
-        blacklisted_ips = db.query(BlacklistIP).count()
-    
-    return {
-        "total_checks": total_checks,
-        "high_risk_checks": high_risk,
-        "blacklisted_ips": blacklisted_ips,
-        "cache_size": {
-            "geo": len(geo_cache._cache),
-            "bin": len(bin_cache._cache),
-            "device": len(device_cache._cache)
-        }
-    }
+    """Prometheus: латентность правил/стадий, флаги, кэши, SQL, Redis (сумма по воркерам)."""
+    body, content_type = render_metrics(engine)
+    return Response(content=body, media_type=content_type)
 
 
 @app.get("/api/checks")
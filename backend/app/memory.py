@@ -0,0 +1,235 @@
+"""
+Учёт памяти долгоживущих структур воркера.
+
+approx_size - приблизительный размер объекта вместе с содержимым: sys.getsizeof
+контейнера, ключей, значений и атрибутов объектов. У больших контейнеров
+меряется равномерная выборка записей и масштабируется на все - отчёт по кэшам
+на 100k записей считается за миллисекунды в потоке event loop (структуры
+меняются только в нём, обход из другого потока ломал бы итерацию).
+
+MemoryAccounting - отчёт по структурам (записи, байты, прирост байт в час с
+предыдущего отчёта), сессиям SQLAlchemy (identity map) и пулу соединений.
+TracemallocDiff - снимки tracemalloc по запросу: первый включает трассировку,
+каждый следующий возвращает top-N строк кода по приросту с предыдущего.
+"""
+from __future__ import annotations
+from collections import deque
+from itertools import islice
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import Any, Dict, List, Optional, Set
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import session as orm_session
+
+# Записей контейнера, которые меряются напрямую; остальное - масштабированием
+SAMPLE_ENTRIES = 200
+
+# Общие объекты (модули, классы, функции) не принадлежат ни одной структуре
+SHARED_TYPES = (ModuleType, type, FunctionType, BuiltinFunctionType, MethodType, weakref.ref)
+
+
+def _sample(items: Any, size: int, sample: int) -> List[Any]:
+    if size <= sample:
+        return list(items)
+    return list(islice(items, 0, None, size // sample))[:sample]
+
+
+def _slot_names(cls: type) -> tuple:
+    slots = cls.__dict__.get("__slots__", ())
+    return (slots,) if isinstance(slots, str) else tuple(slots)
+
+
+def approx_size(obj: Any, depth: int = 6, sample: int = SAMPLE_ENTRIES, _seen: Optional[Set[int]] = None) -> int:
+    """Приблизительный размер obj с содержимым до глубины depth, байты."""
+    seen = set() if _seen is None else _seen
+    if id(obj) in seen or isinstance(obj, SHARED_TYPES):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if depth <= 0 or isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+        return size
+
+    if isinstance(obj, dict):
+        count = len(obj)
+        picked = _sample(obj.items(), count, sample)
+        children = sum(approx_size(key, depth - 1, sample, seen) + approx_size(value, depth - 1, sample, seen) for key, value in picked)
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        count = len(obj)
+        picked = _sample(obj, count, sample)
+        children = sum(approx_size(item, depth - 1, sample, seen) for item in picked)
+    else:
+        attrs = getattr(obj, "__dict__", None)
+        if attrs is not None:
+            return size + approx_size(attrs, depth - 1, sample, seen)
+        slots = [name for cls in type(obj).__mro__ for name in _slot_names(cls)]
+        return size + sum(approx_size(getattr(obj, name, None), depth - 1, sample, seen) for name in slots if name not in ("__weakref__", "__dict__"))
+
+    if picked and count > len(picked):
+        children = children * count // len(picked)
+    return size + children
+
+
+def _entries(container: Any) -> Optional[int]:
+    return len(container) if hasattr(container, "__len__") else None
+
+
+def long_lived_structures() -> Dict[str, Any]:
+    """Имя -> (контейнер, глубина обхода, число записей) для долгоживущего состояния воркера."""
+    from .cache import bin_cache, device_cache, geo_cache
+    from .check_sessions import check_sessions
+    from .enrichment import enricher
+    from .idempotency import idempotency_cache
+    from .loop_monitor import loop_monitor
+    from .metrics import _children
+    from .ml_anomaly import anomaly_detector
+    from .profiler import slow_checks
+    from .rate_limiter import rate_limiter
+    from .rule_engine import rule_engine
+    from .rules.velocity import recent_attempts
+    from .trust import trust_index
+    from .websocket_manager import websocket_manager
+    memos = {rule.name: rule.memo._entries for rule in rule_engine.rules if rule.memo is not None}
+    structures = {
+        "geo_cache": (geo_cache._cache, 6),
+        "bin_cache": (bin_cache._cache, 6),
+        "device_cache": (device_cache._cache, 6),
+        "idempotency_cache": (idempotency_cache._local._cache, 8),
+        "idempotency_inflight": (idempotency_cache._inflight, 1),
+        "rate_limiter": (rate_limiter._requests, 4),
+        "velocity": (recent_attempts._hits, 4),
+        "trust_index": (trust_index._entries, 4),
+        "check_sessions": (check_sessions._sessions, 6),
+        "enrichment_tasks": (enricher._tasks, 1),
+        "rule_memo": (memos, 6),
+        # Соединение держит scope всего приложения - только сами объекты
+        "websocket_connections": (websocket_manager.active_connections, 1),
+        "websocket_metadata": (websocket_manager.connection_metadata, 3),
+        "anomaly_detector": (anomaly_detector, 6),
+        "slow_checks": (slow_checks._entries, 8),
+        "loop_block_reports": (loop_monitor._reports, 4),
+        "metric_series": (_children, 1),
+    }
+    entries = {"rule_memo": sum(len(memo) for memo in memos.values())}
+    return {name: (container, depth, entries.get(name, _entries(container))) for name, (container, depth) in structures.items()}
+
+
+def entry_counts() -> Dict[str, int]:
+    """Число записей в каждой долгоживущей структуре (без обхода содержимого)."""
+    return {name: entries for name, (_, _, entries) in long_lived_structures().items() if entries is not None}
+
+
+def sqlalchemy_state(bind: Optional[Engine] = None) -> Dict[str, Any]:
+    """Живые сессии и их identity map; пул соединений движка."""
+    sessions = list(orm_session._sessions.values())
+    objects = 0
+    size = 0
+    seen: Set[int] = set()
+    for db in sessions:
+        try:
+            instances = list(db.identity_map.values())
+        except RuntimeError:
+            # Сессия из пула потоков меняется прямо сейчас - её объекты не считаем
+            continue
+        objects += len(instances)
+        for instance in _sample(instances, len(instances), SAMPLE_ENTRIES):
+            state = sa_inspect(instance)
+            part = sys.getsizeof(instance) + sys.getsizeof(state) + approx_size(state.dict, 2, _seen=seen)
+            size += part * len(instances) // min(len(instances), SAMPLE_ENTRIES)
+    report: Dict[str, Any] = {"sessions": len(sessions), "identity_map_objects": objects, "identity_map_bytes": size}
+    if bind is not None:
+        pool = bind.pool
+        report["pool"] = {
+            "class": type(pool).__name__,
+            "status": pool.status(),
+            **{name: getattr(pool, name)() for name in ("size", "checkedin", "checkedout", "overflow") if hasattr(pool, name)},
+        }
+    return report
+
+
+class MemoryAccounting:
+    def __init__(self):
+        self._previous: Optional[Dict[str, Any]] = None
+
+    def report(self, bind: Optional[Engine] = None) -> Dict[str, Any]:
+        """Записи и байты по структурам; прирост в час - с предыдущего отчёта."""
+        started = time.perf_counter()
+        now = time.monotonic()
+        structures: Dict[str, Dict[str, Any]] = {}
+        for name, (container, depth, entries) in long_lived_structures().items():
+            structures[name] = {"entries": entries, "bytes": approx_size(container, depth)}
+        sqlalchemy = sqlalchemy_state(bind)
+        structures["sqlalchemy_identity_map"] = {"entries": sqlalchemy["identity_map_objects"], "bytes": sqlalchemy["identity_map_bytes"]}
+
+        previous = self._previous
+        if previous is not None and now > previous["at"]:
+            hours = (now - previous["at"]) / 3600
+            for name, row in structures.items():
+                if name in previous["bytes"]:
+                    row["growth_bytes_per_hour"] = round((row["bytes"] - previous["bytes"][name]) / hours)
+        self._previous = {"at": now, "bytes": {name: row["bytes"] for name, row in structures.items()}}
+        return {
+            "total_bytes": sum(row["bytes"] for row in structures.values()),
+            "since_previous_seconds": round(now - previous["at"], 1) if previous else None,
+            "structures": structures,
+            "sqlalchemy": sqlalchemy,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+
+
+class TracemallocDiff:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last: Optional[tracemalloc.Snapshot] = None
+        self._started_here = False
+
+    @staticmethod
+    def _take() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def snapshot(self, top: int = 20, frames: int = 1) -> Dict[str, Any]:
+        """Первый вызов включает tracemalloc и снимает базу; следующие - top-N прироста с прошлого снимка."""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self._started_here = True
+                self._last = None
+            current = self._take()
+            previous, self._last = self._last, current
+            traced, peak = tracemalloc.get_traced_memory()
+            report: Dict[str, Any] = {"tracing": True, "traced_bytes": traced, "peak_bytes": peak, "diff": []}
+            if previous is None:
+                report["baseline"] = True
+                return report
+            key_type = "traceback" if frames > 1 else "lineno"
+            for stat in current.compare_to(previous, key_type)[:top]:
+                report["diff"].append({
+                    "where": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                    "size_diff_bytes": stat.size_diff,
+                    "size_bytes": stat.size,
+                    "count_diff": stat.count_diff,
+                    "count": stat.count,
+                })
+            return report
+
+    def stop(self) -> Dict[str, Any]:
+        """Выключает трассировку, включённую снимками (у tracemalloc заметный оверхед)."""
+        with self._lock:
+            self._last = None
+            if self._started_here and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            self._started_here = False
+            return {"tracing": tracemalloc.is_tracing()}
+
+
+# Глобальный учёт памяти и снимки tracemalloc воркера
+memory_accounting = MemoryAccounting()
+tracemalloc_diff = TracemallocDiff()
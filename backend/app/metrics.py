@@ -0,0 +1,181 @@
+"""
+Prometheus-метрики: латентность правил и стадий проверки, срабатывания флагов,
+кэши, SQL, Redis, исходящий HTTP и задержка event loop. Отдаются текстом
+на /metrics; те же замеры SQL/Redis/HTTP учитываются в стоимости запроса
+(request_cost).
+
+Несколько воркеров uvicorn: задайте PROMETHEUS_MULTIPROC_DIR (пустой каталог,
+очищается перед стартом) - каждый воркер пишет свои значения в mmap-файлы,
+/metrics любого воркера суммирует все. Без переменной - метрики процесса.
+"""
+from __future__ import annotations
+from typing import Any, Dict, Optional, Tuple
+import os
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from .config import settings
+from .models import BlacklistIP, FraudCheck
+from .request_cost import record_http, record_redis, record_sql
+from .tracing import tracer
+
+# Фиксированные бакеты, с: от локальных правил (100 мкс) до внешних lookup'ов (секунды)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+RULE_DURATION = Histogram("antifraud_rule_duration_seconds", "Время выполнения правила", ["rule"], buckets=LATENCY_BUCKETS)
+STAGE_DURATION = Histogram("antifraud_stage_duration_seconds", "Время стадии проверки", ["stage"], buckets=LATENCY_BUCKETS)
+RULE_HITS = Counter("antifraud_rule_hits_total", "Срабатывания правил по флагам", ["rule", "flag"])
+CACHE_REQUESTS = Counter("antifraud_cache_requests_total", "Обращения к кэшам", ["cache", "result"])
+DB_DURATION = Histogram("antifraud_db_statement_duration_seconds", "Время SQL-запроса", ["operation", "status"], buckets=LATENCY_BUCKETS)
+REDIS_DURATION = Histogram("antifraud_redis_call_duration_seconds", "Время round trip к Redis", ["command"], buckets=LATENCY_BUCKETS)
+HTTP_CLIENT_DURATION = Histogram("antifraud_http_client_duration_seconds", "Время исходящего HTTP-вызова", ["target"], buckets=LATENCY_BUCKETS)
+CHECKS = Counter("antifraud_checks_total", "Проверки по профилю и рекомендации", ["profile", "recommendation"])
+# Задержка event loop - своя у каждого воркера (в multiprocess-режиме метка pid)
+LOOP_LAG = Gauge("antifraud_event_loop_lag_seconds", "Последняя задержка event loop", multiprocess_mode="liveall")
+LOOP_LAG_DURATION = Histogram("antifraud_event_loop_lag_duration_seconds", "Задержка event loop", buckets=LATENCY_BUCKETS)
+LOOP_BLOCKS = Counter("antifraud_event_loop_blocks_total", "Блокировки event loop дольше порога", ["endpoint"])
+
+# Дочерние серии по меткам: labels() берёт блокировку, на горячем пути - словарь
+_children: Dict[Tuple[Any, Tuple[str, ...]], Any] = {}
+
+
+def _child(metric: Any, *labels: str) -> Any:
+    key = (metric, labels)
+    child = _children.get(key)
+    if child is None:
+        child = _children[key] = metric.labels(*labels)
+    return child
+
+
+def observe_rule(rule: str, seconds: float) -> None:
+    _child(RULE_DURATION, rule).observe(seconds)
+
+
+def count_rule_hit(rule: str, flag: str) -> None:
+    _child(RULE_HITS, rule, flag).inc()
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    _child(STAGE_DURATION, stage).observe(seconds)
+
+
+def count_cache(cache: str, hit: bool) -> None:
+    _child(CACHE_REQUESTS, cache, "hit" if hit else "miss").inc()
+
+
+def observe_redis(command: str, seconds: float) -> None:
+    _child(REDIS_DURATION, command).observe(seconds)
+    record_redis(seconds)
+    tracer.record(f"redis {command}", seconds, kind="CLIENT", remote="redis")
+
+
+def observe_http(target: str, seconds: float) -> None:
+    _child(HTTP_CLIENT_DURATION, target).observe(seconds)
+    record_http(seconds)
+
+
+def count_check(profile: str, recommendation: str) -> None:
+    _child(CHECKS, profile, recommendation).inc()
+
+
+def observe_loop_lag(seconds: float) -> None:
+    LOOP_LAG.set(seconds)
+    LOOP_LAG_DURATION.observe(seconds)
+
+
+def count_loop_block(endpoint: str) -> None:
+    _child(LOOP_BLOCKS, endpoint).inc()
+
+
+class Stage:
+    """with Stage("rules"): ... - время блока в antifraud_stage_duration_seconds (и спан трассы)."""
+
+    __slots__ = ("name", "started", "span")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "Stage":
+        self.span = tracer.span(f"stage {self.name}").__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        observe_stage(self.name, time.perf_counter() - self.started)
+        self.span.__exit__(*exc)
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Время каждого SQL-запроса движка по типу операции (SELECT, INSERT, ...) и исходу (ok/error)."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        _observe_statement(engine, statement, time.perf_counter() - conn.info["query_started"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # Упавший запрос: after_cursor_execute не вызывается - иначе метка времени
+        # осталась бы в conn.info и сдвинула стек следующих запросов соединения
+        conn = context.connection
+        started = conn.info.get("query_started") if conn is not None else None
+        if started:
+            _observe_statement(engine, context.statement, time.perf_counter() - started.pop(), context.original_exception)
+
+
+def _observe_statement(engine: Engine, statement: Optional[str], elapsed: float, error: Optional[BaseException] = None) -> None:
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement else "UNKNOWN"
+    _child(DB_DURATION, operation, "ok" if error is None else "error").observe(elapsed)
+    record_sql(elapsed)
+    tags = {"db.statement": statement}
+    if error is not None:
+        tags["error"] = type(error).__name__
+    tracer.record(f"sql {operation}", elapsed, kind="CLIENT", remote=engine.dialect.name, **tags)
+
+
+class DatabaseCollector:
+    """Счётчики строк из БД на момент scrape - общие для всех воркеров, не суммируются."""
+
+    def __init__(self, bind: Engine):
+        self.bind = bind
+
+    def collect(self):
+        with Session(bind=self.bind) as db:
+            total = db.query(FraudCheck).count()
+            high_risk = db.query(FraudCheck).filter(FraudCheck.risk_score >= settings.threshold_review).count()
+            blacklisted = db.query(BlacklistIP).count()
+        yield GaugeMetricFamily("antifraud_stored_checks", "Проверок в БД", value=total)
+        yield GaugeMetricFamily("antifraud_stored_high_risk_checks", "Проверок в БД со score >= threshold_review", value=high_risk)
+        yield GaugeMetricFamily("antifraud_blacklisted_ips", "IP в blacklist", value=blacklisted)
+
+
+class _ProcessCollector:
+    """Метрики этого процесса (REGISTRY) как коллектор реестра ответа."""
+
+    def collect(self):
+        return REGISTRY.collect()
+
+
+def render_metrics(bind: Engine) -> Tuple[bytes, str]:
+    """Тело и Content-Type ответа /metrics."""
+    registry = CollectorRegistry()
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        # Сумма по mmap-файлам всех воркеров
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry.register(_ProcessCollector())
+    registry.register(DatabaseCollector(bind))
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    """Остановка воркера в multiprocess-режиме."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
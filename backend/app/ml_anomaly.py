@@ -7,15 +7,16 @@ import numpy as np
 import json
 import hashlib
 from datetime import datetime, timedelta
-from ..cache import device_cache
-from ..config import settings
-from pydantic import BaseModel
+from .cache import device_cache
+from .config import settings
+from .rules.result import (
+    RuleResult, FLAG_ML_HIGH_RISK, FLAG_ML_MEDIUM_RISK, FLAG_ML_LOW_RISK,
+    FLAG_BEHAVIORAL_HIGH_RISK, FLAG_BEHAVIORAL_MEDIUM_RISK, FLAG_BEHAVIORAL_LOW_RISK,
+)
 
 
-class MLAnomalyResult(BaseModel):
-    score_delta: int
-    fraud_flag: Optional[str] = None
-    details: Dict[str, Any] | None = None
+# Совместимость: ML-анализаторы возвращают общий RuleResult
+MLAnomalyResult = RuleResult
 
 
 class AnomalyDetector:
@@ -151,7 +152,7 @@ class AnomalyDetector:
         return min(base_score, 100)  # Ограничиваем максимальным score
 
 
-def check_ml_anomalies(data: Dict[str, Any]) -> MLAnomalyResult:
+def check_ml_anomalies(data: Dict[str, Any]) -> RuleResult:
     """Основная функция для проверки ML аномалий"""
     detector = AnomalyDetector()
     
@@ -167,11 +168,11 @@ def check_ml_anomalies(data: Dict[str, Any]) -> MLAnomalyResult:
     # Определяем fraud flag
     fraud_flag = None
     if ml_score > 70:
-        fraud_flag = "ml_high_risk"
+        fraud_flag = FLAG_ML_HIGH_RISK
     elif ml_score > 40:
-        fraud_flag = "ml_medium_risk"
+        fraud_flag = FLAG_ML_MEDIUM_RISK
     elif ml_score > 20:
-        fraud_flag = "ml_low_risk"
+        fraud_flag = FLAG_ML_LOW_RISK
     
     # Подготавливаем детали
     details = {
@@ -188,7 +189,7 @@ def check_ml_anomalies(data: Dict[str, Any]) -> MLAnomalyResult:
         'feature_weights': detector.feature_weights
     }
     
-    return MLAnomalyResult(
+    return RuleResult(
         score_delta=ml_score,
         fraud_flag=fraud_flag,
         details=details
@@ -262,7 +263,7 @@ class BehavioralAnalyzer:
         return analysis
 
 
-def analyze_behavioral_patterns(data: Dict[str, Any]) -> MLAnomalyResult:
+def analyze_behavioral_patterns(data: Dict[str, Any]) -> RuleResult:
     """Анализирует поведенческие паттерны пользователя"""
     analyzer = BehavioralAnalyzer()
     analysis = analyzer.analyze_behavior(data)
@@ -288,17 +289,20 @@ def analyze_behavioral_patterns(data: Dict[str, Any]) -> MLAnomalyResult:
     # Определяем fraud flag
     fraud_flag = None
     if final_score > 60:
-        fraud_flag = "behavioral_high_risk"
+        fraud_flag = FLAG_BEHAVIORAL_HIGH_RISK
     elif final_score > 30:
-        fraud_flag = "behavioral_medium_risk"
+        fraud_flag = FLAG_BEHAVIORAL_MEDIUM_RISK
     elif final_score > 15:
-        fraud_flag = "behavioral_low_risk"
+        fraud_flag = FLAG_BEHAVIORAL_LOW_RISK
     
-    return MLAnomalyResult(
+    return RuleResult(
         score_delta=final_score,
         fraud_flag=fraud_flag,
         details={
             'behavioral_analysis': analysis,
             'final_score': final_score
         }
-    )
\ No newline at end of file
+    )
+
+# Глобальный детектор аномалий
+anomaly_detector = AnomalyDetector()
@@ -1,14 +1,19 @@
 from __future__ import annotations
-from sqlalchemy import Column, Integer, String, DateTime, Text, Index, Float
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Text, Index, Float
 from sqlalchemy.dialects.sqlite import JSON
 from sqlalchemy.sql import func
 from .db import Base
+from .ids import next_check_id
+
+# 64-битный ID; в SQLite - INTEGER (алиас rowid)
+CheckId = BigInteger().with_variant(Integer, "sqlite")
 
 
 class FraudCheck(Base):
     __tablename__ = "fraud_checks"
 
-    id = Column(Integer, primary_key=True, index=True)
+    # Snowflake ID генерируется приложением - известен до записи в БД
+    id = Column(CheckId, primary_key=True, index=True, autoincrement=False, default=next_check_id)
     email = Column(String(255), index=True, nullable=False)
     ip = Column(String(64), index=True, nullable=False)
     bin = Column(String(16), index=True, nullable=True)
@@ -99,7 +104,7 @@ class AnomalyDetection(Base):
     __tablename__ = "anomaly_detections"
 
     id = Column(Integer, primary_key=True, index=True)
-    check_id = Column(Integer, nullable=False, index=True)
+    check_id = Column(CheckId, nullable=False, index=True)
     anomaly_score = Column(Float, nullable=False)
     anomaly_type = Column(String(50), nullable=False)
     features = Column(JSON, nullable=True)
@@ -110,3 +115,12 @@ class AnomalyDetection(Base):
         Index('idx_check_anomaly', 'check_id', 'is_anomaly'),
         Index('idx_anomaly_score', 'anomaly_score'),
     )
+
+
+class WorkerIdLease(Base):
+    __tablename__ = "worker_id_leases"
+
+    # ID воркера snowflake (0..63), занятый процессом owner до expires_at
+    worker_id = Column(Integer, primary_key=True, autoincrement=False)
+    owner = Column(String(128), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
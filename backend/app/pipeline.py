@@ -0,0 +1,296 @@
+"""
+Пайплайн /api/check: регистрация стандартных правил в движке и сборка результата.
+"""
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Tuple
+from collections import Counter
+import asyncio
+import json
+from sqlalchemy.orm import Session
+from .config import settings
+from .models import FraudCheck, AnomalyDetection
+from .ids import next_check_id
+from .schemas import CheckRequest, CheckResponse, MLAnalysis
+from .ml_anomaly import anomaly_detector
+from .risk_score import aggregate_results, recommendation_from_score, calculate_ml_enhanced_score
+from .profiles import PROFILES, PipelineProfile
+from .rule_engine import CheckContext, rule_engine
+from .rules.geo import get_ip_country, bin_country_lookup, geo_mismatch
+from .rule_dsl import dsl_rules
+from .rules.email import check_email_reputation
+from .rules.velocity import check_velocity, velocity_counts, velocity_result
+from .rules.device import device_fingerprint_frequency
+from .rules.result import NO_SIGNAL
+from .rules.blacklist import check_blacklist_ip, blacklisted_ips, blacklist_result
+
+
+# Lookup'ы при таймауте дорабатывают в фоне и прогревают кэш для следующих проверок
+@rule_engine.rule("ip_country", scored=False, finish_in_background=True)
+async def ip_country_lookup(ctx: CheckContext):
+    return await get_ip_country(ctx.payload.ip)
+
+
+@rule_engine.rule("bin_country", scored=False, finish_in_background=True)
+async def bin_country(ctx: CheckContext):
+    return await bin_country_lookup(ctx.payload.bin)
+
+
+@rule_engine.rule("geo", depends_on=("ip_country", "bin_country"), max_score=lambda: settings.score_geo_mismatch)
+def geo_rule(ctx: CheckContext):
+    return geo_mismatch(ctx.results["ip_country"], ctx.results["bin_country"])
+
+
+# Пороги, веса и флаги timezone/bot/device - в файле правил (rule_dsl)
+
+
+# Таймзоне нужна только страна IP, BIN lookup она не ждёт
+@rule_engine.rule(
+    "timezone",
+    depends_on=dsl_rules.current.depends_on("timezone"),
+    max_score=lambda: dsl_rules.current.max_score("timezone"),
+    memo_inputs=("results.ip_country", "timezone", "ruleset"),
+)
+def timezone_rule(ctx: CheckContext):
+    return ctx.ruleset.evaluate("timezone", ctx) or NO_SIGNAL
+
+
+@rule_engine.rule("email", max_score=lambda: settings.score_temp_email, memo_inputs=("email",))
+def email_rule(ctx: CheckContext):
+    return check_email_reputation(ctx.payload.email)
+
+
+@rule_engine.rule("velocity", blocking=True, max_score=lambda: settings.score_velocity)
+def velocity_rule(ctx: CheckContext):
+    with ctx.thread_session() as db:
+        return check_velocity(db, ctx.payload.email, ctx.payload.ip or "")
+
+
+@rule_engine.rule("bot", depends_on=dsl_rules.current.depends_on("bot"), max_score=lambda: dsl_rules.current.max_score("bot"))
+def bot_rule(ctx: CheckContext):
+    return ctx.ruleset.evaluate("bot", ctx) or NO_SIGNAL
+
+
+# Декларативные признаки устройства (regex по User-Agent, разрешение экрана) -
+# чистая функция входов, кэшируется отдельно от счётчика отпечатков
+@rule_engine.rule("device_signals", depends_on=dsl_rules.current.depends_on("device"), scored=False, memo_inputs=("user_agent", "device_info", "ruleset"))
+def device_signals_rule(ctx: CheckContext):
+    return ctx.ruleset.evaluate("device", ctx)
+
+
+# 15 - frequent_device_fingerprint
+@rule_engine.rule("device", depends_on=("device_signals",), side_effects=True, max_score=lambda: max(dsl_rules.current.max_score("device"), 15))
+def device_rule(ctx: CheckContext):
+    # Частоту отпечатка считаем, только если не сработали декларативные признаки
+    return ctx.results["device_signals"] or device_fingerprint_frequency(ctx.payload.device_info, ctx.payload.user_agent)
+
+
+@rule_engine.rule("blacklist", blocking=True, max_score=lambda: settings.score_ip_blacklisted)
+def blacklist_rule(ctx: CheckContext):
+    with ctx.thread_session() as db:
+        return check_blacklist_ip(db, ctx.payload.ip)
+
+
+class ScoredCheck:
+    """Результат прогона правил по одному запросу до сохранения в БД."""
+
+    def __init__(self, ctx: CheckContext, profile: PipelineProfile = PROFILES["standard"], check_id: Optional[int] = None, persist: bool = True):
+        payload = ctx.payload
+        results = ctx.results
+        self.payload = payload
+        self.results = results
+        self.degraded = ctx.degraded
+        self.skipped = ctx.skipped
+        self.timings = ctx.timings
+        self.profile = profile
+        self.geo = results.get("geo")
+        self.ml_details: Optional[Dict[str, Any]] = None
+        if profile.ml_enhanced:
+            self.score, self.flags, self.ml_details = calculate_ml_enhanced_score(ml_data(payload, self.geo), rule_engine.score_parts(ctx))
+        else:
+            self.score, self.flags = aggregate_results(rule_engine.score_results(ctx))
+        self.recommendation = recommendation_from_score(self.score)
+        if ctx.decided or not profile.anomaly_detection:
+            # Решение зафиксировано досрочно (ML-детекция его не изменит) или профиль без ML
+            self.check_data, self.anomaly_score, self.is_anomaly, self.anomaly_type = None, 0.0, False, "skipped"
+        else:
+            self.check_data, self.anomaly_score, self.is_anomaly, self.anomaly_type = detect_anomaly(payload, self.geo)
+        # ID известен до записи: строки можно писать отложенно и батчами;
+        # при фоновом пересчёте - ID предварительной проверки. Проверка без записи
+        # (перескоринг) остаётся без ID: его нет в БД, и аренда ID воркера не нужна
+        self.check_id = check_id if check_id is not None or not persist else next_check_id()
+
+    def fraud_check_row(self) -> FraudCheck:
+        payload = self.payload
+        geo_details = self.geo.details if self.geo and self.geo.details else {}
+        return FraudCheck(
+            id=self.check_id,
+            email=payload.email,
+            ip=payload.ip or "",
+            bin=(payload.bin or "")[:16],
+            user_agent=payload.user_agent or "",
+            ip_country=geo_details.get("ip_country"),
+            bin_country=geo_details.get("bin_country"),
+            timezone=payload.timezone,
+            language=payload.language,
+            session_duration_ms=payload.session_duration_ms,
+            typing_speed_ms_avg=payload.typing_speed_ms_avg,
+            mouse_moves_count=payload.mouse_moves_count,
+            first_click_delay_ms=payload.first_click_delay_ms,
+            device_info=json.dumps(payload.device_info or {}),
+            risk_score=self.score,
+            fraud_flags=json.dumps(self.flags),
+        )
+
+    def anomaly_row(self) -> Optional[AnomalyDetection]:
+        """None, если ML-детекция была пропущена."""
+        if self.check_data is None:
+            return None
+        return AnomalyDetection(
+            check_id=self.check_id,
+            anomaly_score=self.anomaly_score,
+            anomaly_type=self.anomaly_type,
+            features=self.check_data,
+            is_anomaly=1 if self.is_anomaly else 0
+        )
+
+    def rows(self) -> List[Any]:
+        """Все строки для записи в БД."""
+        anomaly = self.anomaly_row()
+        return [self.fraud_check_row()] + ([anomaly] if anomaly is not None else [])
+
+    @property
+    def needs_alert(self) -> bool:
+        return self.score >= settings.threshold_review
+
+    def alert(self) -> Dict[str, Any]:
+        return {
+            "check_id": self.check_id,
+            "email": self.payload.email,
+            "ip": self.payload.ip,
+            "risk_score": self.score,
+            "fraud_flags": self.flags,
+            "recommendation": self.recommendation,
+            "anomaly_score": self.anomaly_score
+        }
+
+    def ml_analysis(self) -> Optional[MLAnalysis]:
+        if not self.profile.details or self.ml_details is None:
+            return None
+        details = self.ml_details
+        return MLAnalysis(
+            base_score=details.get('base_score', 0),
+            ml_anomaly_score=details.get('ml_anomaly_score', 0),
+            behavioral_score=details.get('behavioral_score', 0),
+            total_score=details.get('total_score', 0),
+            anomalies=details.get('ml_details', {}).get('anomalies', []),
+            behavioral_analysis=details.get('behavioral_details', {}).get('behavioral_analysis', {}),
+        )
+
+    def response(self) -> CheckResponse:
+        return CheckResponse(
+            risk_score=self.score,
+            fraud_flags=self.flags,
+            recommendation=self.recommendation,
+            check_id=self.check_id,
+            ml_analysis=self.ml_analysis(),
+            provisional=True if self.profile.enrich_with else None,
+        )
+
+
+def ml_data(payload: CheckRequest, geo_res: Any) -> Dict[str, Any]:
+    """Вход calculate_ml_enhanced_score (ML + поведенческий анализ)."""
+    return {
+        "email": payload.email,
+        "bin": payload.bin,
+        "ip": payload.ip,
+        "userAgent": payload.user_agent or "",
+        "deviceInfo": payload.device_info or {},
+        "timezone": payload.timezone,
+        "language": payload.language,
+        "session_duration": payload.session_duration_ms / 1000 if payload.session_duration_ms else 0,
+        "typing_speed": payload.typing_speed_ms_avg or 0,
+        "mouse_movements": payload.mouse_moves_count or 0,
+        "first_click_time": payload.first_click_delay_ms / 1000 if payload.first_click_delay_ms else 0,
+        "geo_mismatch": geo_res is not None and geo_res.fraud_flag == "geo_mismatch",
+    }
+
+
+def detect_anomaly(payload: CheckRequest, geo_res: Any) -> Tuple[Dict[str, Any], float, bool, str]:
+    """ML-детекция аномалий: (данные, score, is_anomaly, тип)."""
+    check_data = {
+        "typing_speed": payload.typing_speed_ms_avg,
+        "session_duration": payload.session_duration_ms / 1000 if payload.session_duration_ms else 0,
+        "mouse_movements": payload.mouse_moves_count,
+        "first_click_time": payload.first_click_delay_ms / 1000 if payload.first_click_delay_ms else 0,
+        "userAgent": payload.user_agent or "",
+        "deviceInfo": payload.device_info or {},
+        "geo_mismatch": geo_res is not None and geo_res.fraud_flag == "geo_mismatch",
+    }
+    features = anomaly_detector.extract_features(check_data)
+    anomalies = anomaly_detector.detect_anomalies(features)
+    anomaly_score = max((a[1] for a in anomalies), default=0.0)
+    anomaly_type = anomalies[0][2] if anomalies else "none"
+    return check_data, anomaly_score, bool(anomalies), anomaly_type
+
+
+async def score_check(payload: CheckRequest, db: Optional[Session], results: Optional[Dict[str, Any]] = None, deadline: Optional[float] = None, early_exit: Optional[bool] = None, profile: PipelineProfile = PROFILES["standard"], check_id: Optional[int] = None, persist: bool = True) -> ScoredCheck:
+    """Прогоняет правила; results - заранее вычисленные результаты (пропускаются движком),
+    deadline - момент по loop.time(), после которого недоделанные правила становятся degraded,
+    early_exit - досрочная остановка (по умолчанию из settings.evaluation_mode),
+    profile - набор правил и анализаторов, check_id - ID уже выданного ответа (пересчёт),
+    persist=False - результат не пишется в БД, ID не выдаётся."""
+    if early_exit is None:
+        early_exit = settings.evaluation_mode == "early_exit"
+    if profile.ml_enhanced:
+        # ML-составляющая может изменить score - досрочно решение не фиксируется
+        early_exit = False
+    ctx = CheckContext(payload, db, results, deadline, early_exit, ruleset=dsl_rules.current, only=profile.rules)
+    await rule_engine.run(ctx)
+    return ScoredCheck(ctx, profile, check_id, persist)
+
+
+def _bulk_db_lookups(db: Session, checks: List[CheckRequest]) -> List[Dict[str, Any]]:
+    with Session(bind=db.get_bind()) as session:
+        email_counts, ip_counts = velocity_counts(session, (c.email for c in checks), (c.ip or "" for c in checks))
+        blacklisted = blacklisted_ips(session, (c.ip for c in checks))
+
+    # Ранние элементы батча учитываются в velocity поздних - как при последовательных вызовах
+    seen_emails: Counter = Counter()
+    seen_ips: Counter = Counter()
+    prefetched = []
+    for c in checks:
+        ip = c.ip or ""
+        prefetched.append({
+            "velocity": velocity_result(email_counts.get(c.email, 0) + seen_emails[c.email], ip_counts.get(ip, 0) + seen_ips[ip]),
+            "blacklist": blacklist_result(bool(c.ip) and c.ip in blacklisted),
+        })
+        seen_emails[c.email] += 1
+        seen_ips[ip] += 1
+    return prefetched
+
+
+async def _no_db_lookups(checks: List[CheckRequest]) -> List[Dict[str, Any]]:
+    return [{} for _ in checks]
+
+
+async def prefetch_batch(checks: List[CheckRequest], db: Session, profile: PipelineProfile = PROFILES["standard"]) -> List[Dict[str, Any]]:
+    """Общие для батча lookup'ы: geo/BIN по уникальным значениям, velocity и blacklist - GROUP BY/IN запросами.
+    Lookup'ы правил, которых нет в профиле, не выполняются."""
+    active = {rule.name for rule in rule_engine.select(profile.rules)}
+    ips = list({c.ip for c in checks if c.ip}) if "ip_country" in active else []
+    bins = list({c.bin for c in checks if c.bin}) if "bin_country" in active else []
+    loop = asyncio.get_running_loop()
+    ip_countries, bin_countries, prefetched = await asyncio.gather(
+        asyncio.gather(*(get_ip_country(ip) for ip in ips)),
+        asyncio.gather(*(bin_country_lookup(b) for b in bins)),
+        loop.run_in_executor(rule_engine.executor, _bulk_db_lookups, db, checks)
+        if {"velocity", "blacklist"} & active else _no_db_lookups(checks),
+    )
+    ip_country_by_ip = dict(zip(ips, ip_countries))
+    bin_country_by_bin = dict(zip(bins, bin_countries))
+    for c, seeded in zip(checks, prefetched):
+        if "ip_country" in active:
+            seeded["ip_country"] = ip_country_by_ip.get(c.ip)
+        if "bin_country" in active:
+            seeded["bin_country"] = bin_country_by_bin.get(c.bin)
+    return prefetched
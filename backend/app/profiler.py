@@ -0,0 +1,131 @@
+"""
+Профилирование в проде без внешних инструментов.
+
+SamplingProfiler - поток, который раз в interval снимает стеки всех потоков
+(sys._current_frames) и считает одинаковые стеки; результат - collapsed stacks
+("поток;модуль:функция;... число"), их принимают flamegraph.pl и speedscope.
+
+SlowCheckCapture - кольцевой буфер медленных /api/check: время каждого правила,
+degraded/skipped, стоимость запроса и форма payload (типы и длины полей, без значений).
+"""
+from __future__ import annotations
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional
+import os
+import sys
+import threading
+import time
+from .config import settings
+from .request_cost import current_cost
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def _frame_label(frame: Any) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    def __init__(self, max_depth: int = 128):
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stacks: Counter = Counter()
+        self.samples = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: float = 0.005) -> None:
+        with self._lock:
+            if self._thread is not None:
+                raise ProfilerBusy("Profiler is already running")
+            self._stacks = Counter()
+            self.samples = 0
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample_loop, args=(interval,), name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> str:
+        """Останавливает сэмплирование и возвращает collapsed stacks."""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return ""
+            self._stop.set()
+            thread.join()
+            self._thread = None
+        return self.collapsed()
+
+    def _sample_loop(self, interval: float) -> None:
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack: List[str] = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)).replace(";", "_"))
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+
+def payload_shape(value: Any) -> Any:
+    """Структура payload без значений: тип и длина строк/списков, ключи словарей."""
+    if isinstance(value, dict):
+        return {key: payload_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return f"list[{len(value)}]"
+    if isinstance(value, str):
+        return f"str[{len(value)}]"
+    return type(value).__name__
+
+
+class SlowCheckCapture:
+    def __init__(self, threshold_ms: int = 250, max_entries: int = 200):
+        self.threshold_ms = threshold_ms
+        self._entries: Deque[Dict[str, Any]] = deque(maxlen=max_entries)
+
+    def observe(self, scored: Any, duration_ms: float) -> bool:
+        """Запоминает проверку дольше порога; True - захвачена."""
+        if not self.threshold_ms or duration_ms < self.threshold_ms:
+            return False
+        cost = current_cost.get()
+        self._entries.append({
+            "captured_at": time.time(),
+            "check_id": scored.check_id,
+            "duration_ms": round(duration_ms, 1),
+            "profile": scored.profile.name,
+            "recommendation": scored.recommendation,
+            "rule_ms": {name: round(ms, 3) for name, ms in scored.timings.items()},
+            "degraded": list(scored.degraded),
+            "skipped": list(scored.skipped),
+            "request_cost": cost.as_dict() if cost is not None else None,
+            "payload_shape": payload_shape(scored.payload.model_dump(exclude_none=True)),
+        })
+        return True
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Последние захваченные проверки, новые первыми."""
+        return list(reversed(self._entries))
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+# Глобальный профилировщик и буфер медленных проверок
+sampling_profiler = SamplingProfiler()
+slow_checks = SlowCheckCapture(threshold_ms=settings.slow_check_capture_ms, max_entries=settings.slow_check_capture_max)
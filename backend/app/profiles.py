@@ -0,0 +1,66 @@
+"""
+Профили пайплайна: какие правила запускать, нужны ли ML/поведенческий анализ
+и детали в ответе. Профиль выбирается по API ключу или заголовком запроса.
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, Optional
+from .config import settings
+
+
+class PipelineProfile:
+    def __init__(
+        self,
+        name: str,
+        rules: Optional[Iterable[str]] = None,
+        anomaly_detection: bool = True,
+        ml_enhanced: bool = False,
+        details: bool = False,
+        enrich_with: Optional[str] = None,
+        allow_trusted: bool = False,
+    ):
+        self.name = name
+        # None - все правила; иначе подмножество (зависимости добавит движок)
+        self.rules = frozenset(rules) if rules is not None else None
+        # ML-детекция аномалий с записью AnomalyDetection
+        self.anomaly_detection = anomaly_detection
+        # ML и поведенческий анализаторы участвуют в score (calculate_ml_enhanced_score)
+        self.ml_enhanced = ml_enhanced
+        # ml_analysis в ответе
+        self.details = details
+        # Двухфазный скоринг: ответ по rules, затем фоновый пересчёт профилем enrich_with
+        self.enrich_with = enrich_with
+        # Доверенная связка email + устройство + BIN считается сокращённым набором (trust.py)
+        self.allow_trusted = allow_trusted
+
+    @property
+    def final(self) -> "PipelineProfile":
+        """Профиль окончательного вердикта (для batch/stream - сразу он)."""
+        return PROFILES[self.enrich_with] if self.enrich_with else self
+
+
+PROFILES: Dict[str, PipelineProfile] = {
+    # Частые пинги со страниц поиска: только локальные правила без I/O
+    "lite": PipelineProfile("lite", rules=("email", "bot", "device"), anomaly_detection=False),
+    "standard": PipelineProfile("standard", allow_trusted=True),
+    # Оплата: полный анализ, как в main_working
+    "full": PipelineProfile("full", ml_enhanced=True, details=True),
+    # Быстрый ответ по локальным правилам (velocity - в памяти процесса),
+    # geo/BIN и ML - в фоне с пересмотром вердикта
+    "two_phase": PipelineProfile(
+        "two_phase",
+        rules=("email", "bot", "device", "blacklist", "velocity"),
+        anomaly_detection=False,
+        enrich_with="standard",
+        allow_trusted=True,
+    ),
+}
+
+
+def is_valid_api_key(api_key: Optional[str]) -> bool:
+    return api_key is not None and (api_key == settings.api_key or api_key in settings.api_key_profiles)
+
+
+def resolve_profile(api_key: Optional[str], requested: Optional[str] = None) -> Optional[PipelineProfile]:
+    """Профиль из заголовка запроса, иначе привязанный к ключу, иначе по умолчанию; None - неизвестное имя."""
+    name = requested or settings.api_key_profiles.get(api_key or "") or settings.default_profile
+    return PROFILES.get(name)
@@ -6,9 +6,13 @@ from collections import defaultdict, deque
 
 
 class RateLimiter:
-    def __init__(self):
+    def __init__(self, sweep_every: int = 10000):
+        # Раз в sweep_every вызовов удаляем ключи без запросов в окне
+        self.sweep_every = sweep_every
         self._lock = threading.Lock()
         self._requests: Dict[str, deque] = defaultdict(deque)
+        self._calls = 0
+        self._max_window = timedelta(minutes=1)
     
     def is_allowed(self, key: str, limit: int, window_minutes: int = 1) -> bool:
         """Проверяет, разрешён ли запрос для ключа в пределах лимита за окно."""
@@ -16,6 +20,10 @@ class RateLimiter:
         cutoff = now - timedelta(minutes=window_minutes)
         
         with self._lock:
+            self._max_window = max(self._max_window, now - cutoff)
+            self._calls += 1
+            if self._calls % self.sweep_every == 0:
+                self._sweep(now)
             requests = self._requests[key]
             
             # Удаляем старые запросы
@@ -29,6 +37,12 @@ class RateLimiter:
             # Добавляем текущий запрос
             requests.append(now)
             return True
+
+    def _sweep(self, now: datetime) -> None:
+        """Без этого каждый когда-либо виденный IP/email навсегда остаётся в словаре."""
+        cutoff = now - self._max_window
+        for key in [key for key, requests in self._requests.items() if not requests or requests[-1] < cutoff]:
+            del self._requests[key]
     
     def cleanup_old_entries(self, max_age_hours: int = 24):
         """Очищает старые записи для экономии памяти."""
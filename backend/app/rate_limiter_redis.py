@@ -1,7 +1,9 @@
-from typing import Optional
+from typing import Optional, Dict, Tuple
 from datetime import datetime, timedelta
 import asyncio
+import time
 from .redis_client import redis_client
+from .metrics import observe_redis
 
 class RedisRateLimiter:
     def __init__(self):
@@ -31,7 +33,11 @@ class RedisRateLimiter:
             # Устанавливаем TTL
             pipe.expire(key, window_minutes * 60)
             
-            results = await pipe.execute()
+            started = time.perf_counter()
+            try:
+                results = await pipe.execute()
+            finally:
+                observe_redis("rate_limit", time.perf_counter() - started)
             current_count = results[1]
             
             return current_count < limit
@@ -40,6 +46,38 @@ class RedisRateLimiter:
             print(f"Redis rate limiter error: {e}")
             return True  # Fallback при ошибке
     
+    async def is_allowed_many(self, hits: Dict[str, Tuple[int, int]], window_minutes: int = 1) -> Dict[str, bool]:
+        """Проверка множества ключей за один round trip: key -> (limit, кол-во запросов)."""
+        if not self.redis.redis or not hits:
+            return {key: True for key in hits}
+        
+        try:
+            current_time = datetime.utcnow()
+            now_ts = current_time.timestamp()
+            window_start = current_time - timedelta(minutes=window_minutes)
+            
+            pipe = self.redis.redis.pipeline()
+            for key, (_, count) in hits.items():
+                pipe.zremrangebyscore(key, 0, window_start.timestamp())
+                pipe.zcard(key)
+                pipe.zadd(key, {f"{now_ts}:{i}": now_ts for i in range(count)})
+                pipe.expire(key, window_minutes * 60)
+            started = time.perf_counter()
+            try:
+                results = await pipe.execute()
+            finally:
+                observe_redis("rate_limit_many", time.perf_counter() - started)
+            
+            # На каждый ключ 4 команды, zcard - вторая
+            return {
+                key: results[i * 4 + 1] + count <= limit
+                for i, (key, (limit, count)) in enumerate(hits.items())
+            }
+            
+        except Exception as e:
+            print(f"Redis rate limiter error: {e}")
+            return {key: True for key in hits}
+    
     async def get_remaining_requests(self, key: str, limit: int, window_minutes: int = 1) -> int:
         """Получить количество оставшихся запросов."""
         if not self.redis.redis:
@@ -49,11 +87,15 @@ class RedisRateLimiter:
             current_time = datetime.utcnow()
             window_start = current_time - timedelta(minutes=window_minutes)
             
-            # Удаляем старые записи
-            await self.redis.redis.zremrangebyscore(key, 0, window_start.timestamp())
-            
-            # Подсчитываем текущие запросы
-            current_count = await self.redis.redis.zcard(key)
+            started = time.perf_counter()
+            try:
+                # Удаляем старые записи
+                await self.redis.redis.zremrangebyscore(key, 0, window_start.timestamp())
+                
+                # Подсчитываем текущие запросы
+                current_count = await self.redis.redis.zcard(key)
+            finally:
+                observe_redis("remaining", time.perf_counter() - started)
             
             return max(0, limit - current_count)
             
@@ -1,7 +1,9 @@
 import redis.asyncio as redis
 from typing import Optional, Any
 import json
+import time
 from .config import settings
+from .metrics import observe_redis
 
 class RedisClient:
     def __init__(self):
@@ -26,34 +28,44 @@ class RedisClient:
         """Получить значение из Redis."""
         if not self.redis:
             return None
+        started = time.perf_counter()
         try:
             value = await self.redis.get(key)
             return json.loads(value) if value else None
         except Exception:
             return None
+        finally:
+            observe_redis("get", time.perf_counter() - started)
     
     async def set(self, key: str, value: Any, ttl: int = 3600):
         """Установить значение в Redis с TTL."""
         if not self.redis:
             return
+        started = time.perf_counter()
         try:
             await self.redis.setex(key, ttl, json.dumps(value))
         except Exception:
             pass
+        finally:
+            observe_redis("setex", time.perf_counter() - started)
     
     async def delete(self, key: str):
         """Удалить ключ из Redis."""
         if not self.redis:
             return
+        started = time.perf_counter()
         try:
             await self.redis.delete(key)
         except Exception:
             pass
+        finally:
+            observe_redis("delete", time.perf_counter() - started)
     
     async def increment(self, key: str, ttl: int = 3600) -> int:
         """Инкремент с TTL."""
         if not self.redis:
             return 0
+        started = time.perf_counter()
         try:
             pipe = self.redis.pipeline()
             pipe.incr(key)
@@ -62,6 +74,8 @@ class RedisClient:
             return results[0]
         except Exception:
             return 0
+        finally:
+            observe_redis("increment", time.perf_counter() - started)
 
 # Глобальный клиент Redis
 redis_client = RedisClient()
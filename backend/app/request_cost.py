@@ -0,0 +1,120 @@
+"""
+Стоимость одного HTTP-запроса: SQL-запросы, round trip'ы к Redis и исходящие
+HTTP-вызовы (geo/BIN) с их суммарным временем.
+
+Счётчик запроса лежит в contextvar: его видят задачи и потоки, запущенные из
+запроса (блокирующие правила копируют контекст в пул). Итог уходит в заголовок
+Server-Timing (SERVER_TIMING_ENABLED, по умолчанию выключен), а для медленных
+запросов - в структурированный лог.
+"""
+from __future__ import annotations
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+import logging
+import threading
+import time
+from .config import settings
+
+logger = logging.getLogger("antifraud.requests")
+
+
+class RequestCost:
+    __slots__ = ("started", "sql_count", "sql_seconds", "redis_count", "redis_seconds", "http_count", "http_seconds", "_lock")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.redis_count = 0
+        self.redis_seconds = 0.0
+        self.http_count = 0
+        self.http_seconds = 0.0
+        # SQL приходит и из пула потоков (DB-правила)
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        return ", ".join((
+            f'sql;dur={self.sql_seconds * 1000:.1f};desc="{self.sql_count} queries"',
+            f'redis;dur={self.redis_seconds * 1000:.1f};desc="{self.redis_count} calls"',
+            f'http;dur={self.http_seconds * 1000:.1f};desc="{self.http_count} calls"',
+            f"app;dur={self.elapsed_ms:.1f}",
+        ))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "duration_ms": round(self.elapsed_ms, 1),
+            "sql_count": self.sql_count,
+            "sql_ms": round(self.sql_seconds * 1000, 1),
+            "redis_count": self.redis_count,
+            "redis_ms": round(self.redis_seconds * 1000, 1),
+            "http_count": self.http_count,
+            "http_ms": round(self.http_seconds * 1000, 1),
+        }
+
+
+# Стоимость текущего запроса (None - вне HTTP-запроса: фоновые задачи, writer)
+current_cost: ContextVar[Optional[RequestCost]] = ContextVar("request_cost", default=None)
+
+
+def record_sql(seconds: float) -> None:
+    cost = current_cost.get()
+    if cost is not None:
+        with cost._lock:
+            cost.sql_count += 1
+            cost.sql_seconds += seconds
+
+
+def record_redis(seconds: float) -> None:
+    cost = current_cost.get()
+    if cost is not None:
+        cost.redis_count += 1
+        cost.redis_seconds += seconds
+
+
+def record_http(seconds: float) -> None:
+    cost = current_cost.get()
+    if cost is not None:
+        cost.http_count += 1
+        cost.http_seconds += seconds
+
+
+class RequestCostMiddleware:
+    """ASGI middleware: Server-Timing в ответ, медленные запросы - в лог."""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        cost = RequestCost()
+        token = current_cost.set(cost)
+        status = 0
+
+        async def send_with_timing(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if settings.server_timing_enabled:
+                    # Для стрима - стоимость к моменту заголовков
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", cost.server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_cost.reset(token)
+            if settings.slow_request_ms and cost.elapsed_ms >= settings.slow_request_ms:
+                logger.warning("Slow request", extra={
+                    "method": scope.get("method"),
+                    "path": scope.get("path"),
+                    "status": status,
+                    "cost": cost.as_dict(),
+                })
@@ -1,6 +1,7 @@
 from __future__ import annotations
-from typing import List, Tuple, Dict, Any
+from typing import Iterable, List, Tuple, Dict, Any
 from .config import settings
+from .rules.result import RuleResult
 from .ml_anomaly import check_ml_anomalies, analyze_behavioral_patterns
 
 
@@ -17,6 +18,20 @@ def aggregate_score_and_flags(parts: List[Tuple[int, str | None]]) -> tuple[int,
     return score, flags
 
 
+def aggregate_results(results: Iterable[RuleResult]) -> tuple[int, list[str]]:
+    """aggregate_score_and_flags по результатам правил - без промежуточных кортежей."""
+    score = 0
+    flags: list[str] = []
+    for result in results:
+        delta = result.score_delta
+        if delta > 0:
+            score += delta
+        flag = result.fraud_flag
+        if flag and flag not in flags:
+            flags.append(flag)
+    return max(0, min(100, score)), flags
+
+
 def recommendation_from_score(score: int) -> str:
     if score >= settings.threshold_block:
         return "block"
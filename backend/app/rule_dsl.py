@@ -0,0 +1,442 @@
+"""
+Декларативные правила: JSON-файл с условиями, весами и флагами.
+
+Каждое правило файла один раз компилируется в функцию Python: исходник
+генерируется из условий (поля читаются один раз в локальные переменные,
+all/any - цепочки and/or, пороги - литералы), значения готовятся заранее
+(regex, множества, таблицы). Новая версия подменяет текущую атомарно;
+проверка держит версию, с которой начала.
+
+Формат:
+    {"rules": [{"name": "bot",
+                "when": <условие>,                       # необязательно: иначе правило молчит
+                "cases": [{"when": <условие>, "score": 20 | "$score_bot_activity", "flag": "..."}]}]}
+
+Условие: {"all": [...]}, {"any": [...]}, {"not": {...}} или лист
+    {"field": "session_duration_ms" | "device_info.screen.width" | "results.ip_country",
+     "op": "lt", "value": 3000, "default": 0}
+вместо "value" - {"lookup": {"field": "results.ip_country", "table": {...}}}:
+значение берётся из таблицы по другому полю (нет ключа - условие ложно).
+Срабатывает первый подходящий case (как return в рукописных правилах).
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import operator
+import os
+import re
+import sys
+import threading
+from .config import settings
+from .schemas import CheckRequest
+from .rules.result import RuleResult
+
+logger = logging.getLogger("antifraud.rules")
+
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(__file__), "rules", "default_rules.json")
+
+Getter = Callable[[Any], Any]
+
+
+class RuleDSLError(ValueError):
+    """Ошибка в файле правил."""
+
+
+# Совместимость: DSL-правила возвращают общий RuleResult
+DSLRuleResult = RuleResult
+
+
+def _lower_all(value: Any) -> Tuple[str, ...]:
+    return tuple(str(v).lower() for v in value)
+
+
+def _substrings(value: Any) -> Any:
+    """Подстроки без регистра -> одна регулярка по строке в нижнем регистре (поиск за один вызов)."""
+    parts = _lower_all(value)
+    return re.compile("|".join(re.escape(part) for part in parts) if parts else "(?!)")
+
+
+# op -> подготовка значения при компиляции (None - op без значения)
+OPS: Dict[str, Optional[Callable[[Any], Any]]] = {
+    "lt": lambda x: x,
+    "le": lambda x: x,
+    "gt": lambda x: x,
+    "ge": lambda x: x,
+    "eq": lambda x: x,
+    "ne": lambda x: x,
+    "in": frozenset,
+    "not_in": frozenset,
+    # Регистронезависимые подстроки
+    "contains": lambda x: str(x).lower(),
+    "contains_any": _substrings,
+    "contains_none": _substrings,
+    "matches": lambda x: re.compile(x, re.IGNORECASE),
+    # Без значения
+    "null": None,
+    "not_null": None,
+    "empty": None,
+    "not_empty": None,
+}
+
+COMPARISONS = {"lt": "<", "le": "<=", "gt": ">", "ge": ">=", "eq": "==", "ne": "!="}
+# Истинны только для не-None значения: в all следующим условиям по этому полю проверка на None не нужна
+NOT_NONE_OPS = {"lt", "le", "gt", "ge", "not_null"}
+
+
+def _literal(value: Any) -> Optional[str]:
+    """Значение, которое можно вписать в исходник (константа байткода, а не поиск имени)."""
+    if value is None or isinstance(value, (bool, int, str)) or (isinstance(value, float) and math.isfinite(value)):
+        return repr(value)
+    return None
+
+
+def _compile_getter(path: str, default: Any = None) -> Tuple[Getter, Optional[str]]:
+    """Геттер поля и имя правила-источника (для results.<rule>)."""
+    if not isinstance(path, str) or not path:
+        raise RuleDSLError(f"Invalid field: {path!r}")
+    parts = path.split(".")
+    dependency = None
+    if parts[0] == "results":
+        if len(parts) < 2:
+            raise RuleDSLError(f"Invalid field: {path!r}")
+        dependency = parts[1]
+        key, nested = parts[1], parts[2:]
+        root: Getter = lambda ctx: ctx.results.get(key)
+    else:
+        attr, nested = parts[0], parts[1:]
+        if attr not in CheckRequest.model_fields:
+            raise RuleDSLError(f"Unknown CheckRequest field: {attr}")
+        root = operator.attrgetter(f"payload.{attr}")
+
+    if not nested:
+        getter = root
+    else:
+        def getter(ctx: Any) -> Any:
+            value = root(ctx)
+            for part in nested:
+                if not isinstance(value, dict):
+                    return None
+                value = value.get(part)
+            return value
+
+    if default is None:
+        return getter, dependency
+
+    def with_default(ctx: Any) -> Any:
+        value = getter(ctx)
+        return default if value is None else value
+    return with_default, dependency
+
+
+class _RuleCompiler:
+    """Исходник функции одного правила.
+
+    Каждое поле читается один раз в локальную переменную перед первым if,
+    all/any - цепочки and/or, листья - выражения без вызовов функций (кроме
+    regex), константы - литералы исходника. Проверка на None пропускается,
+    если поле имеет default или уже проверено в том же all.
+    """
+
+    def __init__(self) -> None:
+        self.env: Dict[str, Any] = {}
+        # Чтения полей, ещё не выписанные перед очередным if
+        self.reads: List[str] = []
+        self.fields: Dict[Tuple[str, str], Tuple[str, bool]] = {}
+        self.lowered: Dict[str, str] = {}
+        self.deps: set = set()
+        self.temps = 0
+
+    def bind(self, value: Any) -> str:
+        name = f"c{len(self.env)}"
+        self.env[name] = value
+        return name
+
+    def const(self, value: Any) -> str:
+        literal = _literal(value)
+        return literal if literal is not None else self.bind(value)
+
+    def field(self, path: Any, default: Any = None) -> Tuple[str, bool]:
+        """Локальная переменная поля и признак "никогда не None" (есть default)."""
+        key = (str(path), json.dumps(default, sort_keys=True, default=str))
+        if key in self.fields:
+            return self.fields[key]
+        _, dependency = _compile_getter(path)
+        if dependency:
+            self.deps.add(dependency)
+        parts = path.split(".")
+        if len(parts) == 1:
+            read = f"p.{path}"
+        elif parts[0] == "results" and len(parts) == 2:
+            read = f"r.get({parts[1]!r})"
+        else:
+            # Вложенное поле - из переменной родителя (общий префикс читается один раз)
+            parent, _ = self.field(".".join(parts[:-1]))
+            read = f"{parent}.get({parts[-1]!r}) if isinstance({parent}, dict) else None"
+        var = f"f{len(self.fields)}"
+        self.reads.append(f"{var} = {read}")
+        if default is not None:
+            self.reads.append(f"if {var} is None: {var} = {self.const(default)}")
+        self.fields[key] = (var, default is not None)
+        return self.fields[key]
+
+    def lower(self, var: str) -> str:
+        """Строка поля в нижнем регистре (None - не строка), тоже один раз на вызов."""
+        if var not in self.lowered:
+            self.lowered[var] = f"l{var[1:]}"
+            self.reads.append(f"{self.lowered[var]} = {var}.lower() if isinstance({var}, str) else None")
+        return self.lowered[var]
+
+    def test(self, op: str, var: str, expected: str, check_none: bool) -> str:
+        if op in COMPARISONS:
+            comparison = f"{var} {COMPARISONS[op]} {expected}"
+            return f"({var} is not None and {comparison})" if check_none and op not in ("eq", "ne") else f"({comparison})"
+        if op == "in":
+            return f"({var} in {expected})"
+        if op == "not_in":
+            return f"({var} not in {expected})"
+        if op == "matches":
+            return f"(isinstance({var}, str) and {expected}.search({var}) is not None)"
+        lowered = self.lower(var)
+        if op == "contains":
+            return f"({lowered} is not None and {expected} in {lowered})"
+        found = "is not None" if op == "contains_any" else "is None"
+        return f"({lowered} is not None and {expected}.search({lowered}) {found})"
+
+    def leaf(self, spec: Dict[str, Any], not_none: frozenset) -> str:
+        op = spec.get("op")
+        if op not in OPS:
+            raise RuleDSLError(f"Unknown op: {op!r}")
+        prepare = OPS[op]
+        var, has_default = self.field(spec.get("field"), spec.get("default"))
+        check_none = not has_default and var not in not_none
+
+        if prepare is None:
+            return {
+                "null": f"({var} is None)",
+                "not_null": f"({var} is not None)",
+                "empty": f"(not {var})",
+                "not_empty": f"(not not {var})",
+            }[op]
+
+        try:
+            if "lookup" in spec:
+                lookup = spec["lookup"]
+                key_var, _ = self.field(lookup.get("field"))
+                table = self.bind({k: prepare(v) for k, v in lookup["table"].items()})
+                self.temps += 1
+                expected = f"t{self.temps}"
+                # Нет ключа в таблице - условие ложно
+                return f"(({expected} := {table}.get({key_var})) is not None and {self.test(op, var, expected, check_none)})"
+
+            if "value" not in spec:
+                raise RuleDSLError(f"Op {op} requires value or lookup")
+            expected = self.const(prepare(spec["value"]))
+        except (TypeError, KeyError, AttributeError, re.error) as e:
+            raise RuleDSLError(f"Invalid {op} condition: {e}") from e
+        return self.test(op, var, expected, check_none)
+
+    def fuse_matches(self, specs: List[Any]) -> List[Any]:
+        """any из нескольких matches по одному полю -> один matches с альтернацией (один проход regex)."""
+        groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for spec in specs:
+            if isinstance(spec, dict) and spec.get("op") == "matches" and "lookup" not in spec and isinstance(spec.get("value"), str):
+                groups.setdefault((str(spec.get("field")), json.dumps(spec.get("default"), default=str)), []).append(spec)
+        fused = []
+        for spec in specs:
+            group = groups.get((str(spec.get("field")), json.dumps(spec.get("default"), default=str))) if isinstance(spec, dict) and spec.get("op") == "matches" else None
+            if group is None or spec not in group:
+                fused.append(spec)
+            elif spec is group[0]:
+                pattern = "|".join(f"(?:{member['value']})" for member in group)
+                try:
+                    re.compile(pattern, re.IGNORECASE)
+                except re.error:
+                    # Например, глобальные флаги внутри шаблона - оставляем по отдельности
+                    fused.extend(group)
+                    continue
+                fused.append({**spec, "value": pattern})
+        return fused
+
+    def condition(self, spec: Any, not_none: frozenset = frozenset()) -> str:
+        if not isinstance(spec, dict):
+            raise RuleDSLError(f"Condition must be an object: {spec!r}")
+
+        if "all" in spec or "any" in spec:
+            is_all = "all" in spec
+            specs = spec["all" if is_all else "any"]
+            if not specs:
+                raise RuleDSLError("Empty all/any")
+            if not is_all:
+                specs = self.fuse_matches(specs)
+            parts = []
+            known = set(not_none)
+            for child in specs:
+                parts.append(self.condition(child, frozenset(known)))
+                if is_all and isinstance(child, dict) and child.get("op") in NOT_NONE_OPS and "lookup" not in child:
+                    known.add(self.field(child.get("field"), child.get("default"))[0])
+            if len(parts) == 1:
+                return parts[0]
+            return "(" + (" and " if is_all else " or ").join(parts) + ")"
+
+        if "not" in spec:
+            return f"(not {self.condition(spec['not'], not_none)})"
+
+        return self.leaf(spec, not_none)
+
+    def statement(self, condition: Any, negate: bool, result: str) -> List[str]:
+        """if по условию; поля, впервые нужные этому условию, читаются прямо перед ним."""
+        test = self.condition(condition)
+        reads, self.reads = self.reads, []
+        return [f"    {line}" for line in reads] + [f"    if {'not ' if negate else ''}{test}:", f"        return {result}"]
+
+    def build(self, name: str, body: List[str]) -> Tuple[Callable[[Any], Optional[RuleResult]], str]:
+        code = "\n".join(body)
+        prelude = [f"    {line}" for line, var in (("p = ctx.payload", "p."), ("r = ctx.results", "r.get(")) if var in code]
+        source = "\n".join(["def rule(ctx):"] + prelude + body) + "\n"
+        namespace = dict(self.env)
+        exec(compile(source, f"<rule {name}>", "exec"), namespace)
+        return namespace["rule"], source
+
+
+def _resolve_score(score: Any) -> int:
+    """Число или "$<поле Settings>" - веса остаются в настройках."""
+    if isinstance(score, str) and score.startswith("$"):
+        value = getattr(settings, score[1:], None)
+        if not isinstance(value, int):
+            raise RuleDSLError(f"Unknown settings weight: {score}")
+        return value
+    if not isinstance(score, int):
+        raise RuleDSLError(f"Invalid score: {score!r}")
+    return score
+
+
+class CompiledRule:
+    def __init__(self, name: str, evaluate: Callable[[Any], Optional[RuleResult]], results: List[RuleResult], depends_on: Tuple[str, ...], source: str = ""):
+        self.name = name
+        # Сгенерированная функция: результат первого сработавшего case; None - ни один не сработал
+        self.evaluate = evaluate
+        self.results = results
+        self.depends_on = depends_on
+        # Исходник функции - для отладки файла правил
+        self.source = source
+        self.max_score = max((result.score_delta for result in results), default=0)
+
+
+def _compile_rule(spec: Dict[str, Any]) -> CompiledRule:
+    name = spec.get("name")
+    if not isinstance(name, str) or not name:
+        raise RuleDSLError(f"Rule without name: {spec!r}")
+    compiler = _RuleCompiler()
+    body = []
+    if "when" in spec:
+        body += compiler.statement(spec["when"], True, "None")
+    results = []
+    for case in spec.get("cases", []):
+        # Результаты неизменяемы и общие для всех проверок - без аллокаций при оценке
+        flag = case.get("flag")
+        # Флаги из файла интернируются, как литералы в коде правил
+        result = RuleResult(score_delta=_resolve_score(case.get("score", 0)), fraud_flag=sys.intern(flag) if flag else None)
+        results.append(result)
+        if "when" in case:
+            body += compiler.statement(case["when"], False, compiler.bind(result))
+        else:
+            body.append(f"    return {compiler.bind(result)}")
+    if not results:
+        raise RuleDSLError(f"Rule {name} has no cases")
+    body.append("    return None")
+    evaluate, source = compiler.build(name, body)
+    return CompiledRule(name, evaluate, results, tuple(sorted(compiler.deps)), source)
+
+
+class RuleSet:
+    """Скомпилированная версия файла правил."""
+
+    def __init__(self, rules: Dict[str, CompiledRule], version: str):
+        self.rules = rules
+        self.version = version
+
+    @classmethod
+    def compile(cls, source: str) -> "RuleSet":
+        try:
+            spec = json.loads(source)
+        except json.JSONDecodeError as e:
+            raise RuleDSLError(f"Invalid JSON: {e}") from e
+        rules: Dict[str, CompiledRule] = {}
+        for rule_spec in spec.get("rules", []):
+            try:
+                rule = _compile_rule(rule_spec)
+            except KeyError as e:
+                raise RuleDSLError(f"Missing key {e} in rule {rule_spec.get('name')!r}") from e
+            if rule.name in rules:
+                raise RuleDSLError(f"Duplicate rule {rule.name}")
+            rules[rule.name] = rule
+        version = spec.get("version") or hashlib.sha256(source.encode()).hexdigest()[:12]
+        return cls(rules, str(version))
+
+    def evaluate(self, name: str, ctx: Any) -> Optional[RuleResult]:
+        return self.rules[name].evaluate(ctx)
+
+    def max_score(self, name: str) -> int:
+        return self.rules[name].max_score
+
+    def depends_on(self, name: str) -> Tuple[str, ...]:
+        return self.rules[name].depends_on
+
+
+class DSLRules:
+    """Текущая версия правил с перезагрузкой по изменению файла."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._watcher: Optional[asyncio.Task] = None
+        self.current = self._load()
+
+    def _load(self) -> RuleSet:
+        with open(self.path, encoding="utf-8") as f:
+            self._mtime = os.fstat(f.fileno()).st_mtime
+            return RuleSet.compile(f.read())
+
+    def reload(self, force: bool = False) -> bool:
+        """Перечитывает файл, если он изменился; True - версия подменена.
+
+        Набор правил и их зависимости зарегистрированы в движке при старте,
+        поэтому меняться могут только условия, веса и флаги.
+        """
+        with self._lock:
+            if not force and os.stat(self.path).st_mtime == self._mtime:
+                return False
+            new = self._load()
+            old = self.current
+            if {n: r.depends_on for n, r in new.rules.items()} != {n: r.depends_on for n, r in old.rules.items()}:
+                raise RuleDSLError("Rule names or dependencies changed - restart required")
+            # Присваивание атомарно: идущие проверки держат ссылку на старую версию
+            self.current = new
+        logger.info("Rules reloaded: %s -> %s", old.version, new.version)
+        return True
+
+    async def _watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.reload()
+            except (OSError, RuleDSLError) as e:
+                logger.error("Rules reload failed, keeping %s: %s", self.current.version, e)
+
+    def start_watching(self, interval: float) -> None:
+        if interval > 0 and self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch(interval))
+
+    def stop_watching(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+
+# Глобальные декларативные правила
+dsl_rules = DSLRules(settings.rules_file or DEFAULT_RULES_FILE)
@@ -0,0 +1,347 @@
+"""
+Движок выполнения правил: реестр правил с зависимостями и планировщик.
+
+Независимые правила выполняются конкурентно, блокирующие (SQLAlchemy)
+уходят в ограниченный пул потоков, а зависимые ждут только свои входы.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import sys
+import time
+from sqlalchemy.orm import Session
+from .config import settings
+from .logging_config import log_rule_result
+from .metrics import count_rule_hit, observe_rule
+from .risk_score import recommendation_from_score
+from .rules.result import RuleResult
+from .rule_memo import RuleMemo
+from .tracing import tracer
+
+# Сглаживание EWMA измеренной стоимости правила
+COST_EWMA_ALPHA = 0.1
+
+
+class CheckContext:
+    """Входные данные и промежуточные результаты одной проверки."""
+
+    def __init__(self, payload: Any, db: Optional[Session] = None, results: Optional[Dict[str, Any]] = None, deadline: Optional[float] = None, early_exit: bool = False, ruleset: Any = None, only: Optional[FrozenSet[str]] = None):
+        self.payload = payload
+        self.db = db
+        self.results: Dict[str, Any] = dict(results or {})
+        # Абсолютный дедлайн по loop.time(); правила, не успевшие к нему, пропускаются
+        self.deadline = deadline
+        self.degraded: List[str] = []
+        # early_exit=True - остановиться, как только рекомендация не может измениться
+        self.early_exit = early_exit
+        self.decided = False
+        self.skipped: List[str] = []
+        # Время выполненных правил, мс (для захвата медленных проверок)
+        self.timings: Dict[str, float] = {}
+        # Версия декларативных правил, зафиксированная на всю проверку
+        self.ruleset = ruleset
+        # Подмножество правил профиля (None - все); зависимости добавляются автоматически
+        self.only = only
+
+    def thread_session(self) -> Session:
+        """Отдельная сессия для правила в пуле потоков (Session не потокобезопасна)."""
+        return Session(bind=self.db.get_bind())
+
+
+class Rule:
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[CheckContext], Any],
+        depends_on: Iterable[str] = (),
+        blocking: bool = False,
+        scored: bool = True,
+        finish_in_background: bool = False,
+        max_score: Optional[Callable[[], int]] = None,
+        memo_inputs: Optional[Iterable[str]] = None,
+        side_effects: bool = False,
+    ):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        # blocking=True - синхронная функция с I/O, выполняется в пуле потоков
+        self.blocking = blocking
+        # scored=False - обогащение (например ip_country), не участвует в score
+        self.scored = scored
+        # finish_in_background=True - при таймауте async-правило дорабатывает в фоне (прогрев кэша)
+        self.finish_in_background = finish_in_background
+        # Максимально возможный вклад в score (вызывается при проверке - веса из settings);
+        # None - неизвестен, правило не даёт закончить досрочно
+        self.max_score = max_score
+        self.is_async = asyncio.iscoroutinefunction(func)
+        # side_effects=True - правило меняет состояние (счётчики), результат не кэшируется
+        self.side_effects = side_effects
+        # memo_inputs - ключи входов, от которых только и зависит результат: LRU по ним
+        self.memo: Optional[RuleMemo] = None
+        if memo_inputs is not None:
+            memo_inputs = tuple(memo_inputs)
+            if side_effects or not self.local:
+                raise ValueError(f"Rule {name}: only local rules without side effects can be memoized")
+            for key in memo_inputs:
+                if key.startswith("results.") and key[len("results."):] not in self.depends_on:
+                    raise ValueError(f"Rule {name}: memo input {key} is not a dependency")
+            if settings.rule_memo_size > 0:
+                self.memo = RuleMemo(memo_inputs, maxsize=settings.rule_memo_size)
+        # Измеренная стоимость, мс (EWMA)
+        self.cost_ms = 0.0
+        # Один объект на правило - флаг degraded:<rule> не собирается на каждую проверку
+        self.degraded_result = RuleResult(0, sys.intern(f"degraded:{name}"))
+
+    def upper_bound(self) -> int:
+        return 100 if self.max_score is None else self.max_score()
+
+    def record_cost(self, elapsed_ms: float) -> None:
+        self.cost_ms += COST_EWMA_ALPHA * (elapsed_ms - self.cost_ms) if self.cost_ms else elapsed_ms
+
+    @property
+    def local(self) -> bool:
+        """Синхронное правило без I/O."""
+        return not (self.is_async or self.blocking)
+
+
+class RuleEngine:
+    def __init__(self, max_workers: int = 8):
+        self._rules: Dict[str, Rule] = {}
+        self._order: Optional[List[Rule]] = None
+        self._selections: Dict[FrozenSet[str], List[Rule]] = {}
+        self._max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def rule(self, name: str, **options: Any):
+        """Декоратор регистрации правила; options - параметры Rule."""
+        def decorator(func: Callable[[CheckContext], Any]) -> Callable[[CheckContext], Any]:
+            self.register(Rule(name, func, **options))
+            return func
+        return decorator
+
+    def register(self, rule: Rule) -> None:
+        if rule.name in self._rules:
+            raise ValueError(f"Rule {rule.name} already registered")
+        self._rules[rule.name] = rule
+        self._order = None
+        self._selections = {}
+
+    @property
+    def rules(self) -> List[Rule]:
+        """Правила в топологическом порядке (при равенстве - в порядке регистрации)."""
+        if self._order is None:
+            self._order = self._toposort()
+        return self._order
+
+    def select(self, names: Optional[FrozenSet[str]]) -> List[Rule]:
+        """Правила names и их зависимости в топологическом порядке; None - все."""
+        if names is None:
+            return self.rules
+        selected = self._selections.get(names)
+        if selected is None:
+            needed = set()
+            stack = list(names)
+            while stack:
+                name = stack.pop()
+                if name not in needed:
+                    if name not in self._rules:
+                        raise ValueError(f"Unknown rule: {name}")
+                    needed.add(name)
+                    stack.extend(self._rules[name].depends_on)
+            selected = self._selections[names] = [rule for rule in self.rules if rule.name in needed]
+        return selected
+
+    def _toposort(self) -> List[Rule]:
+        order: List[Rule] = []
+        state: Dict[str, int] = {}  # 1 - в обработке, 2 - готово
+
+        def visit(name: str, path: Tuple[str, ...]) -> None:
+            if name not in self._rules:
+                raise ValueError(f"Unknown rule dependency: {name} (required by {path[-1]})")
+            if state.get(name) == 2:
+                return
+            if state.get(name) == 1:
+                raise ValueError(f"Rule dependency cycle: {' -> '.join(path + (name,))}")
+            state[name] = 1
+            for dep in self._rules[name].depends_on:
+                visit(dep, path + (name,))
+            state[name] = 2
+            order.append(self._rules[name])
+
+        for name in self._rules:
+            visit(name, ())
+        return order
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="rule")
+        return self._executor
+
+    def _budget(self, rule: Rule, ctx: CheckContext) -> Optional[float]:
+        """Сколько секунд есть у правила: min(бюджет правила, остаток до дедлайна)."""
+        budget = None
+        rule_budget_ms = settings.rule_budgets_ms.get(rule.name)
+        if rule_budget_ms is not None:
+            budget = rule_budget_ms / 1000
+        if ctx.deadline is not None:
+            remaining = ctx.deadline - asyncio.get_running_loop().time()
+            budget = remaining if budget is None else min(budget, remaining)
+        return budget
+
+    async def _call(self, rule: Rule, ctx: CheckContext) -> Any:
+        if rule.is_async:
+            if rule.finish_in_background:
+                return await asyncio.shield(rule.func(ctx))
+            return await rule.func(ctx)
+        if rule.blocking:
+            # Контекст запроса (стоимость SQL для Server-Timing) - в поток пула
+            return await asyncio.get_running_loop().run_in_executor(self.executor, contextvars.copy_context().run, rule.func, ctx)
+        if rule.memo is not None:
+            return rule.memo.get_or_compute(ctx, rule.func)
+        return rule.func(ctx)
+
+    async def run_rule(self, name: str, ctx: CheckContext) -> Any:
+        """Одно правило вне полного прогона (предрасчёт по частичным данным); зависимости не запускаются."""
+        return await self._call(self._rules[name], ctx)
+
+    def _degrade(self, rule: Rule, ctx: CheckContext) -> None:
+        ctx.degraded.append(rule.name)
+        if not rule.scored:
+            # Зависимые правила получат None, как при недоступном провайдере
+            ctx.results[rule.name] = None
+        count_rule_hit(rule.name, "degraded")
+        log_rule_result(rule.name, 0, f"degraded:{rule.name}")
+
+    async def _execute(self, rule: Rule, ctx: CheckContext, tasks: Dict[str, asyncio.Task]) -> Any:
+        # Результат, заранее положенный в контекст (batch-prefetch), не пересчитываем
+        if rule.name in ctx.results:
+            return ctx.results[rule.name]
+        waits = [tasks[dep] for dep in rule.depends_on if dep in tasks]
+        if waits:
+            await asyncio.gather(*waits)
+        budget = self._budget(rule, ctx)
+        with tracer.span(f"rule {rule.name}") as span:
+            started = time.perf_counter()
+            if budget is None or rule.local:
+                # Синхронные локальные правила не прерываются - их стоимость микросекунды
+                value = await self._call(rule, ctx)
+            elif budget <= 0:
+                span.tag("degraded", "no_budget")
+                self._degrade(rule, ctx)
+                return None
+            else:
+                try:
+                    value = await asyncio.wait_for(self._call(rule, ctx), budget)
+                except asyncio.TimeoutError:
+                    span.tag("degraded", "timeout")
+                    self._degrade(rule, ctx)
+                    return None
+            elapsed = time.perf_counter() - started
+            rule.record_cost(elapsed * 1000)
+            ctx.timings[rule.name] = elapsed * 1000
+            observe_rule(rule.name, elapsed)
+            ctx.results[rule.name] = value
+            if rule.scored:
+                if value.fraud_flag:
+                    span.tag("fraud_flag", value.fraud_flag)
+                    count_rule_hit(rule.name, value.fraud_flag)
+                log_rule_result(rule.name, value.score_delta, value.fraud_flag, getattr(value, "details", None))
+            return value
+
+    async def run(self, ctx: CheckContext) -> Dict[str, Any]:
+        """Выполняет все правила; латентность = самый длинный путь в графе зависимостей."""
+        if ctx.early_exit:
+            return await self._run_early_exit(ctx)
+        tasks: Dict[str, asyncio.Task] = {}
+        for rule in self.select(ctx.only):
+            tasks[rule.name] = asyncio.ensure_future(self._execute(rule, ctx, tasks))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return ctx.results
+
+    def _is_decided(self, ctx: CheckContext) -> bool:
+        """Рекомендация не изменится, даже если все оставшиеся правила дадут максимум."""
+        score = sum(max(0, int(value.score_delta)) for value in self._scored_results(ctx))
+        upper = score + sum(
+            rule.upper_bound()
+            for rule in self.select(ctx.only)
+            if rule.scored and rule.name not in ctx.results and rule.name not in ctx.degraded
+        )
+        return recommendation_from_score(min(100, score)) == recommendation_from_score(min(100, upper))
+
+    def _scored_results(self, ctx: CheckContext) -> List[Any]:
+        return [ctx.results[rule.name] for rule in self.select(ctx.only) if rule.scored and ctx.results.get(rule.name) is not None]
+
+    async def _run_early_exit(self, ctx: CheckContext) -> Dict[str, Any]:
+        """Дешёвые решающие правила - первыми; остановка, как только решение зафиксировано."""
+        # Фаза 1: локальные правила с готовыми входами, по стоимости на единицу возможного score;
+        # локальные правила, зависящие от локальных (device <- device_signals), - следующей волной
+        while not self._is_decided(ctx):
+            local = [
+                rule for rule in self.select(ctx.only)
+                if rule.local and rule.name not in ctx.results and all(dep in ctx.results for dep in rule.depends_on)
+            ]
+            if not local:
+                break
+            local.sort(key=lambda rule: rule.cost_ms / max(1, rule.upper_bound()))
+            for rule in local:
+                if self._is_decided(ctx):
+                    break
+                await self._execute(rule, ctx, {})
+
+        # Фаза 2: остальные - конкурентно, пока решение не зафиксировано
+        if not self._is_decided(ctx):
+            tasks: Dict[str, asyncio.Task] = {}
+            for rule in self.select(ctx.only):
+                if rule.name not in ctx.results:
+                    tasks[rule.name] = asyncio.ensure_future(self._execute(rule, ctx, tasks))
+            pending = set(tasks.values())
+            try:
+                while pending and not self._is_decided(ctx):
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+            finally:
+                for task in pending:
+                    task.cancel()
+
+        for rule in self.select(ctx.only):
+            if rule.name not in ctx.results and rule.name not in ctx.degraded:
+                ctx.skipped.append(rule.name)
+        ctx.decided = bool(ctx.skipped)
+        return ctx.results
+
+    def score_results(self, ctx: CheckContext) -> List[RuleResult]:
+        """Результаты scored-правил в порядке движка; пропущенные правила - degraded:<rule>."""
+        results = []
+        degraded = ctx.degraded
+        for rule in self.select(ctx.only):
+            if degraded and rule.name in degraded:
+                results.append(rule.degraded_result)
+            elif rule.scored and rule.name in ctx.results:
+                results.append(ctx.results[rule.name])
+        return results
+
+    def score_parts(self, ctx: CheckContext) -> List[Tuple[int, Optional[str]]]:
+        """Пары (score_delta, fraud_flag) для aggregate_score_and_flags."""
+        return [(result.score_delta, result.fraud_flag) for result in self.score_results(ctx)]
+
+    def memo_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Статистика LRU мемоизируемых правил."""
+        return {rule.name: rule.memo.stats() for rule in self.rules if rule.memo is not None}
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+# Глобальный движок правил
+rule_engine = RuleEngine(max_workers=settings.rule_executor_workers)
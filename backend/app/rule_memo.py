@@ -0,0 +1,113 @@
+"""
+Мемоизация чистых правил по объявленным входам.
+
+Правило объявляет ключи входов (memo_inputs): поля запроса (в т.ч. вложенные
+через точку, "device_info.platform"), результаты зависимостей ("results.<rule>")
+и "ruleset" - версию декларативных правил, чтобы перезагрузка файла правил не
+отдавала старые веса. Результат хранится в ограниченном LRU этого правила.
+
+Кэшировать можно только локальные правила без побочных эффектов: правила со
+счётчиками (частота отпечатка устройства) помечаются side_effects=True.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, Hashable, Iterable, Tuple
+from collections import OrderedDict
+
+Getter = Callable[[Any], Any]
+
+
+def _freeze(value: Any) -> Hashable:
+    """dict/list из запроса (device_info) -> хэшируемое значение ключа.
+    Тег контейнера различает {"a": 1} и [["a", 1]] - иначе они дали бы один ключ."""
+    if isinstance(value, dict):
+        return ("d", tuple(sorted((k, _freeze(v)) for k, v in value.items())))
+    if isinstance(value, (list, tuple)):
+        return ("l", tuple(_freeze(v) for v in value))
+    return value
+
+
+def input_getter(key: str) -> Getter:
+    """Геттер значения входа правила по его ключу."""
+    if not isinstance(key, str) or not key:
+        raise ValueError(f"Invalid memo input: {key!r}")
+    if key == "ruleset":
+        return lambda ctx: ctx.ruleset.version if ctx.ruleset is not None else None
+    parts = key.split(".")
+    if parts[0] == "results":
+        if len(parts) != 2:
+            raise ValueError(f"Invalid memo input: {key!r}")
+        name = parts[1]
+        return lambda ctx: ctx.results.get(name)
+    attr, nested = parts[0], parts[1:]
+
+    def getter(ctx: Any) -> Any:
+        value = getattr(ctx.payload, attr, None)
+        for part in nested:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(part)
+        return value
+    return getter
+
+
+class RuleMemo:
+    """LRU результатов одного правила; счётчики попаданий для /api/metrics.
+
+    Локальные правила выполняются в потоке event loop, поэтому без блокировки.
+    """
+
+    def __init__(self, inputs: Iterable[str], maxsize: int = 4096):
+        self.inputs: Tuple[str, ...] = tuple(inputs)
+        self._getters = tuple(input_getter(key) for key in self.inputs)
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, ctx: Any) -> Hashable:
+        key = tuple(getter(ctx) for getter in self._getters)
+        try:
+            hash(key)
+        except TypeError:
+            key = _freeze(key)
+        return key
+
+    def get_or_compute(self, ctx: Any, compute: Callable[[Any], Any]) -> Any:
+        key = self.key(ctx)
+        entries = self._entries
+        try:
+            value = entries[key]
+        except KeyError:
+            self.misses += 1
+            value = entries[key] = compute(ctx)
+            if len(entries) > self.maxsize:
+                entries.popitem(last=False)
+                self.evictions += 1
+            return value
+        self.hits += 1
+        entries.move_to_end(key)
+        return value
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inputs": list(self.inputs),
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hit_rate, 4),
+        }
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = self.misses = self.evictions = 0
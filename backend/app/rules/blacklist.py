@@ -1,22 +1,36 @@
 from __future__ import annotations
-from typing import Optional
+from typing import Optional, Iterable, Set
 from sqlalchemy.orm import Session
 from sqlalchemy import select
 from ..models import BlacklistIP
 from ..config import settings
-from pydantic import BaseModel
+from .result import RuleResult, NO_SIGNAL, FLAG_IP_BLACKLISTED
 
 
-class BlacklistRuleResult(BaseModel):
-    score_delta: int
-    fraud_flag: Optional[str] = None
+# Совместимость: все правила возвращают общий RuleResult
+BlacklistRuleResult = RuleResult
 
 
-def check_blacklist_ip(db: Session, ip: Optional[str]) -> BlacklistRuleResult:
+def check_blacklist_ip(db: Session, ip: Optional[str]) -> RuleResult:
     if not ip:
-        return BlacklistRuleResult(score_delta=0, fraud_flag=None)
+        return NO_SIGNAL
     q = select(BlacklistIP).where(BlacklistIP.ip == ip)
     row = db.execute(q).scalar_one_or_none()
     if row is not None:
-        return BlacklistRuleResult(score_delta=settings.score_ip_blacklisted, fraud_flag="ip_blacklisted")
-    return BlacklistRuleResult(score_delta=0, fraud_flag=None)
+        return RuleResult(score_delta=settings.score_ip_blacklisted, fraud_flag=FLAG_IP_BLACKLISTED)
+    return NO_SIGNAL
+
+
+def blacklisted_ips(db: Session, ips: Iterable[Optional[str]]) -> Set[str]:
+    """Какие из ip в blacklist - одним запросом."""
+    values = {ip for ip in ips if ip}
+    if not values:
+        return set()
+    q = select(BlacklistIP.ip).where(BlacklistIP.ip.in_(values))
+    return set(db.execute(q).scalars())
+
+
+def blacklist_result(is_blacklisted: bool) -> RuleResult:
+    if is_blacklisted:
+        return RuleResult(score_delta=settings.score_ip_blacklisted, fraud_flag=FLAG_IP_BLACKLISTED)
+    return NO_SIGNAL
@@ -4,7 +4,7 @@ import hashlib
 import re
 from ..cache import device_cache
 from ..config import settings
-from pydantic import BaseModel
+from .result import RuleResult, NO_SIGNAL, FLAG_SUSPICIOUS_USER_AGENT, FLAG_SUSPICIOUS_SCREEN_RESOLUTION, FLAG_SUSPICIOUS_DEVICE, FLAG_FREQUENT_DEVICE_FINGERPRINT
 
 # Расширенные паттерны подозрительных устройств
 SUSPICIOUS_PATTERNS = [
@@ -40,14 +40,13 @@ SUSPICIOUS_SCREEN_RESOLUTIONS = [
 ]
 
 
-class DeviceRuleResult(BaseModel):
-    score_delta: int
-    fraud_flag: Optional[str] = None
+# Совместимость: все правила возвращают общий RuleResult
+DeviceRuleResult = RuleResult
 
 
-def check_device(device_info: Optional[Dict[str, Any]], user_agent: Optional[str]) -> DeviceRuleResult:
+def check_device(device_info: Optional[Dict[str, Any]], user_agent: Optional[str]) -> RuleResult:
     if not device_info and not user_agent:
-        return DeviceRuleResult(score_delta=0, fraud_flag=None)
+        return NO_SIGNAL
 
     ua = (user_agent or "").lower()
     platform = str(device_info.get("platform", "")) if device_info else ""
@@ -56,7 +55,7 @@ def check_device(device_info: Optional[Dict[str, Any]], user_agent: Optional[str
     # Проверяем подозрительные User-Agent паттерны
     for pattern in SUSPICIOUS_UA_PATTERNS:
         if re.search(pattern, ua, re.IGNORECASE):
-            return DeviceRuleResult(score_delta=settings.score_device_suspicious, fraud_flag="suspicious_user_agent")
+            return RuleResult(score_delta=settings.score_device_suspicious, fraud_flag=FLAG_SUSPICIOUS_USER_AGENT)
 
     # Проверяем подозрительные screen resolutions
     screen_width = screen.get("width", 0)
@@ -64,25 +63,41 @@ def check_device(device_info: Optional[Dict[str, Any]], user_agent: Optional[str
     for suspicious_res in SUSPICIOUS_SCREEN_RESOLUTIONS:
         if (screen_width == suspicious_res["width"] and 
             screen_height == suspicious_res["height"]):
-            return DeviceRuleResult(score_delta=settings.score_device_suspicious, fraud_flag="suspicious_screen_resolution")
+            return RuleResult(score_delta=settings.score_device_suspicious, fraud_flag=FLAG_SUSPICIOUS_SCREEN_RESOLUTION)
 
     # Проверяем старые паттерны
     for pattern in SUSPICIOUS_PATTERNS:
         p_platform = pattern.get("platform")
         ua_contains = pattern.get("userAgent_contains", "").lower()
         if (not p_platform or p_platform == platform) and (ua_contains in ua):
-            return DeviceRuleResult(score_delta=settings.score_device_suspicious, fraud_flag="suspicious_device")
+            return RuleResult(score_delta=settings.score_device_suspicious, fraud_flag=FLAG_SUSPICIOUS_DEVICE)
+
+    return device_fingerprint_frequency(device_info, user_agent)
+
+
+def device_fingerprint(device_info: Optional[Dict[str, Any]], user_agent: Optional[str]) -> str:
+    """MD5 отпечатка устройства (User-Agent, платформа, экран, язык, таймзона)."""
+    platform = str(device_info.get("platform", "")) if device_info else ""
+    screen = device_info.get("screen", {}) if device_info else {}
 
     # Создаём device fingerprint
     fingerprint_data = {
-        "user_agent": ua,
+        "user_agent": (user_agent or "").lower(),
         "platform": platform,
         "screen": screen,
         "language": device_info.get("language", "") if device_info else "",
         "timezone": device_info.get("timezone", "") if device_info else "",
     }
     fingerprint_str = str(sorted(fingerprint_data.items()))
-    fingerprint_hash = hashlib.md5(fingerprint_str.encode()).hexdigest()
+    return hashlib.md5(fingerprint_str.encode()).hexdigest()
+
+
+def device_fingerprint_frequency(device_info: Optional[Dict[str, Any]], user_agent: Optional[str]) -> RuleResult:
+    """Частота использования отпечатка устройства (не выражается декларативно - состояние в кэше)."""
+    if not device_info and not user_agent:
+        return NO_SIGNAL
+
+    fingerprint_hash = device_fingerprint(device_info, user_agent)
     
     # Проверяем частоту использования этого отпечатка
     cache_key = device_cache._make_key("device", fingerprint_hash)
@@ -91,6 +106,6 @@ def check_device(device_info: Optional[Dict[str, Any]], user_agent: Optional[str
     
     # Если отпечаток используется слишком часто - подозрительно
     if usage_count > 10:  # Более 10 использований за час
-        return DeviceRuleResult(score_delta=15, fraud_flag="frequent_device_fingerprint")
+        return RuleResult(score_delta=15, fraud_flag=FLAG_FREQUENT_DEVICE_FINGERPRINT)
 
-    return DeviceRuleResult(score_delta=0, fraud_flag=None)
+    return NO_SIGNAL
@@ -1,8 +1,8 @@
 from __future__ import annotations
 from typing import Optional, Set
 from ..config import settings
-from pydantic import BaseModel
 import re
+from .result import RuleResult, NO_SIGNAL, FLAG_TEMPORARY_EMAIL, FLAG_SUSPICIOUS_EMAIL, FLAG_INVALID_EMAIL
 
 # Расширенный список временных email доменов
 TEMP_DOMAINS: Set[str] = {
@@ -71,30 +71,29 @@ SUSPICIOUS_PATTERNS = [
 ]
 
 
-class EmailRuleResult(BaseModel):
-    score_delta: int
-    fraud_flag: Optional[str] = None
+# Совместимость: все правила возвращают общий RuleResult
+EmailRuleResult = RuleResult
 
 
-def check_email_reputation(email: str) -> EmailRuleResult:
+def check_email_reputation(email: str) -> RuleResult:
     if not email or "@" not in email:
-        return EmailRuleResult(score_delta=settings.score_temp_email, fraud_flag="invalid_email")
+        return RuleResult(score_delta=settings.score_temp_email, fraud_flag=FLAG_INVALID_EMAIL)
     
     # Извлекаем домен
     domain = email.split("@")[-1].lower().strip()
     
     # Проверяем временные домены
     if domain in TEMP_DOMAINS:
-        return EmailRuleResult(score_delta=settings.score_temp_email, fraud_flag="temporary_email")
+        return RuleResult(score_delta=settings.score_temp_email, fraud_flag=FLAG_TEMPORARY_EMAIL)
     
     # Проверяем подозрительные паттерны
     for pattern in SUSPICIOUS_PATTERNS:
         if re.search(pattern, email.lower()):
-            return EmailRuleResult(score_delta=settings.score_temp_email // 2, fraud_flag="suspicious_email")
+            return RuleResult(score_delta=settings.score_temp_email // 2, fraud_flag=FLAG_SUSPICIOUS_EMAIL)
     
     # Проверяем валидность email
     email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     if not re.match(email_pattern, email):
-        return EmailRuleResult(score_delta=settings.score_temp_email, fraud_flag="invalid_email")
+        return RuleResult(score_delta=settings.score_temp_email, fraud_flag=FLAG_INVALID_EMAIL)
     
-    return EmailRuleResult(score_delta=0, fraud_flag=None)
+    return NO_SIGNAL
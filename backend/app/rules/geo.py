@@ -1,9 +1,14 @@
 from __future__ import annotations
 from typing import Dict, Any, Optional
-from pydantic import BaseModel
+import asyncio
+import time
+from urllib.parse import urlsplit
 import httpx
 from ..cache import geo_cache, bin_cache
 from ..config import settings
+from ..metrics import observe_http
+from ..tracing import tracer
+from .result import RuleResult, FLAG_GEO_MISMATCH
 
 # Простой мок BIN->country (fallback)
 BIN_MOCK = {
@@ -19,11 +24,28 @@ BIN_API_ENDPOINTS = [
     "https://binlist.net/api/v1/",  # Альтернативный
 ]
 
+# API геолокации: шаблон URL и поле страны в ответе (по порядку fallback'а)
+GEO_API_ENDPOINTS = [
+    ("https://ipapi.co/{ip}/json/", "country_code"),
+    ("https://ip-api.com/json/{ip}", "countryCode"),
+    ("https://ipinfo.io/{ip}/json", "country"),
+]
+
+
+def provider_url(url: str) -> str:
+    """Подменяет хост провайдера по settings.provider_base_urls (локальные заглушки)."""
+    overrides = settings.provider_base_urls
+    if not overrides:
+        return url
+    parts = urlsplit(url)
+    base = overrides.get(parts.hostname or "")
+    if base is None:
+        return url
+    return base.rstrip("/") + parts.path + (f"?{parts.query}" if parts.query else "")
+
 
-class GeoRuleResult(BaseModel):
-    score_delta: int
-    fraud_flag: Optional[str] = None
-    details: Dict[str, Any] | None = None
+# Совместимость: все правила возвращают общий RuleResult
+GeoRuleResult = RuleResult
 
 
 async def get_ip_country(ip: Optional[str]) -> Optional[str]:
@@ -36,34 +58,28 @@ async def get_ip_country(ip: Optional[str]) -> Optional[str]:
     if cached is not None:
         return cached
     
-    # Список API для геолокации
-    geo_apis = [
-        f"https://ipapi.co/{ip}/json/",
-        f"https://ip-api.com/json/{ip}",
-        f"https://ipinfo.io/{ip}/json",
-    ]
-    
-    for url in geo_apis:
-        try:
-            async with httpx.AsyncClient(timeout=3.0) as client:
-                response = await client.get(url)
-                if response.status_code == 200:
-                    data = response.json()
-                    country = None
-                    
-                    # Разные API возвращают данные в разных форматах
-                    if "ipapi.co" in url:
-                        country = data.get("country_code")
-                    elif "ip-api.com" in url:
-                        country = data.get("countryCode")
-                    elif "ipinfo.io" in url:
-                        country = data.get("country")
-                    
-                    if country:
-                        geo_cache.set(cache_key, country, ttl=86400)  # 24 часа
-                        return country
-        except Exception:
-            continue
+    for attempt, (template, field) in enumerate(GEO_API_ENDPOINTS):
+        # Спан на попытку: какой провайдер цепочки ответил и сколько заняли отказы
+        with tracer.span("GET geo", kind="CLIENT", remote=urlsplit(template).hostname, attempt=attempt) as span:
+            try:
+                url = provider_url(template.format(ip=ip))
+                async with httpx.AsyncClient(timeout=3.0) as client:
+                    started = time.perf_counter()
+                    try:
+                        response = await client.get(url)
+                    finally:
+                        observe_http("geo", time.perf_counter() - started)
+                    span.tag("http.status_code", response.status_code)
+                    if response.status_code == 200:
+                        # Разные API возвращают страну в разных полях
+                        country = response.json().get(field)
+                        if country:
+                            span.tag("answered", True)
+                            geo_cache.set(cache_key, country, ttl=86400)  # 24 часа
+                            return country
+            except Exception as e:
+                span.tag("error", type(e).__name__)
+                continue
     
     return None
 
@@ -79,19 +95,27 @@ async def bin_country_lookup(bin6: Optional[str]) -> Optional[str]:
         return cached
     
     # Пробуем реальные API
-    for api_url in BIN_API_ENDPOINTS:
-        try:
-            url = f"{api_url}{bin6[:6]}"
-            async with httpx.AsyncClient(timeout=3.0) as client:
-                response = await client.get(url)
-                if response.status_code == 200:
-                    data = response.json()
-                    country = data.get("country", {}).get("alpha2")
-                    if country:
-                        bin_cache.set(cache_key, country, ttl=86400)  # 24 часа
-                        return country
-        except Exception:
-            continue
+    for attempt, api_url in enumerate(BIN_API_ENDPOINTS):
+        with tracer.span("GET bin", kind="CLIENT", remote=urlsplit(api_url).hostname, attempt=attempt) as span:
+            try:
+                url = provider_url(f"{api_url}{bin6[:6]}")
+                async with httpx.AsyncClient(timeout=3.0) as client:
+                    started = time.perf_counter()
+                    try:
+                        response = await client.get(url)
+                    finally:
+                        observe_http("bin", time.perf_counter() - started)
+                    span.tag("http.status_code", response.status_code)
+                    if response.status_code == 200:
+                        data = response.json()
+                        country = data.get("country", {}).get("alpha2")
+                        if country:
+                            span.tag("answered", True)
+                            bin_cache.set(cache_key, country, ttl=86400)  # 24 часа
+                            return country
+            except Exception as e:
+                span.tag("error", type(e).__name__)
+                continue
     
     # Fallback на мок данные
     country = BIN_MOCK.get(bin6[:6])
@@ -100,11 +124,15 @@ async def bin_country_lookup(bin6: Optional[str]) -> Optional[str]:
     return country
 
 
-async def check_geo_and_bin(bin6: Optional[str], ip: Optional[str]) -> GeoRuleResult:
-    ip_country = await get_ip_country(ip)
-    bin_country = await bin_country_lookup(bin6)
-
+def geo_mismatch(ip_country: Optional[str], bin_country: Optional[str]) -> RuleResult:
+    """Сравнивает страну IP и страну BIN (без сетевых запросов)."""
     if ip_country and bin_country and ip_country != bin_country:
-        return GeoRuleResult(score_delta=settings.score_geo_mismatch, fraud_flag="geo_mismatch", details={"ip_country": ip_country, "bin_country": bin_country})
+        return RuleResult(score_delta=settings.score_geo_mismatch, fraud_flag=FLAG_GEO_MISMATCH, details={"ip_country": ip_country, "bin_country": bin_country})
+
+    return RuleResult(score_delta=0, fraud_flag=None, details={"ip_country": ip_country, "bin_country": bin_country})
+
 
-    return GeoRuleResult(score_delta=0, fraud_flag=None, details={"ip_country": ip_country, "bin_country": bin_country})
+async def check_geo_and_bin(bin6: Optional[str], ip: Optional[str]) -> RuleResult:
+    # Lookup'ы независимы - выполняем параллельно
+    ip_country, bin_country = await asyncio.gather(get_ip_country(ip), bin_country_lookup(bin6))
+    return geo_mismatch(ip_country, bin_country)
@@ -0,0 +1,52 @@
+"""
+Результат правила - компактный объект со __slots__ вместо pydantic-модели.
+
+Правила создаются на каждую проверку, валидация им не нужна (значения формирует
+наш код); pydantic остаётся только на границе API (schemas.py).
+"""
+from __future__ import annotations
+from typing import Any, Dict, Optional
+
+
+class RuleResult:
+    __slots__ = ("score_delta", "fraud_flag", "details")
+
+    def __init__(self, score_delta: int = 0, fraud_flag: Optional[str] = None, details: Optional[Dict[str, Any]] = None):
+        self.score_delta = score_delta
+        # None - правило не сработало
+        self.fraud_flag = fraud_flag
+        self.details = details
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, RuleResult):
+            return NotImplemented
+        return (self.score_delta, self.fraud_flag, self.details) == (other.score_delta, other.fraud_flag, other.details)
+
+    def __repr__(self) -> str:
+        return f"RuleResult(score_delta={self.score_delta!r}, fraud_flag={self.fraud_flag!r}, details={self.details!r})"
+
+
+# Общий результат "не сработало" - не изменяется, поэтому не аллоцируется заново
+NO_SIGNAL = RuleResult(0)
+
+# Флаги - строковые литералы-идентификаторы интернируются интерпретатором,
+# поэтому во всех результатах это одна и та же строка
+FLAG_GEO_MISMATCH = "geo_mismatch"
+FLAG_TIMEZONE_MISMATCH = "timezone_mismatch"
+FLAG_TEMPORARY_EMAIL = "temporary_email"
+FLAG_SUSPICIOUS_EMAIL = "suspicious_email"
+FLAG_INVALID_EMAIL = "invalid_email"
+FLAG_TOO_MANY_ATTEMPTS = "too_many_attempts"
+FLAG_BOT_LIKE_ACTIVITY = "bot_like_activity"
+FLAG_AUTOFILL_OR_BOT = "autofill_or_bot"
+FLAG_SUSPICIOUS_USER_AGENT = "suspicious_user_agent"
+FLAG_SUSPICIOUS_SCREEN_RESOLUTION = "suspicious_screen_resolution"
+FLAG_SUSPICIOUS_DEVICE = "suspicious_device"
+FLAG_FREQUENT_DEVICE_FINGERPRINT = "frequent_device_fingerprint"
+FLAG_IP_BLACKLISTED = "ip_blacklisted"
+FLAG_ML_HIGH_RISK = "ml_high_risk"
+FLAG_ML_MEDIUM_RISK = "ml_medium_risk"
+FLAG_ML_LOW_RISK = "ml_low_risk"
+FLAG_BEHAVIORAL_HIGH_RISK = "behavioral_high_risk"
+FLAG_BEHAVIORAL_MEDIUM_RISK = "behavioral_medium_risk"
+FLAG_BEHAVIORAL_LOW_RISK = "behavioral_low_risk"
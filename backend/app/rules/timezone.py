@@ -1,6 +1,6 @@
 from __future__ import annotations
 from typing import Optional
-from pydantic import BaseModel
+from .result import RuleResult, NO_SIGNAL, FLAG_TIMEZONE_MISMATCH
 
 # Грубая карта стран к основным таймзонам
 COUNTRY_TIMEZONES = {
@@ -21,23 +21,22 @@ COUNTRY_TIMEZONES = {
 }
 
 
-class TimezoneRuleResult(BaseModel):
-    score_delta: int
-    fraud_flag: Optional[str] = None
+# Совместимость: все правила возвращают общий RuleResult
+TimezoneRuleResult = RuleResult
 
 
-def check_timezone_mismatch(ip_country: Optional[str], timezone: Optional[str]) -> TimezoneRuleResult:
+def check_timezone_mismatch(ip_country: Optional[str], timezone: Optional[str]) -> RuleResult:
     """Проверяет несоответствие IP-страны и таймзоны."""
     if not ip_country or not timezone:
-        return TimezoneRuleResult(score_delta=0, fraud_flag=None)
+        return NO_SIGNAL
     
     expected_zones = COUNTRY_TIMEZONES.get(ip_country, [])
     if not expected_zones:
-        return TimezoneRuleResult(score_delta=0, fraud_flag=None)
+        return NO_SIGNAL
     
     # Простая проверка: если таймзона не содержит ожидаемые зоны
     timezone_lower = timezone.lower()
     if not any(zone.lower() in timezone_lower for zone in expected_zones):
-        return TimezoneRuleResult(score_delta=20, fraud_flag="timezone_mismatch")
+        return RuleResult(score_delta=20, fraud_flag=FLAG_TIMEZONE_MISMATCH)
     
-    return TimezoneRuleResult(score_delta=0, fraud_flag=None)
+    return NO_SIGNAL
@@ -1,32 +1,96 @@
 from __future__ import annotations
-from typing import Optional
+from typing import Deque, Optional, Iterable, Dict, Tuple
+from collections import deque
+import time
 from sqlalchemy.orm import Session
 from sqlalchemy import select, func
 from ..models import FraudCheck
 from ..config import settings
-from pydantic import BaseModel
 from datetime import datetime, timedelta
+from .result import RuleResult, NO_SIGNAL, FLAG_TOO_MANY_ATTEMPTS
 
 
-class VelocityRuleResult(BaseModel):
-    score_delta: int
-    fraud_flag: Optional[str] = None
+# Совместимость: все правила возвращают общий RuleResult
+VelocityRuleResult = RuleResult
 
 
-def check_velocity(db: Session, email: str, ip: str) -> VelocityRuleResult:
+VELOCITY_WINDOW_MINUTES = 5
+VELOCITY_MAX_ATTEMPTS = 3
+
+
+def velocity_result(attempts_email: int, attempts_ip: int) -> RuleResult:
+    if attempts_email > VELOCITY_MAX_ATTEMPTS or attempts_ip > VELOCITY_MAX_ATTEMPTS:
+        return RuleResult(score_delta=settings.score_velocity, fraud_flag=FLAG_TOO_MANY_ATTEMPTS)
+    return NO_SIGNAL
+
+
+def check_velocity(db: Session, email: str, ip: str, exclude_id: Optional[int] = None) -> RuleResult:
     # Кол-во попыток за последние 5 минут по email и ip
-    since = datetime.utcnow() - timedelta(minutes=5)
+    # exclude_id - сама пересчитываемая проверка: её строка может уже быть в БД, а может ещё нет
+    since = datetime.utcnow() - timedelta(minutes=VELOCITY_WINDOW_MINUTES)
     # Приведение created_at (timezone-aware) к naive UTC может отличаться, для MVP используем >= since по серверному времени
     q = select(func.count()).select_from(FraudCheck).where(
         FraudCheck.email == email,
     ).where(FraudCheck.created_at >= since)
-    attempts_email = db.execute(q).scalar() or 0
-
     q2 = select(func.count()).select_from(FraudCheck).where(
         FraudCheck.ip == ip,
     ).where(FraudCheck.created_at >= since)
+    if exclude_id is not None:
+        q = q.where(FraudCheck.id != exclude_id)
+        q2 = q2.where(FraudCheck.id != exclude_id)
+    attempts_email = db.execute(q).scalar() or 0
     attempts_ip = db.execute(q2).scalar() or 0
 
-    if attempts_email > 3 or attempts_ip > 3:
-        return VelocityRuleResult(score_delta=settings.score_velocity, fraud_flag="too_many_attempts")
-    return VelocityRuleResult(score_delta=0, fraud_flag=None)
+    return velocity_result(attempts_email, attempts_ip)
+
+
+def velocity_counts(db: Session, emails: Iterable[str], ips: Iterable[str]) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Попытки за окно для множества email и ip - по одному GROUP BY запросу на измерение."""
+    since = datetime.utcnow() - timedelta(minutes=VELOCITY_WINDOW_MINUTES)
+    result = []
+    for column, values in ((FraudCheck.email, set(emails)), (FraudCheck.ip, set(ips))):
+        counts: Dict[str, int] = {}
+        if values:
+            q = select(column, func.count()).where(column.in_(values)).where(FraudCheck.created_at >= since).group_by(column)
+            counts = {value: count for value, count in db.execute(q)}
+        result.append(counts)
+    return result[0], result[1]
+
+
+class RecentAttempts:
+    """Попытки за окно velocity в памяти процесса - для предварительного скоринга без БД.
+
+    Видит только проверки своего воркера; окончательный результат даёт check_velocity.
+    """
+
+    def __init__(self, window_seconds: int = VELOCITY_WINDOW_MINUTES * 60, sweep_every: int = 1000):
+        self.window = window_seconds
+        self.sweep_every = sweep_every
+        self._hits: Dict[str, Deque[float]] = {}
+        self._calls = 0
+
+    def _count_and_record(self, key: str, now: float) -> int:
+        hits = self._hits.get(key)
+        if hits is None:
+            hits = self._hits[key] = deque()
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+        count = len(hits)
+        hits.append(now)
+        return count
+
+    def hit(self, email: str, ip: str) -> RuleResult:
+        """Результат velocity по попыткам до текущей (как запрос к БД) и учёт текущей."""
+        now = time.monotonic()
+        self._calls += 1
+        if self._calls % self.sweep_every == 0:
+            self._sweep(now)
+        return velocity_result(self._count_and_record(f"email:{email}", now), self._count_and_record(f"ip:{ip}", now))
+
+    def _sweep(self, now: float) -> None:
+        for key in [key for key, hits in self._hits.items() if not hits or hits[-1] <= now - self.window]:
+            del self._hits[key]
+
+
+# Глобальный счётчик попыток в памяти
+recent_attempts = RecentAttempts()
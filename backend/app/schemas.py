@@ -21,6 +21,24 @@ class CheckRequest(BaseModel):
     device_info: Optional[Dict[str, Any]] = None
 
 
+class CheckSessionUpdate(BaseModel):
+    """Поля CheckRequest, известные на момент start/update сессии."""
+    email: Optional[str] = None
+    bin: Optional[str] = None
+    user_agent: Optional[str] = None
+    ip: Optional[str] = None
+    timezone: Optional[str] = None
+    language: Optional[str] = None
+    device_info: Optional[Dict[str, Any]] = None
+
+
+class CheckSessionResponse(BaseModel):
+    session_id: str
+    expires_in: int
+    # Lookup'ы, запущенные этим вызовом
+    started: List[str] = []
+
+
 class RuleResult(BaseModel):
     score_delta: int
     fraud_flag: Optional[str] = None  # None если правило не сработало
@@ -42,3 +60,13 @@ class CheckResponse(BaseModel):
     recommendation: str
     check_id: Optional[int] = None
     ml_analysis: Optional[MLAnalysis] = None
+    # True - предварительный ответ, после фонового обогащения вердикт может быть пересмотрен
+    provisional: Optional[bool] = None
+
+
+class BatchCheckRequest(BaseModel):
+    checks: List[CheckRequest] = Field(min_length=1)
+
+
+class BatchCheckResponse(BaseModel):
+    results: List[CheckResponse]
@@ -0,0 +1,184 @@
+"""
+Потоковый скоринг NDJSON: строка CheckRequest на входе -> строка CheckResponse на выходе.
+
+Вход читается только когда есть свободный слот (backpressure), результаты
+отдаются сразу и сохраняются микро-батчами, поэтому память не зависит от размера входа.
+Строки длиннее stream_max_line_bytes не копятся - на их месте в выводе ошибка,
+как и на месте строк не в UTF-8; сбой записи батча тоже отдаётся ошибками его строк.
+
+persist=False - перескоринг без записи: строки FraudCheck с created_at = сейчас
+попали бы в velocity живых проверок тех же email/IP, а повтор уже проверенной
+брони - в индекс доверия.
+"""
+from __future__ import annotations
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, List, Optional, Tuple, Union
+import asyncio
+import json
+import logging
+from pydantic import ValidationError
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from .config import settings
+from .schemas import CheckRequest
+from .pipeline import ScoredCheck, score_check
+from .trust import observe_check
+from .metrics import Stage, count_check
+from .profiles import PROFILES, PipelineProfile
+from .rule_engine import rule_engine
+
+logger = logging.getLogger("antifraud.streaming")
+
+class NDJSONStreamResponse(StreamingResponse):
+    """StreamingResponse, генератор которого сам читает тело запроса.
+
+    Стандартный StreamingResponse параллельно ждёт http.disconnect через receive()
+    и перехватывает сообщения с телом; отключение клиента здесь обнаружит request.stream().
+    """
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+# Вместо строки длиннее лимита
+LINE_TOO_LONG = object()
+# Вместо строки, которая не декодируется как UTF-8
+INVALID_UTF8 = object()
+
+
+def _decode(line: bytes) -> Union[str, object]:
+    try:
+        return line.decode()
+    except UnicodeDecodeError:
+        return INVALID_UTF8
+
+
+async def iter_lines(chunks: AsyncIterable[bytes], max_line: Optional[int] = None) -> AsyncIterator[Union[str, object]]:
+    """Разбивает поток байтов (например request.stream()) на строки; строка длиннее
+    max_line байт (по умолчанию stream_max_line_bytes) не буферизуется до конца - вместо неё LINE_TOO_LONG,
+    вместо строки не в UTF-8 - INVALID_UTF8."""
+    max_line = max_line or settings.stream_max_line_bytes
+    tail = b""
+    oversized = False
+    async for chunk in chunks:
+        tail += chunk
+        *lines, tail = tail.split(b"\n")
+        for line in lines:
+            if oversized or len(line) > max_line:
+                # Первая строка после переполнения - конец той же длинной строки
+                oversized = False
+                yield LINE_TOO_LONG
+            else:
+                yield _decode(line)
+        if len(tail) > max_line:
+            # Остаток до перевода строки отбрасывается
+            oversized = True
+            tail = b""
+    if oversized or len(tail) > max_line:
+        yield LINE_TOO_LONG
+    elif tail:
+        yield _decode(tail)
+
+
+async def aiter_lines(lines: Iterable[str]) -> AsyncIterator[str]:
+    """Асинхронная обёртка над синхронным источником строк (файл, список)."""
+    for line in lines:
+        yield line
+
+
+async def _score_line(line_no: int, raw: str, db: Session, profile: PipelineProfile, persist: bool) -> Tuple[int, Any]:
+    try:
+        payload = CheckRequest.model_validate_json(raw)
+    except ValidationError as e:
+        return line_no, f"invalid CheckRequest: {e.errors(include_url=False, include_input=False)}"
+    try:
+        return line_no, await score_check(payload, db, profile=profile, persist=persist)
+    except Exception as e:
+        return line_no, f"{type(e).__name__}: {e}"
+
+
+def _output_line(line_no: int, item: Any) -> str:
+    if isinstance(item, ScoredCheck):
+        return json.dumps({"line": line_no, **item.response().model_dump(exclude_none=True)}) + "\n"
+    return json.dumps({"line": line_no, "error": item}, default=str) + "\n"
+
+
+def _persist(bind: Engine, scored: List[ScoredCheck]) -> None:
+    """Сохраняет микро-батч одной транзакцией."""
+    with Session(bind=bind) as db:
+        db.add_all([row for item in scored for row in item.rows()])
+        db.commit()
+
+
+async def score_ndjson(
+    lines: AsyncIterable[Any],
+    bind: Engine,
+    concurrency: int = settings.stream_concurrency,
+    flush_size: int = settings.stream_flush_size,
+    first_line: int = 1,
+    profile: PipelineProfile = PROFILES["standard"],
+    persist: bool = True,
+    max_line: Optional[int] = None,
+) -> AsyncIterator[str]:
+    """Скорит NDJSON-поток, отдавая результаты по мере готовности (порядок - по завершению).
+    persist=False - только вывод, без записи проверок и обновления индекса доверия."""
+    max_line = max_line or settings.stream_max_line_bytes
+    db = Session(bind=bind)  # только как источник bind для DB-правил
+    source = lines.__aiter__()
+    loop = asyncio.get_running_loop()
+    pending: set = set()
+    buffer: List[ScoredCheck] = []
+    buffer_lines: List[int] = []
+    line_no = first_line - 1
+    exhausted = False
+    try:
+        while True:
+            # Читаем вход только при наличии свободных слотов
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    raw = await source.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                line_no += 1
+                if raw is INVALID_UTF8:
+                    yield _output_line(line_no, "line is not valid UTF-8")
+                elif raw is LINE_TOO_LONG or len(raw) > max_line:
+                    yield _output_line(line_no, f"line exceeds {max_line} bytes")
+                elif raw.strip():
+                    pending.add(asyncio.ensure_future(_score_line(line_no, raw, db, profile, persist)))
+
+            if pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    done_line, item = task.result()
+                    # check_id известен заранее - строку отдаём сразу, запись идёт батчем
+                    yield _output_line(done_line, item)
+                    if isinstance(item, ScoredCheck):
+                        count_check(profile.name, item.recommendation)
+                        if persist:
+                            observe_check(item)
+                            buffer.append(item)
+                            buffer_lines.append(done_line)
+
+            if buffer and (len(buffer) >= flush_size or not pending):
+                try:
+                    with Stage("stream_persist"):
+                        await loop.run_in_executor(rule_engine.executor, _persist, bind, buffer)
+                except Exception as e:
+                    # Результаты уже отданы - сообщаем, какие из них не сохранены, и продолжаем поток
+                    logger.error("Stream persist of %d checks failed: %s", len(buffer), e)
+                    for persisted_line in buffer_lines:
+                        yield _output_line(persisted_line, f"not persisted: {type(e).__name__}: {e}")
+                buffer, buffer_lines = [], []
+
+            if exhausted and not pending:
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+        db.close()
@@ -0,0 +1,280 @@
+"""
+Локальная трассировка проверок: спаны правил, SQL-запросов, вызовов Redis,
+попыток geo/BIN HTTP (с провайдером цепочки fallback'а) и WebSocket broadcast.
+
+Решение о записи принимается один раз на входе запроса (head-based sampling,
+TRACE_SAMPLE_RATE). Входящий W3C traceparent с флагом sampled включает запись
+всегда, но только от клиентов из TRACE_TRUSTED_NETWORKS - иначе любой клиент
+мог бы включить запись каждого своего запроса. У невыбранного запроса нет
+текущего спана, и все tracer.span() - no-op. Спанов в трассе не больше
+TRACE_MAX_SPANS: лишние не создаются, их число - в теге корня.
+Текущий спан лежит в contextvar, поэтому дочерние спаны видны из задач
+правил и из пула потоков (контекст копируется).
+
+Спаны пишутся в формате Zipkin v2 JSON, по спану на строку, в файл с ротацией
+(TRACE_FILE): трасса целиком - когда закрывается корневой спан.
+"""
+from __future__ import annotations
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, List, Optional
+import ipaddress
+import json
+import logging
+import os
+import random
+import threading
+import time
+from .config import settings
+
+SERVICE_NAME = "antifraud"
+
+
+def _new_id(bits: int = 64) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Trace:
+    __slots__ = ("trace_id", "root", "spans", "started", "dropped", "closed")
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.root: Optional["Span"] = None
+        # Завершённые дочерние спаны; пишутся вместе с корневым
+        self.spans: List["Span"] = []
+        # Созданных дочерних спанов и отброшенных сверх лимита
+        self.started = 0
+        self.dropped = 0
+        self.closed = False
+
+
+class Span:
+    __slots__ = ("tracer", "trace", "span_id", "parent_id", "name", "kind", "remote", "timestamp", "started", "duration", "tags", "_token")
+
+    def __init__(self, tracer: "Tracer", trace: Trace, name: str, parent_id: Optional[str] = None, kind: Optional[str] = None, remote: Optional[str] = None, tags: Optional[Dict[str, Any]] = None):
+        self.tracer = tracer
+        self.trace = trace
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.remote = remote
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.tags = {key: str(value) for key, value in tags.items()} if tags else {}
+        self._token = None
+
+    def tag(self, key: str, value: Any) -> None:
+        self.tags[key] = str(value)
+
+    def __enter__(self) -> "Span":
+        self._token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        if exc_type is not None:
+            self.tags["error"] = exc_type.__name__
+        current_span.reset(self._token)
+        self.finish()
+
+    def finish(self, duration: Optional[float] = None) -> None:
+        self.duration = time.perf_counter() - self.started if duration is None else duration
+        self.tracer._finished(self)
+
+    def as_zipkin(self) -> Dict[str, Any]:
+        span: Dict[str, Any] = {
+            "traceId": self.trace.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": int(self.timestamp * 1_000_000),
+            "duration": max(1, int((self.duration or 0) * 1_000_000)),
+            "localEndpoint": {"serviceName": SERVICE_NAME},
+        }
+        if self.parent_id:
+            span["parentId"] = self.parent_id
+        if self.kind:
+            span["kind"] = self.kind
+        if self.remote:
+            span["remoteEndpoint"] = {"serviceName": self.remote}
+        if self.tags:
+            span["tags"] = self.tags
+        return span
+
+
+class _NoopSpan:
+    """Спан невыбранного запроса: ничего не пишет и не меняет контекст."""
+
+    __slots__ = ()
+
+    def tag(self, key: str, value: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+# Текущий спан (None - запрос не выбран или вне запроса)
+current_span: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Dict[str, Any]]:
+    """W3C traceparent: 00-<trace id 32 hex>-<span id 16 hex>-<флаги>."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    return {"trace_id": parts[1], "parent_id": parts[2], "sampled": bool(flags & 1)}
+
+
+def trusted_networks(cidrs: List[str]) -> List[Any]:
+    return [ipaddress.ip_network(cidr, strict=False) for cidr in cidrs]
+
+
+class Tracer:
+    def __init__(self, path: str = "", sample_rate: float = 0.0, max_bytes: int = 50 * 1024 * 1024, backups: int = 5, max_spans: int = 500, trusted: Optional[List[Any]] = None):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.max_spans = max_spans
+        # Сети, которым разрешено включать запись флагом sampled в traceparent
+        self.trusted = trusted or []
+        self._handler: Optional[RotatingFileHandler] = None
+        self._lock = threading.Lock()
+        self.traces = 0
+
+    def configure(self, **options: Any) -> None:
+        """Меняет путь/частоту/ротацию; файл переоткрывается при следующей записи."""
+        with self._lock:
+            for name, value in options.items():
+                setattr(self, name, value)
+            if self._handler is not None:
+                self._handler.close()
+                self._handler = None
+
+    def is_trusted(self, client: Optional[str]) -> bool:
+        if not client or not self.trusted:
+            return False
+        try:
+            address = ipaddress.ip_address(client)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted)
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, client: Optional[str] = None, **tags: Any) -> Optional[Span]:
+        """Корневой спан, если запрос выбран для записи, иначе None; client - адрес клиента
+        (флаг sampled входящего traceparent учитывается только от доверенных сетей)."""
+        if not self.path:
+            return None
+        incoming = parse_traceparent(traceparent)
+        if incoming is not None and incoming["sampled"] and self.is_trusted(client):
+            trace, parent_id = Trace(incoming["trace_id"]), incoming["parent_id"]
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            # Выбран нашим сэмплингом - продолжаем входящую трассу, если она есть
+            trace, parent_id = (Trace(incoming["trace_id"]), incoming["parent_id"]) if incoming else (Trace(_new_id(128)), None)
+        else:
+            return None
+        trace.root = Span(self, trace, name, parent_id=parent_id, kind="SERVER", tags=tags)
+        return trace.root
+
+    def _child(self, name: str, kind: Optional[str], remote: Optional[str], tags: Dict[str, Any]) -> Optional[Span]:
+        parent = current_span.get()
+        if parent is None:
+            return None
+        trace = parent.trace
+        if trace.started >= self.max_spans:
+            trace.dropped += 1
+            return None
+        trace.started += 1
+        return Span(self, trace, name, parent_id=parent.span_id, kind=kind, remote=remote, tags=tags)
+
+    def span(self, name: str, kind: Optional[str] = None, remote: Optional[str] = None, **tags: Any) -> Any:
+        """with tracer.span("rule velocity"): ... - дочерний спан текущего (no-op вне трассы и сверх лимита)."""
+        return self._child(name, kind, remote, tags) or NOOP_SPAN
+
+    def record(self, name: str, seconds: float, kind: Optional[str] = None, remote: Optional[str] = None, **tags: Any) -> None:
+        """Уже завершённая операция длительностью seconds (точки замера метрик)."""
+        span = self._child(name, kind, remote, tags)
+        if span is None:
+            return
+        span.timestamp -= seconds
+        span.finish(seconds)
+
+    def _finished(self, span: Span) -> None:
+        trace = span.trace
+        if span is trace.root:
+            trace.closed = True
+            if trace.dropped:
+                span.tag("spans.dropped", trace.dropped)
+            self.traces += 1
+            self._write(trace.spans + [span])
+        elif trace.closed:
+            # Фоновая задача запроса пережила корневой спан - пишем спан отдельно
+            self._write([span])
+        else:
+            trace.spans.append(span)
+
+    def _write(self, spans: List[Span]) -> None:
+        lines = "\n".join(json.dumps(s.as_zipkin(), separators=(",", ":")) for s in spans)
+        with self._lock:
+            if self._handler is None:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+                self._handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8")
+                self._handler.setFormatter(logging.Formatter("%(message)s"))
+            self._handler.emit(logging.makeLogRecord({"msg": lines, "levelno": logging.INFO, "levelname": "INFO"}))
+
+
+class TracingMiddleware:
+    """ASGI middleware: корневой спан запроса к TRACE_PATHS (точное совпадение пути) и заголовок X-Trace-Id."""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or not tracer.path or scope["path"] not in settings.trace_paths_tuple:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or ())
+        traceparent = headers.get(b"traceparent")
+        client = scope.get("client")
+        root = tracer.start_trace(
+            f"{scope['method']} {scope['path']}",
+            traceparent.decode("latin-1") if traceparent else None,
+            client=client[0] if client else None,
+        )
+        if root is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_trace_id(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                root.tag("http.status_code", message["status"])
+                message = {**message, "headers": [*message.get("headers", []), (b"x-trace-id", root.trace.trace_id.encode("latin-1"))]}
+            await send(message)
+
+        with root:
+            await self.app(scope, receive, send_with_trace_id)
+
+
+# Глобальный трассировщик воркера
+tracer = Tracer(
+    path=settings.trace_file,
+    sample_rate=settings.trace_sample_rate,
+    max_bytes=settings.trace_file_max_mb * 1024 * 1024,
+    backups=settings.trace_file_backups,
+    max_spans=settings.trace_max_spans,
+    trusted=trusted_networks(settings.trace_trusted_networks_list),
+)
@@ -0,0 +1,263 @@
+"""
+Индекс доверия постоянных клиентов.
+
+Сущность - связка email + отпечаток устройства + BIN. Если у неё подряд
+trust_min_checks проверок с низким риском в пределах окна, разнесённых не
+меньше чем на trust_min_spacing_hours (серия коротких "чистых" запросов подряд
+доверия не даёт), /api/check считает её сокращённым набором правил
+(TRUSTED_PROFILE). В серию идут только проверки полным набором правил:
+результат TRUSTED_PROFILE лишь продлевает last_seen, а каждая
+trust_full_every-я проверка доверенной связки снова идёт полным профилем -
+geo, BIN, email и устройство могут отозвать доверие.
+
+Индекс строится из истории FraudCheck в фоне после старта (последние
+trust_rebuild_max_rows проверок окна, батчами в пуле потоков) и обновляется
+каждой проверкой. Проверка с высоким риском сбрасывает все связки этого email,
+изменение blacklist - связки, проходившие через этот IP.
+
+Индекс живёт в памяти воркера: другой воркер узнает о сбросе по своим
+проверкам, а blacklist и velocity входят в сокращённый набор правил.
+"""
+from __future__ import annotations
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from collections import OrderedDict
+import asyncio
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import time
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from .config import settings
+from .models import FraudCheck
+from .profiles import PipelineProfile
+from .rules.device import device_fingerprint
+
+logger = logging.getLogger("antifraud.trust")
+
+# Сокращённый набор: без внешних lookup'ов (geo/BIN) и ML, но с blacklist,
+# velocity и бот-эвристиками - они ловят захват аккаунта
+TRUSTED_PROFILE = PipelineProfile("trusted", rules=("bot", "blacklist", "velocity"), anomaly_detection=False)
+
+# Сколько последних IP помнить для сброса по blacklist
+MAX_ENTRY_IPS = 8
+
+EntityKey = Tuple[str, str, str]
+
+
+def entity_key(email: Optional[str], bin: Optional[str], device_info: Optional[Dict[str, Any]], user_agent: Optional[str]) -> Optional[EntityKey]:
+    """None - связка неполная (нет email, BIN или данных устройства), доверие не копится."""
+    if not email or not bin or not (device_info or user_agent):
+        return None
+    return email.strip().lower(), device_fingerprint(device_info, user_agent), bin[:16]
+
+
+class TrustEntry:
+    __slots__ = ("low_streak", "last_counted", "last_check_id", "last_seen", "trusted_uses", "ips")
+
+    def __init__(self) -> None:
+        self.low_streak = 0
+        # Время последней проверки, засчитанной в серию (для разнесения по времени)
+        self.last_counted = 0.0
+        self.last_check_id: Optional[int] = None
+        self.last_seen = 0.0
+        # Проверок сокращённым профилем с последней полной
+        self.trusted_uses = 0
+        self.ips: Tuple[str, ...] = ()
+
+
+class TrustIndex:
+    def __init__(self, min_checks: int = 5, window_hours: int = 720, max_score: int = 20, max_entries: int = 100000, min_spacing_hours: float = 24, full_every: int = 10):
+        self.min_checks = min_checks
+        self.window = window_hours * 3600
+        self.max_score = max_score
+        self.max_entries = max_entries
+        self.min_spacing = min_spacing_hours * 3600
+        self.full_every = full_every
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self._entries: "OrderedDict[EntityKey, TrustEntry]" = OrderedDict()
+        # email -> связки (сброс всех устройств/карт email при high-risk)
+        self._by_email: Dict[str, Set[EntityKey]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _drop(self, key: EntityKey) -> None:
+        self._entries.pop(key, None)
+        keys = self._by_email.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_email[key[0]]
+
+    def is_trusted(self, key: Optional[EntityKey], now: Optional[float] = None) -> bool:
+        if key is None or self.min_checks <= 0:
+            return False
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        if (now or time.time()) - entry.last_seen > self.window:
+            self._drop(key)
+            return False
+        return entry.low_streak >= self.min_checks
+
+    def use_trusted(self, key: Optional[EntityKey], now: Optional[float] = None) -> bool:
+        """Считать ли эту проверку сокращённым набором: доверенная связка, кроме
+        каждой full_every-й проверки - она идёт полным профилем."""
+        if not self.is_trusted(key, now):
+            return False
+        entry = self._entries[key]
+        if self.full_every > 0 and entry.trusted_uses >= self.full_every - 1:
+            entry.trusted_uses = 0
+            return False
+        entry.trusted_uses += 1
+        return True
+
+    def observe(self, key: Optional[EntityKey], ip: Optional[str], score: int, check_id: Optional[int] = None, now: Optional[float] = None, counts: bool = True) -> None:
+        """Учитывает проверку; повтор того же check_id (фоновый пересчёт) не добавляет попытку.
+        counts=False - проверка сокращённым набором: отзывает доверие, но в серию не идёт."""
+        if key is None:
+            return
+        if score >= settings.threshold_review:
+            # Высокий риск - сомнительны все устройства и карты этого email
+            self.invalidate_email(key[0])
+            return
+        if score > self.max_score:
+            # Серия низкого риска прервана
+            self._drop(key)
+            return
+        entry = self._entries.get(key)
+        if entry is None and not counts:
+            return
+        if entry is None:
+            entry = self._entries[key] = TrustEntry()
+            self._by_email.setdefault(key[0], set()).add(key)
+            if len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+        else:
+            self._entries.move_to_end(key)
+        now = now or time.time()
+        if now - entry.last_seen > self.window:
+            entry.low_streak = 0
+        if counts and (check_id is None or check_id != entry.last_check_id) and (entry.low_streak == 0 or now - entry.last_counted >= self.min_spacing):
+            entry.low_streak += 1
+            entry.last_counted = now
+        if counts:
+            entry.last_check_id = check_id
+        entry.last_seen = now
+        if ip and ip not in entry.ips:
+            entry.ips = (entry.ips + (ip,))[-MAX_ENTRY_IPS:]
+
+    def invalidate_email(self, email: str) -> None:
+        for key in list(self._by_email.get(email, ())):
+            self._drop(key)
+
+    def invalidate_ip(self, ip: str) -> int:
+        """Сброс связок, проходивших через IP (blacklist изменён); редкая операция - полный проход."""
+        keys = [key for key, entry in self._entries.items() if ip in entry.ips]
+        for key in keys:
+            self._drop(key)
+        return len(keys)
+
+    def _history(self, bind: Engine, max_rows: int, batch_size: int) -> Iterator[List[Tuple[Any, ...]]]:
+        """Батчи аргументов observe из истории за окно, по возрастанию ID (он растёт со временем).
+        Разбор device_info и отпечаток считаются здесь - в потоке, который читает БД."""
+        since = datetime.utcnow() - timedelta(seconds=self.window)
+        in_window = FraudCheck.created_at >= since
+        after_id = None
+        if max_rows > 0:
+            # Последние max_rows проверок окна: ID, с которого они начинаются
+            with Session(bind=bind) as db:
+                after_id = db.execute(
+                    select(FraudCheck.id).where(in_window).order_by(FraudCheck.id.desc()).offset(max_rows).limit(1)
+                ).scalar()
+        while True:
+            query = select(FraudCheck.id, FraudCheck.email, FraudCheck.bin, FraudCheck.device_info, FraudCheck.user_agent, FraudCheck.ip, FraudCheck.risk_score, FraudCheck.created_at).where(in_window)
+            if after_id is not None:
+                query = query.where(FraudCheck.id > after_id)
+            with Session(bind=bind) as db:
+                rows = db.execute(query.order_by(FraudCheck.id).limit(batch_size)).all()
+            if not rows:
+                return
+            batch = []
+            for row in rows:
+                try:
+                    device_info = json.loads(row.device_info) if row.device_info else None
+                except ValueError:
+                    device_info = None
+                created_at = row.created_at
+                if created_at is not None and created_at.tzinfo is None:
+                    # SQLite возвращает naive UTC
+                    created_at = created_at.replace(tzinfo=timezone.utc)
+                seen = created_at.timestamp() if created_at is not None else None
+                batch.append((entity_key(row.email, row.bin, device_info, row.user_agent), row.ip, row.risk_score, row.id, seen))
+            yield batch
+            after_id = rows[-1].id
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._by_email.clear()
+
+    def _apply(self, batch: List[Tuple[Any, ...]]) -> None:
+        for key, ip, score, check_id, seen in batch:
+            self.observe(key, ip, score, check_id, now=seen)
+
+    def rebuild(self, bind: Engine, max_rows: Optional[int] = None, batch_size: Optional[int] = None) -> None:
+        """Заполняет индекс историей FraudCheck за окно (синхронно)."""
+        self._clear()
+        for batch in self._history(bind, settings.trust_rebuild_max_rows if max_rows is None else max_rows, batch_size or settings.trust_rebuild_batch_size):
+            self._apply(batch)
+        logger.info("Trust index rebuilt: %d entities", len(self._entries))
+
+    async def rebuild_async(self, bind: Engine) -> None:
+        """То же в фоне: чтение и разбор батча - в пуле потоков, observe - в event loop
+        (индекс не меняется из двух потоков). Проверки, пришедшие до конца загрузки,
+        учитываются сразу, просто без ещё не загруженной истории."""
+        loop = asyncio.get_running_loop()
+        self._clear()
+        history = self._history(bind, settings.trust_rebuild_max_rows, settings.trust_rebuild_batch_size)
+        try:
+            while (batch := await loop.run_in_executor(None, next, history, None)) is not None:
+                self._apply(batch)
+        except Exception as e:
+            logger.error("Trust index rebuild failed: %s", e)
+            return
+        logger.info("Trust index rebuilt: %d entities", len(self._entries))
+
+    def start_rebuild(self, bind: Engine) -> None:
+        if self._rebuild_task is None or self._rebuild_task.done():
+            self._rebuild_task = asyncio.create_task(self.rebuild_async(bind))
+
+    def stop_rebuild(self) -> None:
+        if self._rebuild_task is not None:
+            self._rebuild_task.cancel()
+            self._rebuild_task = None
+
+
+def payload_key(payload: Any) -> Optional[EntityKey]:
+    return entity_key(payload.email, payload.bin, payload.device_info, payload.user_agent)
+
+
+def observe_check(scored: Any) -> None:
+    """Обновляет индекс результатом проверки (ScoredCheck)."""
+    counts = scored.profile is not TRUSTED_PROFILE
+    trust_index.observe(payload_key(scored.payload), scored.payload.ip, scored.score, scored.check_id, counts=counts)
+
+
+def select_profile(payload: Any, profile: PipelineProfile) -> PipelineProfile:
+    """TRUSTED_PROFILE для доверенной связки, если профиль это допускает."""
+    if profile.allow_trusted and trust_index.use_trusted(payload_key(payload)):
+        return TRUSTED_PROFILE
+    return profile
+
+
+# Глобальный индекс доверия
+trust_index = TrustIndex(
+    min_checks=settings.trust_min_checks,
+    window_hours=settings.trust_window_hours,
+    max_score=settings.trust_max_score,
+    max_entries=settings.trust_max_entries,
+    min_spacing_hours=settings.trust_min_spacing_hours,
+    full_every=settings.trust_full_every,
+)
@@ -3,6 +3,7 @@ from typing import List, Dict, Any
 import json
 import asyncio
 from datetime import datetime
+from .tracing import tracer
 
 class WebSocketManager:
     def __init__(self):
@@ -42,12 +43,15 @@ class WebSocketManager:
             return
         
         disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(json.dumps(message))
-            except Exception as e:
-                print(f"Error broadcasting: {e}")
-                disconnected.append(connection)
+        with tracer.span("websocket broadcast", type=message.get("type"), connections=len(self.active_connections)) as span:
+            text = json.dumps(message)
+            for connection in self.active_connections:
+                try:
+                    await connection.send_text(text)
+                except Exception as e:
+                    print(f"Error broadcasting: {e}")
+                    disconnected.append(connection)
+            span.tag("failed", len(disconnected))
         
         # Удаляем отключенные соединения
         for conn in disconnected:
@@ -62,6 +66,15 @@ class WebSocketManager:
         }
         await self.broadcast(alert)
     
+    async def broadcast_verdict_revised(self, check_data: Dict[str, Any]):
+        """Отправить пересмотренный после обогащения вердикт."""
+        revision = {
+            "type": "verdict_revised",
+            "timestamp": datetime.utcnow().isoformat(),
+            "data": check_data
+        }
+        await self.broadcast(revision)
+    
     async def broadcast_metrics_update(self, metrics: Dict[str, Any]):
         """Отправить обновление метрик."""
         update = {
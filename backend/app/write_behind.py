@@ -0,0 +1,165 @@
+"""
+Write-behind запись в БД: строки копятся в очереди и сбрасываются
+микро-батчами (по размеру или по времени) одной транзакцией.
+
+Если транзакция батча падает (дубликат PK, ограничение), батч делится пополам
+и половины пишутся заново, пока не останется одна сбойная строка: остальные
+строки батча не теряются, а сбойная уходит в dead-letter лог
+(antifraud.write_behind.dead_letter) со значениями колонок для повторной записи.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import logging
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from .config import settings
+from .metrics import Stage
+
+logger = logging.getLogger("antifraud.write_behind")
+dead_letter_logger = logging.getLogger("antifraud.write_behind.dead_letter")
+
+
+def row_values(row: Any) -> Dict[str, Any]:
+    """Значения колонок строки ORM (для dead-letter лога)."""
+    return {column.name: getattr(row, column.key, None) for column in row.__table__.columns}
+
+
+class WriteUnit:
+    """Строка + зависимые строки, которым нужен её id (например AnomalyDetection.check_id)."""
+
+    def __init__(self, row: Any, bind: Engine, children: Optional[Callable[[Any], Iterable[Any]]] = None, future: Optional[asyncio.Future] = None, merge: bool = False):
+        self.row = row
+        self.bind = bind
+        self.children = children
+        self.future = future
+        # merge=True - обновить уже записанную строку с тем же PK
+        self.merge = merge
+
+
+class WriteBehindWriter:
+    def __init__(self, batch_size: int = 200, flush_interval_ms: int = 5, max_queue: int = 10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Один поток: записи в SQLite всё равно сериализуются
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="write-behind")
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Дожидается записи всего, что уже в очереди."""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, row: Any, bind: Engine, children: Optional[Callable[[Any], Iterable[Any]]] = None, wait: bool = False, merge: bool = False) -> Optional[Any]:
+        """Ставит строку в очередь; wait=True - дождаться коммита и вернуть id строки,
+        merge=True - обновить строку, поставленную в очередь раньше (порядок очереди сохраняется)."""
+        future = asyncio.get_running_loop().create_future() if wait else None
+        unit = WriteUnit(row, bind, children, future, merge)
+        if not self.running:
+            # Writer не запущен (скрипты, тесты без lifespan) - пишем сразу
+            await self._flush([unit])
+        else:
+            await self._queue.put(unit)
+        return await future if future is not None else None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            unit = await self._queue.get()
+            if unit is None:
+                break
+            batch = [unit]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    unit = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if unit is None:
+                    stopping = True
+                    break
+                batch.append(unit)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[WriteUnit]) -> None:
+        by_bind: Dict[Engine, List[WriteUnit]] = {}
+        for unit in batch:
+            by_bind.setdefault(unit.bind, []).append(unit)
+        loop = asyncio.get_running_loop()
+        for bind, units in by_bind.items():
+            with Stage("write_behind_flush"):
+                failed = await loop.run_in_executor(self._executor, self._write_units, bind, units)
+            errors = {id(unit): error for unit, error in failed}
+            for unit in units:
+                if unit.future is None or unit.future.done():
+                    continue
+                if id(unit) in errors:
+                    unit.future.set_exception(errors[id(unit)])
+                else:
+                    unit.future.set_result(unit.row.id)
+
+    def _write_units(self, bind: Engine, units: List[WriteUnit]) -> List[Tuple[WriteUnit, Exception]]:
+        """Пишет units; при ошибке - половинами до сбойной строки. Возвращает незаписанные."""
+        try:
+            self._write_batch(bind, units)
+            return []
+        except Exception as e:
+            if len(units) == 1:
+                self._dead_letter(units[0], e)
+                return [(units[0], e)]
+            logger.warning("Write-behind batch failed (%d rows), retrying in halves: %s", len(units), e)
+        middle = len(units) // 2
+        return self._write_units(bind, units[:middle]) + self._write_units(bind, units[middle:])
+
+    @staticmethod
+    def _dead_letter(unit: WriteUnit, error: Exception) -> None:
+        dead_letter_logger.error(json.dumps({
+            "table": unit.row.__tablename__,
+            "merge": unit.merge,
+            "error": f"{type(error).__name__}: {error}",
+            "row": row_values(unit.row),
+        }, default=str))
+
+    @staticmethod
+    def _write_batch(bind: Engine, units: List[WriteUnit]) -> None:
+        # expire_on_commit=False: id остаются доступны без повторного SELECT
+        with Session(bind=bind, expire_on_commit=False) as db:
+            for unit in units:
+                # merge после add той же строки в батче найдёт её через autoflush
+                if unit.merge:
+                    db.merge(unit.row)
+                else:
+                    db.add(unit.row)
+            if any(unit.children for unit in units):
+                db.flush()  # id основных строк для зависимых
+                db.add_all([child for unit in units if unit.children for child in unit.children(unit.row)])
+            db.commit()
+
+
+# Глобальный write-behind writer
+persistence_writer = WriteBehindWriter(
+    batch_size=settings.write_behind_batch_size,
+    flush_interval_ms=settings.write_behind_flush_ms,
+    max_queue=settings.write_behind_queue_size,
+)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарки правил и скоринга на реалистичных корпусах входов.
+
+Локальные правила и скоринг гоняются по сгенерированному корпусу (фиксированный
+seed), velocity и blacklist - по SQLite с историей generate_history.py на 1M
+проверок (создаётся один раз и переиспользуется).
+
+    python benchmark_rules.py --save benchmark_baseline.json
+    python benchmark_rules.py --compare benchmark_baseline.json --tolerance 0.25
+
+В режиме сравнения код выхода 1, если правило замедлилось больше допуска
+(по лучшему раунду; медиана тоже сохраняется в baseline).
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Добавляем путь к приложению
+sys.path.append(str(Path(__file__).parent))
+
+# Сравнение - по лучшему раунду: он меньше всего зависит от шума машины
+COMPARE_METRIC = "min_us"
+
+EMAIL_DOMAINS = ["gmail.com"] * 30 + ["yahoo.com"] * 8 + ["outlook.com"] * 8 + ["icloud.com"] * 5 + [
+    "mail.ru", "yandex.ru", "booking-corp.com", "acme.travel", "yopmail.com", "10minutemail.com", "guerrillamail.com",
+]
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_5) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Safari/605.1.15",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0",
+    "Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) HeadlessChrome/126.0.0.0 Safari/537.36",
+    "python-requests/2.32.3",
+    "curl/8.5.0",
+    "",
+]
+SCREENS = [(1920, 1080), (1440, 900), (2560, 1440), (390, 844), (412, 915), (1366, 768), (800, 600), (0, 0)]
+PLATFORMS = ["Win32", "MacIntel", "iPhone", "Linux x86_64", "Linux armv8l"]
+COUNTRY_TZ = [
+    ("US", "America/New_York"), ("US", "America/Los_Angeles"), ("GB", "Europe/London"), ("DE", "Europe/Berlin"),
+    ("FR", "Europe/Paris"), ("RU", "Europe/Moscow"), ("JP", "Asia/Tokyo"), ("BR", "America/Sao_Paulo"),
+    ("US", "Europe/Moscow"), ("GB", "Asia/Shanghai"), ("NL", "Europe/Amsterdam"), (None, "Europe/London"), ("US", None),
+]
+FLAGS = [None] * 6 + ["geo_mismatch", "temporary_email", "bot_like_activity", "suspicious_user_agent", "too_many_attempts"]
+
+
+def make_email(rng, i):
+    if rng.random() < 0.02:
+        return f"broken-address-{i}"
+    return f"traveller{rng.randrange(200000)}@{rng.choice(EMAIL_DOMAINS)}"
+
+
+def make_ip(rng):
+    return f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+
+
+def make_device(rng):
+    width, height = rng.choice(SCREENS)
+    return {"platform": rng.choice(PLATFORMS), "screen": {"width": width, "height": height}, "language": "en-US", "timezone": rng.choice(COUNTRY_TZ)[1]}
+
+
+def make_checks(rng, size):
+    from app.schemas import CheckRequest
+    checks = []
+    for i in range(size):
+        bot = rng.random() < 0.1
+        checks.append(CheckRequest(
+            email=make_email(rng, i),
+            ip=make_ip(rng),
+            bin=rng.choice(["411111", "400000", "550000", "520082", "378282"]),
+            user_agent=rng.choice(USER_AGENTS),
+            device_info=make_device(rng) if rng.random() < 0.9 else None,
+            timezone=rng.choice(COUNTRY_TZ)[1],
+            language="en-US",
+            session_duration_ms=rng.randint(500, 4000) if bot else rng.randint(20000, 600000),
+            typing_speed_ms_avg=rng.randint(5, 40) if bot else rng.randint(80, 250),
+            mouse_moves_count=rng.randint(0, 2) if bot else rng.randint(15, 400),
+            first_click_delay_ms=rng.randint(20, 200) if bot else rng.randint(800, 8000),
+        ))
+    return checks
+
+
+def local_benchmarks(size, seed):
+    """Имя -> (функция одного вызова, корпус аргументов)."""
+    from app.ml_anomaly import analyze_behavioral_patterns, check_ml_anomalies
+    from app.pipeline import ml_data
+    from app.rule_dsl import dsl_rules
+    from app.rule_engine import CheckContext
+    from app.risk_score import aggregate_score_and_flags
+    from app.rules.bot import check_bot_activity
+    from app.rules.device import check_device
+    from app.rules.email import check_email_reputation
+    from app.rules.timezone import check_timezone_mismatch
+
+    rng = random.Random(seed)
+    checks = make_checks(rng, size)
+    ml_inputs = [ml_data(c, None) for c in checks]
+    score_parts = [
+        [(rng.choice((0, 0, 10, 20, 25, 30)), rng.choice(FLAGS)) for _ in range(rng.randint(6, 9))]
+        for _ in range(size)
+    ]
+    # bot, timezone и device в пайплайне считаются правилами DSL - их скомпилированные
+    # функции меряются рядом с написанными вручную
+    ruleset = dsl_rules.current
+    tz_pairs = [rng.choice(COUNTRY_TZ) for _ in checks]
+    tz_contexts = [CheckContext(c.model_copy(update={"timezone": tz}), results={"ip_country": country}) for c, (country, tz) in zip(checks, tz_pairs)]
+    contexts = [(CheckContext(c),) for c in checks]
+    # check_device доходит до счётчика отпечатков (device_cache) - main() очищает
+    # его перед бенчмарком, чтобы раунды были одинаковыми
+    return {
+        "check_email_reputation": (check_email_reputation, [(c.email,) for c in checks]),
+        "check_device": (check_device, [(c.device_info, c.user_agent) for c in checks]),
+        "check_bot_activity": (check_bot_activity, [(c.session_duration_ms, c.mouse_moves_count, c.first_click_delay_ms, c.typing_speed_ms_avg) for c in checks]),
+        "check_timezone_mismatch": (check_timezone_mismatch, tz_pairs),
+        "dsl_bot": (ruleset.rules["bot"].evaluate, contexts),
+        "dsl_timezone": (ruleset.rules["timezone"].evaluate, [(ctx,) for ctx in tz_contexts]),
+        "dsl_device": (ruleset.rules["device"].evaluate, contexts),
+        "aggregate_score_and_flags": (aggregate_score_and_flags, [(parts,) for parts in score_parts]),
+        "check_ml_anomalies": (check_ml_anomalies, [(data,) for data in ml_inputs]),
+        "analyze_behavioral_patterns": (analyze_behavioral_patterns, [(data,) for data in ml_inputs]),
+    }
+
+
+def fill_history(engine, rows, seed):
+    """История на rows проверок (generate_history.py); пересоздаётся, если строк меньше."""
+    from sqlalchemy import func, select
+    from sqlalchemy.orm import Session
+    from app.db import Base
+    from app.models import FraudCheck
+    from generate_history import generate_history
+
+    Base.metadata.create_all(bind=engine)
+    with Session(bind=engine) as db:
+        existing = db.execute(select(func.count()).select_from(FraudCheck)).scalar()
+    if existing < rows:
+        generate_history(engine, rows, seed=seed, reset=True)
+
+
+def db_benchmarks(engine, size, seed):
+    from sqlalchemy import select
+    from sqlalchemy.orm import Session
+    from app.models import BlacklistIP, FraudCheck
+    from app.rules.blacklist import check_blacklist_ip
+    from app.rules.velocity import check_velocity
+
+    rng = random.Random(seed + 1)
+    db = Session(bind=engine)
+    # Половина запросов - по существующим email/ip (попадание в индекс), половина - новые
+    known = db.execute(select(FraudCheck.email, FraudCheck.ip).order_by(FraudCheck.id.desc()).limit(size)).all()
+    blacklisted = list(db.execute(select(BlacklistIP.ip).limit(size)).scalars())
+    velocity_args = [(db, *known[i % len(known)]) if i % 2 else (db, make_email(rng, i), make_ip(rng)) for i in range(size)]
+    blacklist_args = [(db, blacklisted[i % len(blacklisted)]) if i % 2 else (db, make_ip(rng)) for i in range(size)]
+    return db, {
+        "check_velocity": (check_velocity, velocity_args),
+        "check_blacklist_ip": (check_blacklist_ip, blacklist_args),
+    }
+
+
+def measure(func, corpus, repeat):
+    """Медиана и минимум по раундам (раунд - весь корпус), мкс на вызов."""
+    rounds = []
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        for args in corpus:
+            func(*args)
+        rounds.append((time.perf_counter_ns() - started) / len(corpus) / 1000)
+    return {"median_us": round(statistics.median(rounds), 3), "min_us": round(min(rounds), 3), "calls": len(corpus), "repeat": repeat}
+
+
+def compare(results, baseline, tolerance):
+    """Строки отчёта и список замедлившихся правил (время > baseline * (1 + tolerance))."""
+    lines, regressions = [], []
+    for name, current in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            lines.append(f"{name:30} {current[COMPARE_METRIC]:>10.3f} us   (нет в baseline)")
+            continue
+        ratio = current[COMPARE_METRIC] / base[COMPARE_METRIC] if base[COMPARE_METRIC] else 1.0
+        slower = ratio > 1 + tolerance
+        if slower:
+            regressions.append(name)
+        lines.append(f"{name:30} {current[COMPARE_METRIC]:>10.3f} us   baseline {base[COMPARE_METRIC]:>10.3f} us   x{ratio:.2f}{'  REGRESSION' if slower else ''}")
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микро-бенчмарки правил и скоринга")
+    parser.add_argument("--save", metavar="FILE", help="сохранить результаты как baseline")
+    parser.add_argument("--compare", metavar="FILE", help="сравнить с baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое замедление (0.25 = +25%%)")
+    parser.add_argument("--only", nargs="*", help="только указанные бенчмарки")
+    parser.add_argument("--corpus", type=int, default=5000, help="размер корпуса локальных правил")
+    parser.add_argument("--repeat", type=int, default=7, help="раундов на бенчмарк")
+    parser.add_argument("--db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_history.db"), help="SQLite для velocity/blacklist")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="строк в fraud_checks")
+    parser.add_argument("--skip-db", action="store_true", help="без velocity/blacklist")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    from app.cache import device_cache
+
+    benchmarks = local_benchmarks(args.corpus, args.seed)
+    db = None
+    if not args.skip_db:
+        from sqlalchemy import create_engine
+        engine = create_engine(f"sqlite:///{args.db}")
+        fill_history(engine, args.rows, args.seed)
+        db, db_benches = db_benchmarks(engine, min(args.corpus, 2000), args.seed)
+        benchmarks.update(db_benches)
+    if args.only:
+        benchmarks = {name: bench for name, bench in benchmarks.items() if name in args.only}
+
+    results = {}
+    try:
+        for name, (func, corpus) in benchmarks.items():
+            device_cache._cache.clear()
+            func(*corpus[0])  # прогрев (импорты, компиляция regex)
+            results[name] = measure(func, corpus, args.repeat)
+            print(f"{name:30} {results[name]['median_us']:>10.3f} us/call", file=sys.stderr)
+    finally:
+        if db is not None:
+            db.close()
+
+    report = {
+        "created_at": datetime.utcnow().isoformat(),
+        "python": sys.version.split()[0],
+        "rows": None if args.skip_db else args.rows,
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline, args.tolerance)
+        print("\n".join(lines))
+        if regressions:
+            print(f"Замедление больше {args.tolerance:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+Синтетическая история для проверки на объёмах продакшена: fraud_checks,
+anomaly_detections, blacklist_ips и audit_logs на десятки миллионов строк.
+
+Модель трафика:
+- постоянные клиенты со степенным распределением активности (немногие делают
+  большую часть проверок), свои email, карта, устройство и 1-3 домашних IP;
+- общие IP (мобильные операторы, NAT) и BIN'ы тоже со скошенной популярностью;
+- суточный и недельный профиль нагрузки, повторные попытки оплаты через минуты;
+- фрод-всплески: один IP (часть таких IP - в blacklist) и одна карта за
+  минуты прогоняют десятки новых email с бот-поведением.
+
+Флаги и risk_score считаются по весам из settings, ID проверок - snowflake
+от created_at (см. app/ids.py), так что порядок по ID совпадает с временем.
+
+    python generate_history.py --checks 20000000 --days 120
+    python generate_history.py --database-url sqlite:////tmp/scale.db --checks 5000000 --reset
+
+Для SQLite загрузка идёт без fsync, вторичные индексы удаляются и строятся
+заново после вставки (--keep-indexes - оставить).
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import accumulate
+from pathlib import Path
+
+# Добавляем путь к приложению
+sys.path.append(str(Path(__file__).parent))
+
+from app.config import settings
+
+# Страна, часовой пояс устройства, доля клиентов
+COUNTRIES = [
+    ("US", "America/New_York", 18), ("US", "America/Los_Angeles", 10), ("GB", "Europe/London", 12),
+    ("DE", "Europe/Berlin", 10), ("FR", "Europe/Paris", 8), ("RU", "Europe/Moscow", 7), ("NL", "Europe/Amsterdam", 4),
+    ("TR", "Europe/Istanbul", 4), ("AE", "Asia/Dubai", 3), ("TH", "Asia/Bangkok", 3), ("JP", "Asia/Tokyo", 4),
+    ("BR", "America/Sao_Paulo", 4),
+]
+EMAIL_DOMAINS = [("gmail.com", 45), ("yahoo.com", 10), ("outlook.com", 10), ("icloud.com", 8), ("mail.ru", 5),
+                 ("yandex.ru", 4), ("hotmail.com", 5), ("gmx.de", 3), ("booking-corp.com", 1), ("acme.travel", 1)]
+TEMP_DOMAINS = ["yopmail.com", "10minutemail.com", "guerrillamail.com", "mailinator.com", "trashmail.com"]
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_5) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Safari/605.1.15",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0",
+    "Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Mobile Safari/537.36",
+]
+BOT_USER_AGENTS = [
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) HeadlessChrome/126.0.0.0 Safari/537.36",
+    "python-requests/2.32.3",
+    "curl/8.5.0",
+]
+DEVICES = [("Win32", 1920, 1080), ("MacIntel", 1440, 900), ("MacIntel", 2560, 1440), ("iPhone", 390, 844),
+           ("Linux armv8l", 412, 915), ("Win32", 1366, 768), ("Linux x86_64", 1920, 1080)]
+BOT_DEVICES = [("Linux x86_64", 800, 600), ("Linux x86_64", 0, 0)]
+
+# Относительная нагрузка по часам UTC (пик - пересечение дня Европы и Америки) и дням недели
+DIURNAL = [0.35, 0.3, 0.25, 0.22, 0.22, 0.28, 0.4, 0.6, 0.8, 0.95, 1.0, 1.0,
+           1.05, 1.1, 1.15, 1.2, 1.2, 1.15, 1.1, 1.0, 0.9, 0.75, 0.6, 0.45]
+WEEKLY = [1.0, 0.97, 0.95, 0.97, 1.05, 1.2, 1.15]
+# Аудит - действия аналитиков в рабочие часы
+BUSINESS_HOURS = [0.05] * 7 + [0.5, 1.0, 1.0, 1.0, 1.0, 0.7, 1.0, 1.0, 1.0, 1.0, 0.6, 0.3] + [0.1] * 5
+AUDIT_ACTIONS = [("login", None, 50), ("view_check", "check", 30), ("blacklist_add", "ip", 8),
+                 ("blacklist_remove", "ip", 2), ("rules_reload", "rules", 1), ("export_report", "analytics", 9)]
+
+# Размер всплеска: BURST_MIN * Парето(1.5), не больше BURST_MAX (в среднем ~13 проверок)
+BURST_MIN = 5
+BURST_MAX = 400
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+FLAG_WEIGHTS = {
+    "geo_mismatch": lambda: settings.score_geo_mismatch,
+    "timezone_mismatch": lambda: settings.score_timezone_mismatch,
+    "temporary_email": lambda: settings.score_temp_email,
+    "too_many_attempts": lambda: settings.score_velocity,
+    "bot_like_activity": lambda: settings.score_bot_activity,
+    "suspicious_user_agent": lambda: settings.score_device_suspicious,
+    "ip_blacklisted": lambda: settings.score_ip_blacklisted,
+}
+
+FRAUD_CHECK_COLUMNS = ("id", "email", "ip", "bin", "user_agent", "ip_country", "bin_country", "timezone", "language",
+                       "session_duration_ms", "typing_speed_ms_avg", "mouse_moves_count", "first_click_delay_ms",
+                       "device_info", "risk_score", "fraud_flags", "created_at")
+ANOMALY_COLUMNS = ("check_id", "anomaly_score", "anomaly_type", "features", "is_anomaly", "created_at")
+AUDIT_COLUMNS = ("user_id", "action", "resource_type", "resource_id", "details", "ip_address", "user_agent", "created_at")
+
+
+def _ip(space, n):
+    """Детерминированный публичный IPv4 для n-го адреса пула space."""
+    h = zlib.crc32(f"{space}:{n}".encode())
+    return f"{h % 223 + 1}.{(h >> 8) & 255}.{(h >> 16) & 255}.{n % 254 + 1}"
+
+
+def skewed_index(rng, size, skew):
+    """Индекс в [0, size) со степенным перекосом к началу (skew=1 - равномерно)."""
+    return int(size * rng.random() ** skew)
+
+
+def _weighted(items):
+    values = [item[:-1] if len(item) > 2 else item[0] for item in items]
+    weights = [item[-1] for item in items]
+    return values, weights
+
+
+class HistoryModel:
+    """Пулы сущностей и генерация строк за один час."""
+
+    def __init__(self, seed=42, customers=100000, bins=3000, shared_ips=20000, fraud_ips=5000,
+                 skew=2.0, travel_share=0.08, retry_share=0.05, fraud_share=0.03, blacklist_share=0.4, anomaly_share=0.9):
+        self.seed = seed
+        self.customers = customers
+        self.shared_ips = shared_ips
+        self.fraud_ips = fraud_ips
+        self.skew = skew
+        self.travel_share = travel_share
+        self.retry_share = retry_share
+        self.fraud_share = fraud_share
+        self.blacklist_share = blacklist_share
+        self.anomaly_share = anomaly_share
+        self.countries, self.country_weights = _weighted(COUNTRIES)
+        self.domains, self.domain_weights = _weighted(EMAIL_DOMAINS)
+        rng = random.Random(seed)
+        # BIN'ы по странам: популярные - в начале списка страны
+        self.bin_country = {}
+        self.bins_by_country = {}
+        while len(self.bin_country) < bins:
+            bin6 = f"{rng.choice('4455553')}{rng.randrange(10000, 99999)}"
+            if bin6 in self.bin_country:
+                continue
+            country = rng.choices(self.countries, self.country_weights)[0][0]
+            self.bin_country[bin6] = country
+            self.bins_by_country.setdefault(country, []).append(bin6)
+        self.bins = list(self.bin_country.items())
+        self.customer = lru_cache(maxsize=262144)(self._customer)
+        self._flags_json = {}
+
+    def _customer(self, idx):
+        rng = random.Random(self.seed * 1000003 + idx)
+        country, tz = rng.choices(self.countries, self.country_weights)[0]
+        domain = rng.choices(self.domains, self.domain_weights)[0]
+        local_bins = self.bins_by_country.get(country) or list(self.bin_country)
+        platform, width, height = rng.choice(DEVICES)
+        device = json.dumps({"platform": platform, "screen": {"width": width, "height": height}, "language": "en-US", "timezone": tz})
+        user_agent = rng.choice(USER_AGENTS)
+        return {
+            "email": f"traveller{idx}@{domain}",
+            "country": country,
+            "timezone": tz,
+            "bin": local_bins[skewed_index(rng, len(local_bins), 2.0)],
+            "user_agent": user_agent,
+            "user_agent_json": json.dumps(user_agent),
+            "device_info": device,
+            "ips": tuple(_ip("home", idx * 3 + k) for k in range(rng.randint(1, 3))),
+            "temp_email": rng.random() < 0.01,
+        }
+
+    def pick_customer(self, rng):
+        """Клиент с учётом перекоса активности."""
+        return self.customer(skewed_index(rng, self.customers, self.skew))
+
+    def fraud_ip(self, idx):
+        return _ip("fraud", idx)
+
+    def blacklisted_fraud_ips(self):
+        """Фрод-IP, попавшие в blacklist (самые активные)."""
+        return [self.fraud_ip(i) for i in range(int(self.fraud_ips * self.blacklist_share))]
+
+    def flags_json(self, flags):
+        key = tuple(flags)
+        cached = self._flags_json.get(key)
+        if cached is None:
+            cached = self._flags_json[key] = json.dumps(list(key))
+        return cached
+
+    @staticmethod
+    def score(flags):
+        return min(100, sum(FLAG_WEIGHTS[flag]() for flag in flags))
+
+    def legit_checks(self, rng, span, count):
+        """Проверки постоянных клиентов за час: (секунда часа, поля, флаги, бот?)."""
+        rows = []
+        while len(rows) < count:
+            c = self.pick_customer(rng)
+            at = rng.random() * span
+            ip_country = c["country"]
+            roll = rng.random()
+            if roll < self.travel_share:
+                ip_country = rng.choices(self.countries, self.country_weights)[0][0]
+                ip = _ip("travel", rng.randrange(10 ** 6))
+            elif roll < self.travel_share + 0.12:
+                ip = _ip("shared", skewed_index(rng, self.shared_ips, 3.0))
+            else:
+                ip = c["ips"][rng.randrange(len(c["ips"]))]
+            bin_country = self.bin_country[c["bin"]]
+            flags = []
+            if ip_country != bin_country:
+                flags.append("geo_mismatch")
+            if ip_country != c["country"] and rng.random() < 0.5:
+                flags.append("timezone_mismatch")
+            if c["temp_email"]:
+                flags.append("temporary_email")
+            # Повторные оплаты через 1-10 минут - в пределах того же часа
+            offsets = [0.0]
+            if rng.random() < self.retry_share:
+                for _ in range(rng.randint(1, 3)):
+                    offsets.append(offsets[-1] + rng.uniform(60, 600))
+            at = max(0.0, min(at, span - offsets[-1] - 0.001))
+            for attempt, delay in enumerate(offsets):
+                when = min(at + delay, span - 0.001)
+                # С третьей попытки срабатывает velocity
+                attempt_flags = flags + ["too_many_attempts"] if attempt >= 2 else flags
+                rows.append((when, c["email"], ip, c["bin"], c["user_agent"], c["user_agent_json"], ip_country, bin_country,
+                             c["timezone"], c["device_info"], attempt_flags, False))
+        return rows[:count]
+
+    @staticmethod
+    def burst_size(rng):
+        return min(BURST_MAX, int(BURST_MIN * rng.paretovariate(1.5)))
+
+    def burst_checks(self, rng, span, size):
+        """Один фрод-всплеск: IP и карта одни, email новые, бот-поведение."""
+        duration = min(span, rng.uniform(60, 1200))
+        offset = rng.random() * (span - duration)
+        ip_idx = skewed_index(rng, self.fraud_ips, 2.0)
+        ip = self.fraud_ip(ip_idx)
+        blacklisted = ip_idx < self.fraud_ips * self.blacklist_share
+        ip_country = rng.choice(self.countries)[0]
+        bin6, bin_country = self.bins[skewed_index(rng, len(self.bins), 1.5)]
+        bot = rng.random() < 0.7
+        user_agent = rng.choice(BOT_USER_AGENTS if bot else USER_AGENTS)
+        platform, width, height = rng.choice(BOT_DEVICES if bot else DEVICES)
+        tz = rng.choice(self.countries)[1]
+        device = json.dumps({"platform": platform, "screen": {"width": width, "height": height}, "language": "en-US", "timezone": tz})
+        temp = rng.random() < 0.5
+        burst_id = rng.randrange(10 ** 9)
+        rows = []
+        for i in range(size):
+            domain = rng.choice(TEMP_DOMAINS) if temp else "gmail.com"
+            flags = []
+            if ip_country != bin_country:
+                flags.append("geo_mismatch")
+            if temp:
+                flags.append("temporary_email")
+            if i >= 2:
+                flags.append("too_many_attempts")
+            if bot:
+                flags += ["bot_like_activity", "suspicious_user_agent"]
+            if blacklisted:
+                flags.append("ip_blacklisted")
+            rows.append((offset + duration * i / size, f"f{burst_id}.{i}@{domain}", ip, bin6, user_agent, json.dumps(user_agent),
+                         ip_country, bin_country, tz, device, flags, bot))
+        return rows
+
+
+class BulkWriter:
+    """executemany чанками напрямую через DBAPI, коммит на каждый чанк."""
+
+    def __init__(self, conn, tables, chunk=50000):
+        self.conn = conn
+        self.chunk = chunk
+        mark = {"qmark": "?", "format": "%s", "pyformat": "%s"}.get(conn.dialect.paramstyle)
+        if mark is None:
+            raise SystemExit(f"Unsupported DBAPI paramstyle: {conn.dialect.paramstyle}")
+        self.sql = {
+            table: f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join([mark] * len(columns))})"
+            for table, columns in tables.items()
+        }
+        self.pending = {table: [] for table in tables}
+        self.written = {table: 0 for table in tables}
+
+    def add(self, table, row):
+        pending = self.pending[table]
+        pending.append(row)
+        if len(pending) >= self.chunk:
+            self.flush(table)
+
+    def flush(self, table=None):
+        for name in ([table] if table else list(self.pending)):
+            rows = self.pending[name]
+            if rows:
+                self.conn.exec_driver_sql(self.sql[name], rows)
+                self.conn.commit()
+                self.written[name] += len(rows)
+                self.pending[name] = []
+
+
+def _hour_weights(start, hours, profile):
+    return [profile[(start + timedelta(hours=h)).hour] * WEEKLY[(start + timedelta(hours=h)).weekday()] for h in range(hours)]
+
+
+def _spread(total, weights):
+    """Целые количества по часам пропорционально весам, в сумме ровно total."""
+    norm = total / sum(weights)
+    counts = []
+    expected = 0.0
+    assigned = 0
+    for w in weights:
+        expected += w * norm
+        counts.append(int(expected) - assigned)
+        assigned += counts[-1]
+    counts[-1] += total - assigned
+    return counts
+
+
+def _anomaly_row(rng, check_id, created_at, row):
+    """Строка anomaly_detections в формате detect_anomaly() из pipeline.py."""
+    bot = row[11]
+    if bot:
+        typing, session, mouse, click = 5 + int(rng.random() * 36), rng.uniform(0.5, 4.0), int(rng.random() * 3), rng.uniform(0.02, 0.2)
+        kind, score, is_anomaly = rng.choice(("low_mouse_movements", "low_first_click_time", "low_session_duration")), rng.uniform(0.5, 1.0), 1
+    else:
+        typing, session, mouse, click = 80 + int(rng.random() * 171), rng.uniform(20, 600), 15 + int(rng.random() * 386), rng.uniform(0.8, 8.0)
+        kind, score, is_anomaly = "none", 0.0, 0
+        if rng.random() < 0.05:
+            kind, score, is_anomaly = "high_session_duration", rng.uniform(0.05, 0.5), 1
+    features = (
+        f'{{"typing_speed": {typing}, "session_duration": {session:.3f}, "mouse_movements": {mouse}, '
+        f'"first_click_time": {click:.3f}, "userAgent": {row[5]}, "deviceInfo": {row[9]}, '
+        f'"geo_mismatch": {"true" if row[6] != row[7] else "false"}}}'
+    )
+    return (check_id, round(score, 4), kind, features, is_anomaly, created_at), (typing, session, mouse, click)
+
+
+def generate_history(engine, checks, days=90, customers=None, audit_logs=None, blacklist_extra=10000, seed=42,
+                     chunk=50000, reset=False, drop_indexes=True, now=None, log=sys.stderr, **model_options):
+    """Заполняет таблицы истории; возвращает число записанных строк по таблицам."""
+    from sqlalchemy import select
+    from app.db import Base
+    from app.ids import EPOCH_MS, MAX_SEQUENCE, MAX_WORKER_ID, SEQUENCE_BITS, TIMESTAMP_SHIFT
+    from app.models import AnomalyDetection, AuditLog, BlacklistIP, FraudCheck
+
+    tables = [FraudCheck.__table__, AnomalyDetection.__table__, AuditLog.__table__, BlacklistIP.__table__]
+    sqlite = engine.dialect.name == "sqlite"
+    if reset:
+        for table in tables:
+            table.drop(engine, checkfirst=True)
+    Base.metadata.create_all(bind=engine, tables=tables)
+
+    model = HistoryModel(seed=seed, customers=customers or max(1000, checks // 6), **model_options)
+    rng = random.Random(seed + 1)
+    now = (now or datetime.utcnow()).replace(microsecond=0)
+    start = (now - timedelta(days=days)).replace(minute=0, second=0)
+    hours = int((now - start).total_seconds() // 3600) + 1
+    spans = [min(3600.0, (now - (start + timedelta(hours=h))).total_seconds()) for h in range(hours)]
+    if spans[-1] < 1:
+        hours -= 1
+        spans.pop()
+
+    # Обычные проверки - по профилю нагрузки; фрод-всплески - в случайные часы
+    # с тем же профилем, пока не наберётся fraud_share проверок
+    weights = [w * span / 3600 for w, span in zip(_hour_weights(start, hours, DIURNAL), spans)]
+    fraud_total = int(checks * model.fraud_share)
+    legit_counts = _spread(checks - fraud_total, weights)
+    bursts = [[] for _ in range(hours)]
+    cumulative = list(accumulate(weights))
+    remaining = fraud_total
+    while remaining > 0:
+        size = min(remaining, model.burst_size(rng))
+        bursts[rng.choices(range(hours), cum_weights=cumulative)[0]].append(size)
+        remaining -= size
+    audit_weights = [w * span / 3600 for w, span in zip(_hour_weights(start, hours, BUSINESS_HOURS), spans)]
+    audit_counts = _spread(checks // 50 if audit_logs is None else audit_logs, audit_weights)
+
+    def stamp(hour_start, prefix, offset):
+        if not sqlite:
+            return hour_start + timedelta(seconds=offset)
+        # SQLite хранит DateTime строкой в формате SQLAlchemy - собираем её без strftime
+        whole = int(offset)
+        return f"{prefix}{whole // 60:02d}:{whole % 60:02d}.{int((offset - whole) * 1e6):06d}"
+
+    blacklisted = model.blacklisted_fraud_ips()
+    action_values, action_weights = _weighted(AUDIT_ACTIONS)
+
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        if sqlite:
+            # Загрузка одним процессом: без fsync и журнала на диске, кэш побольше
+            for pragma in ("synchronous=OFF", "journal_mode=MEMORY", "cache_size=-262144", "temp_store=MEMORY"):
+                conn.exec_driver_sql(f"PRAGMA {pragma}")
+        dropped = []
+        try:
+            if drop_indexes:
+                for table in tables[:3]:
+                    for index in table.indexes:
+                        index.drop(conn, checkfirst=True)
+                        dropped.append(index)
+                conn.commit()
+
+            writer = BulkWriter(conn, {
+                "fraud_checks": FRAUD_CHECK_COLUMNS,
+                "anomaly_detections": ANOMALY_COLUMNS,
+                "audit_logs": AUDIT_COLUMNS,
+                "blacklist_ips": ("ip",),
+            }, chunk=chunk)
+            known = set(conn.execute(select(BlacklistIP.ip)).scalars())
+            extra = [_ip("blacklist", i) for i in range(blacklist_extra)]
+            for ip in dict.fromkeys(blacklisted + extra):
+                if ip not in known:
+                    writer.add("blacklist_ips", (ip,))
+            writer.flush("blacklist_ips")
+
+            last_ms, sequence = -1, 0
+            for h in range(hours):
+                if not legit_counts[h] and not bursts[h] and not audit_counts[h]:
+                    continue
+                hour_start = start + timedelta(hours=h)
+                rows = model.legit_checks(rng, spans[h], legit_counts[h])
+                for size in bursts[h]:
+                    rows += model.burst_checks(rng, spans[h], size)
+                rows.sort(key=lambda row: row[0])
+                hour_ms = int((hour_start - UNIX_EPOCH).total_seconds()) * 1000
+                prefix = f"{hour_start:%Y-%m-%d %H}:"
+                for row in rows:
+                    ms = hour_ms + int(row[0] * 1000)
+                    # Snowflake как в SnowflakeGenerator, отдельный worker id генератора
+                    if ms <= last_ms:
+                        ms = last_ms
+                        sequence += 1
+                        if sequence > MAX_SEQUENCE:
+                            ms, sequence = ms + 1, 0
+                    else:
+                        sequence = 0
+                    last_ms = ms
+                    check_id = ((ms - EPOCH_MS) << TIMESTAMP_SHIFT) | (MAX_WORKER_ID << SEQUENCE_BITS) | sequence
+                    created_at = stamp(hour_start, prefix, row[0])
+                    flags = row[10]
+                    if rng.random() < model.anomaly_share:
+                        anomaly, behaviour = _anomaly_row(rng, check_id, created_at, row)
+                        writer.add("anomaly_detections", anomaly)
+                        typing, session, mouse, click = behaviour
+                    else:
+                        typing, session, mouse, click = (20, 2.0, 1, 0.1) if row[11] else (150, 120.0, 80, 2.0)
+                    writer.add("fraud_checks", (
+                        check_id, row[1], row[2], row[3], row[4], row[6], row[7], row[8], "en-US",
+                        int(session * 1000), typing, mouse, int(click * 1000), row[9],
+                        model.score(flags), model.flags_json(flags), created_at,
+                    ))
+                for _ in range(audit_counts[h]):
+                    action, resource_type = action_values[rng.choices(range(len(action_values)), action_weights)[0]]
+                    user_id = skewed_index(rng, 20, 2.0) + 1
+                    resource_id = rng.choice(blacklisted) if resource_type == "ip" and blacklisted else (str(rng.randrange(10 ** 6)) if resource_type else None)
+                    writer.add("audit_logs", (
+                        user_id, action, resource_type, resource_id, json.dumps({"username": f"analyst{user_id}"}),
+                        _ip("office", user_id % 4), USER_AGENTS[user_id % len(USER_AGENTS)],
+                        stamp(hour_start, prefix, rng.random() * spans[h]),
+                    ))
+                if h % 168 == 0 and writer.written["fraud_checks"]:
+                    print(f"{hour_start:%Y-%m-%d}: {writer.written['fraud_checks']} checks, {time.perf_counter() - started:.0f}s", file=log)
+            writer.flush()
+        finally:
+            # Индексы возвращаем и после ошибки загрузки - иначе БД останется без них
+            if dropped:
+                conn.rollback()
+                rebuild = time.perf_counter()
+                for index in dropped:
+                    index.create(conn, checkfirst=True)
+                conn.commit()
+                print(f"indexes rebuilt in {time.perf_counter() - rebuild:.1f}s", file=log)
+        if sqlite:
+            conn.exec_driver_sql("ANALYZE")
+            conn.commit()
+
+    elapsed = time.perf_counter() - started
+    print(f"{writer.written['fraud_checks']} checks in {elapsed:.1f}s ({writer.written['fraud_checks'] / max(elapsed, 1e-9):.0f} rows/s)", file=log)
+    return dict(writer.written)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетическая история проверок для нагрузочных тестов")
+    parser.add_argument("--database-url", default=settings.database_url, help="БД (по умолчанию DATABASE_URL)")
+    parser.add_argument("--checks", type=int, default=10_000_000, help="строк в fraud_checks")
+    parser.add_argument("--days", type=int, default=90, help="глубина истории в днях")
+    parser.add_argument("--customers", type=int, help="постоянных клиентов (по умолчанию checks/6)")
+    parser.add_argument("--skew", type=float, default=2.0, help="перекос активности клиентов (1 - равномерно)")
+    parser.add_argument("--fraud-share", type=float, default=0.03, help="доля проверок во фрод-всплесках")
+    parser.add_argument("--anomaly-share", type=float, default=0.9, help="доля проверок со строкой anomaly_detections")
+    parser.add_argument("--audit-logs", type=int, help="строк audit_logs (по умолчанию checks/50)")
+    parser.add_argument("--blacklist-extra", type=int, default=10000, help="IP в blacklist сверх фрод-IP")
+    parser.add_argument("--chunk", type=int, default=50000, help="строк на executemany")
+    parser.add_argument("--reset", action="store_true", help="пересоздать таблицы истории перед генерацией")
+    parser.add_argument("--keep-indexes", action="store_true", help="не удалять индексы на время вставки")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    from sqlalchemy import create_engine
+    engine = create_engine(args.database_url)
+    written = generate_history(
+        engine, args.checks, days=args.days, customers=args.customers, audit_logs=args.audit_logs,
+        blacklist_extra=args.blacklist_extra, seed=args.seed, chunk=args.chunk, reset=args.reset,
+        drop_indexes=not args.keep_indexes, skew=args.skew, fraud_share=args.fraud_share, anomaly_share=args.anomaly_share,
+    )
+    print(json.dumps(written))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,621 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный прогон API целиком (app.main:app) без сети.
+
+Внешние geo/BIN API (ipapi.co, ip-api.com, ipinfo.io, binlist) заменяются
+локальными HTTP-заглушками с задаваемой задержкой и долей ошибок: приложение
+получает их адреса через PROVIDER_BASE_URLS. Трафик - взвешенная смесь
+сценариев, итог - пропускная способность и p50/p95/p99 по эндпоинтам.
+
+    python load_test.py --duration 30 --concurrency 64
+    python load_test.py --mix check=60,two_phase=20,session=10,batch=5,stream=5 --rate 200
+    python load_test.py --geo-latency-ms 150 --provider ipapi.co=error:1 --json report.json
+    python load_test.py --db /tmp/scale.db --history 5000000 --returning-share 0.6
+
+По умолчанию приложение работает в этом же процессе через ASGI (без uvicorn,
+с startup/shutdown). --url отправляет трафик на запущенный сервер: заглушки
+слушают порты с --stub-port, строку PROVIDER_BASE_URLS для сервера скрипт
+печатает при старте.
+
+Soak-режим - часы трафика с постоянно новыми email/IP/устройствами; раз в
+--sample-seconds снимаются RSS и размеры кэшей, лимитеров, сессий и т.п.
+После прогрева память должна выйти на плато, иначе код выхода 1:
+
+    python load_test.py --soak --duration 7200 --sample-seconds 60 --cache-max-entries 5000
+"""
+import argparse
+import asyncio
+import gc
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlsplit
+
+# Добавляем путь к приложению
+sys.path.append(str(Path(__file__).parent))
+
+from benchmark_rules import COUNTRY_TZ, fill_history, make_checks
+
+# Хосты провайдеров из app/rules/geo.py
+GEO_HOSTS = ("ipapi.co", "ip-api.com", "ipinfo.io")
+BIN_HOSTS = ("lookup.binlist.net", "binlist.net")
+
+# Сверх таймаута httpx-клиента в geo.py (3 с)
+HANG_SECONDS = 3.5
+
+DEFAULT_MIX = "check=70,two_phase=10,session=10,batch=5,stream=5"
+
+
+def _country(key):
+    """Страна по ключу, стабильная между прогонами."""
+    return COUNTRY_TZ[zlib.crc32(key.encode()) % len(COUNTRY_TZ)][0]
+
+
+def provider_body(host, path):
+    """Ответ в формате API провайдера; None - путь не распознан."""
+    parts = [p for p in path.split("/") if p]
+    if host == "ipapi.co" and len(parts) == 2:
+        return {"ip": parts[0], "country_code": _country(parts[0])}
+    if host == "ip-api.com" and len(parts) == 2:
+        return {"status": "success", "query": parts[1], "countryCode": _country(parts[1])}
+    if host == "ipinfo.io" and len(parts) == 2:
+        return {"ip": parts[0], "country": _country(parts[0])}
+    if host in BIN_HOSTS and parts:
+        return {"scheme": "visa", "type": "debit", "country": {"alpha2": _country(parts[-1])}}
+    return None
+
+
+class ProviderStub:
+    """Заглушка одного провайдера: задержка latency + экспоненциальный хвост
+    со средним jitter, доля 503 (error) и зависаний дольше таймаута клиента (timeout)."""
+
+    def __init__(self, host, latency_ms=50.0, jitter_ms=20.0, error_rate=0.0, timeout_rate=0.0, seed=0):
+        self.host = host
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.rng = random.Random(f"{seed}:{host}")
+        self.port = None
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def configure(self, spec):
+        """spec: "latency:80,jitter:10,error:0.2,timeout:0.01"."""
+        fields = {"latency": "latency_ms", "jitter": "jitter_ms", "error": "error_rate", "timeout": "timeout_rate"}
+        for item in spec.split(","):
+            name, _, value = item.partition(":")
+            if name.strip() not in fields:
+                raise ValueError(f"Unknown stub option: {name}")
+            setattr(self, fields[name.strip()], float(value))
+
+    async def respond(self, path):
+        """(статус, тело) после задержки."""
+        self.requests += 1
+        delay = self.latency_ms + (self.rng.expovariate(1 / self.jitter_ms) if self.jitter_ms > 0 else 0)
+        roll = self.rng.random()
+        if roll < self.timeout_rate:
+            self.timeouts += 1
+            await asyncio.sleep(HANG_SECONDS)
+        else:
+            await asyncio.sleep(delay / 1000)
+        if roll < self.timeout_rate + self.error_rate:
+            self.errors += 1
+            return 503, {"error": "stub failure"}
+        body = provider_body(self.host, path)
+        if body is None:
+            return 404, {"error": "not found"}
+        return 200, body
+
+    async def handle(self, reader, writer):
+        # Минимальный HTTP/1.1 для GET от httpx, keep-alive
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                path = request_line.split()[1].decode("latin-1") if len(request_line.split()) > 1 else "/"
+                status, body = await self.respond(urlsplit(path).path)
+                payload = json.dumps(body).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def stats(self):
+        return {"requests": self.requests, "errors": self.errors, "timeouts": self.timeouts}
+
+
+class StubServers:
+    """Заглушки всех провайдеров в отдельном потоке со своим event loop'ом,
+    чтобы их задержки не делили цикл с приложением."""
+
+    def __init__(self, stubs, host="127.0.0.1", port=0):
+        self.stubs = stubs
+        self.host = host
+        self.port = port
+        self._loop = None
+        self._thread = None
+        self._servers = []
+
+    def start(self):
+        ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        async def serve():
+            for i, stub in enumerate(self.stubs):
+                server = await asyncio.start_server(stub.handle, self.host, self.port + i if self.port else 0)
+                stub.port = server.sockets[0].getsockname()[1]
+                self._servers.append(server)
+            ready.set()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(serve())
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="provider-stubs", daemon=True)
+        self._thread.start()
+        if not ready.wait(5):
+            raise RuntimeError("Provider stubs did not start")
+        return self.base_urls()
+
+    def base_urls(self):
+        """Значение settings.provider_base_urls."""
+        return {stub.host: f"http://{self.host}:{stub.port}" for stub in self.stubs}
+
+    def stop(self):
+        if self._loop is None:
+            return
+        for server in self._servers:
+            self._loop.call_soon_threadsafe(server.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def stats(self):
+        return {stub.host: stub.stats() for stub in self.stubs}
+
+
+def make_stubs(args):
+    stubs = [ProviderStub(host, args.geo_latency_ms, args.geo_jitter_ms, args.geo_error_rate, args.geo_timeout_rate, args.seed) for host in GEO_HOSTS]
+    stubs += [ProviderStub(host, args.bin_latency_ms, args.bin_jitter_ms, args.bin_error_rate, args.bin_timeout_rate, args.seed) for host in BIN_HOSTS]
+    by_host = {stub.host: stub for stub in stubs}
+    for item in args.provider or ():
+        host, _, spec = item.partition("=")
+        if host not in by_host:
+            raise SystemExit(f"Unknown provider {host}, expected one of: {', '.join(by_host)}")
+        by_host[host].configure(spec)
+    return stubs
+
+
+def percentile(sorted_values, q):
+    """Ближайший ранг: q в [0, 100]."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(q / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+class Recorder:
+    """Латентности и ошибки по эндпоинтам."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.started = time.perf_counter()
+        self.finished = None
+        # Открытая модель: сценарии, не начатые из-за предела concurrency
+        self.dropped = 0
+
+    def record(self, endpoint, status, seconds):
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][status] += 1
+        if not 200 <= status < 300:
+            self.errors[endpoint] += 1
+
+    def report(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[endpoint] = {
+                "count": len(values),
+                "errors": self.errors[endpoint],
+                "statuses": dict(self.statuses[endpoint]),
+                "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2),
+            }
+        total = sum(e["count"] for e in endpoints.values())
+        return {"elapsed_s": round(elapsed, 2), "requests": total, "rps": round(total / elapsed, 2) if elapsed else 0.0, "endpoints": endpoints}
+
+
+def parse_mix(text):
+    """"check=70,batch=5" -> {"check": 70.0, "batch": 5.0}."""
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name}, expected one of: {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Traffic:
+    """Генератор payload'ов и клиент с заголовками. Новые клиенты - корпус
+    benchmark_rules, постоянные (доля returning_share) - клиенты из истории
+    generate_history.py с теми же email, картой, устройством и IP."""
+
+    def __init__(self, client, recorder, api_key, seed, batch_size, history=None, returning_share=0.0):
+        self.client = client
+        self.recorder = recorder
+        self.headers = {"X-API-Key": api_key}
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.history = history
+        self.returning_share = returning_share if history is not None else 0.0
+
+    def payloads(self, count):
+        payloads = [check.model_dump(exclude_none=True) for check in make_checks(self.rng, count)]
+        for payload in payloads:
+            if self.rng.random() < self.returning_share:
+                payload.update(self.returning_customer())
+        return payloads
+
+    def returning_customer(self):
+        c = self.history.pick_customer(self.rng)
+        return {
+            "email": c["email"],
+            "ip": c["ips"][self.rng.randrange(len(c["ips"]))],
+            "bin": c["bin"],
+            "user_agent": c["user_agent"],
+            "device_info": json.loads(c["device_info"]),
+            "timezone": c["timezone"],
+        }
+
+    async def send(self, endpoint, method, url, **kwargs):
+        headers = {**self.headers, **kwargs.pop("headers", {})}
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=headers, **kwargs)
+            status = response.status_code
+        except Exception:
+            # Таймаут/обрыв соединения - как ответ 599
+            response, status = None, 599
+        self.recorder.record(endpoint, status, time.perf_counter() - started)
+        return response
+
+
+async def scenario_check(traffic):
+    await traffic.send("POST /api/check", "POST", "/api/check", json=traffic.payloads(1)[0])
+
+
+async def scenario_two_phase(traffic):
+    await traffic.send("POST /api/check [two_phase]", "POST", "/api/check", json=traffic.payloads(1)[0], headers={"X-Pipeline-Profile": "two_phase"})
+
+
+async def scenario_session(traffic):
+    """Чекаут: ip и устройство при открытии формы, email и карта по мере ввода, submit."""
+    payload = traffic.payloads(1)[0]
+    first = {key: payload[key] for key in ("ip", "user_agent", "device_info") if key in payload}
+    response = await traffic.send("POST /api/check/session", "POST", "/api/check/session", json=first)
+    if response is None or response.status_code != 200:
+        return
+    session_id = response.json()["session_id"]
+    update = {key: payload[key] for key in ("email", "bin") if key in payload}
+    await traffic.send("PATCH /api/check/session/{id}", "PATCH", f"/api/check/session/{session_id}", json=update)
+    await traffic.send("POST /api/check/session/{id}/finalize", "POST", f"/api/check/session/{session_id}/finalize", json=payload)
+
+
+async def scenario_batch(traffic):
+    await traffic.send("POST /api/check/batch", "POST", "/api/check/batch", json={"checks": traffic.payloads(traffic.batch_size)})
+
+
+async def scenario_stream(traffic):
+    body = "".join(json.dumps(payload) + "\n" for payload in traffic.payloads(traffic.batch_size))
+    await traffic.send("POST /api/check/stream", "POST", "/api/check/stream", content=body, headers={"Content-Type": "application/x-ndjson"})
+
+
+SCENARIOS = {
+    "check": scenario_check,
+    "two_phase": scenario_two_phase,
+    "session": scenario_session,
+    "batch": scenario_batch,
+    "stream": scenario_stream,
+}
+
+
+async def run_load(client, mix, api_key, concurrency=32, duration=None, requests=None, rate=None, batch_size=20, seed=42,
+                   history=None, returning_share=0.0, recorder=None):
+    """Гоняет смесь сценариев до истечения duration (с) или requests сценариев.
+
+    Без rate - замкнутый цикл: concurrency воркеров шлют следующий сценарий сразу
+    после ответа. С rate - открытая модель: сценарии стартуют с частотой rate/с
+    независимо от ответов (не больше concurrency одновременно, лишние - dropped).
+    recorder - продолжить запись в существующий (окна soak-прогона)."""
+    recorder = recorder or Recorder()
+    traffic = Traffic(client, recorder, api_key, seed, batch_size, history, returning_share)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    picker = random.Random(seed + 1)
+    deadline = time.perf_counter() + duration if duration else None
+    budget = {"left": requests}
+
+    def next_scenario():
+        if deadline is not None and time.perf_counter() >= deadline:
+            return None
+        if budget["left"] is not None:
+            if budget["left"] <= 0:
+                return None
+            budget["left"] -= 1
+        return SCENARIOS[picker.choices(names, weights)[0]]
+
+    if rate:
+        in_flight = set()
+        start = time.perf_counter()
+        i = 0
+        while (scenario := next_scenario()) is not None:
+            await asyncio.sleep(max(0.0, start + i / rate - time.perf_counter()))
+            i += 1
+            if len(in_flight) >= concurrency:
+                recorder.dropped += 1
+                continue
+            task = asyncio.create_task(scenario(traffic))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+    else:
+        async def worker():
+            while (scenario := next_scenario()) is not None:
+                await scenario(traffic)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    recorder.finished = time.perf_counter()
+    return recorder
+
+
+async def run_in_process(app, runner=None, **load_kwargs):
+    """Прогон против ASGI-приложения в этом процессе, со startup/shutdown;
+    runner(client, **load_kwargs) - вместо run_load (например, run_soak)."""
+    import httpx
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=30.0) as client:
+            return await (runner or run_load)(client, **load_kwargs)
+    finally:
+        await app.router.shutdown()
+
+
+async def run_remote(url, **load_kwargs):
+    import httpx
+    limits = httpx.Limits(max_connections=load_kwargs.get("concurrency", 32))
+    async with httpx.AsyncClient(base_url=url, timeout=30.0, limits=limits) as client:
+        return await run_load(client, **load_kwargs)
+
+
+def rss_mb():
+    """Текущий RSS процесса; без /proc (macOS) - пиковый из getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def structure_sizes():
+    """Число записей в долгоживущих структурах приложения в этом процессе."""
+    from app.memory import entry_counts
+    return {**entry_counts(), "gc_objects": len(gc.get_objects())}
+
+
+async def run_soak(client, duration, sample_seconds=60.0, seed=42, on_sample=None, **load_kwargs):
+    """Нагрузка окнами по sample_seconds до duration; после каждого окна - gc и
+    снимок RSS и размеров структур. У каждого окна свой seed - новые email, IP и
+    устройства, кардинальность ключей растёт всё время прогона."""
+    recorder = Recorder()
+    samples = []
+    started = time.perf_counter()
+    window = 0
+    done = 0
+    while (elapsed := time.perf_counter() - started) < duration:
+        window_started = time.perf_counter()
+        await run_load(client, duration=min(sample_seconds, duration - elapsed), seed=seed + window, recorder=recorder, **load_kwargs)
+        gc.collect()
+        total = sum(len(values) for values in recorder.latencies.values())
+        sample = {
+            "t": round(time.perf_counter() - started, 1),
+            "rps": round((total - done) / (time.perf_counter() - window_started), 1),
+            "rss_mb": round(rss_mb(), 1),
+            "sizes": structure_sizes(),
+        }
+        samples.append(sample)
+        if on_sample is not None:
+            on_sample(sample)
+        done = total
+        window += 1
+    return recorder, samples
+
+
+def _slope(points):
+    """Наклон прямой МНК по (x, y)."""
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var if var else 0.0
+
+
+def growth_verdict(samples, warmup, max_rss_mb_per_hour=20.0, rss_noise_mb=5.0, max_growth=0.2, min_entries=100):
+    """Проблемы роста памяти после прогрева (пустой список - стабильно).
+
+    RSS: наклон больше max_rss_mb_per_hour и прирост за устойчивую часть больше
+    шума. Структуры: среднее последней трети выборок больше первой на max_growth
+    (и хотя бы на min_entries записей)."""
+    steady = [sample for sample in samples if sample["t"] >= warmup]
+    if len(steady) < 3:
+        return [f"only {len(steady)} samples after {warmup:.0f}s warm-up, need at least 3"]
+    problems = []
+    slope = _slope([(sample["t"] / 3600, sample["rss_mb"]) for sample in steady])
+    grown = steady[-1]["rss_mb"] - steady[0]["rss_mb"]
+    if slope > max_rss_mb_per_hour and grown > rss_noise_mb:
+        problems.append(f"rss grows {slope:.1f} MB/h (+{grown:.1f} MB after warm-up)")
+    k = max(1, len(steady) // 3)
+    for name in steady[0]["sizes"]:
+        first = sum(sample["sizes"][name] for sample in steady[:k]) / k
+        last = sum(sample["sizes"][name] for sample in steady[-k:]) / k
+        if last - first > max(min_entries, first * max_growth):
+            problems.append(f"{name} grows {first:.0f} -> {last:.0f}")
+    return problems
+
+
+def print_sample(sample):
+    sizes = " ".join(f"{name}={size}" for name, size in sample["sizes"].items())
+    print(f"[{sample['t']:>7.0f}s] {sample['rps']:>7.1f} rps  rss {sample['rss_mb']:>7.1f} MB  {sizes}", file=sys.stderr, flush=True)
+
+
+def print_report(report, stub_stats, dropped):
+    print(f"{'endpoint':40} {'count':>7} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for endpoint, row in report["endpoints"].items():
+        print(f"{endpoint:40} {row['count']:>7} {row['errors']:>5} {row['rps']:>8.1f} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}")
+    print(f"total: {report['requests']} requests in {report['elapsed_s']}s, {report['rps']} rps" + (f", dropped {dropped}" if dropped else ""))
+    print("stubs: " + ", ".join(f"{host} {s['requests']} req/{s['errors']} err/{s['timeouts']} hang" for host, s in stub_stats.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон API с локальными заглушками geo/BIN")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"веса сценариев ({', '.join(SCENARIOS)})")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных сценариев")
+    parser.add_argument("--duration", type=float, default=20.0, help="длительность, с")
+    parser.add_argument("--requests", type=int, help="вместо --duration: число сценариев")
+    parser.add_argument("--rate", type=float, help="открытая модель: сценариев в секунду")
+    parser.add_argument("--batch-size", type=int, default=20, help="проверок в batch/stream")
+    parser.add_argument("--geo-latency-ms", type=float, default=60.0)
+    parser.add_argument("--geo-jitter-ms", type=float, default=30.0)
+    parser.add_argument("--geo-error-rate", type=float, default=0.02)
+    parser.add_argument("--geo-timeout-rate", type=float, default=0.0)
+    parser.add_argument("--bin-latency-ms", type=float, default=80.0)
+    parser.add_argument("--bin-jitter-ms", type=float, default=40.0)
+    parser.add_argument("--bin-error-rate", type=float, default=0.02)
+    parser.add_argument("--bin-timeout-rate", type=float, default=0.0)
+    parser.add_argument("--provider", action="append", metavar="HOST=SPEC", help="настройки одной заглушки, например ipapi.co=latency:200,error:0.5")
+    parser.add_argument("--url", help="адрес запущенного сервера вместо ASGI в процессе")
+    parser.add_argument("--stub-port", type=int, default=0, help="первый порт заглушек (0 - свободные)")
+    parser.add_argument("--api-key", help="X-API-Key (по умолчанию settings.api_key)")
+    parser.add_argument("--db", help="SQLite для прогона в процессе (по умолчанию временный файл)")
+    parser.add_argument("--json", metavar="FILE", help="сохранить отчёт в JSON")
+    parser.add_argument("--history", type=int, default=0, help="проверок в истории (generate_history.py) до прогона; с --url - размер истории сервера")
+    parser.add_argument("--returning-share", type=float, default=0.5, help="доля проверок от постоянных клиентов из истории")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--soak", action="store_true", help="soak-режим: --duration окнами, замеры памяти, код 1 при росте")
+    parser.add_argument("--sample-seconds", type=float, default=60.0, help="soak: окно между замерами, с")
+    parser.add_argument("--warmup", type=float, help="soak: прогрев без проверки роста, с (по умолчанию 1/5 длительности)")
+    parser.add_argument("--max-rss-growth", type=float, default=20.0, help="soak: допустимый рост RSS после прогрева, МБ/ч")
+    parser.add_argument("--max-structure-growth", type=float, default=0.2, help="soak: допустимый рост структуры (0.2 = +20%%)")
+    parser.add_argument("--cache-max-entries", type=int, help="CACHE_MAX_ENTRIES приложения (soak: быстрее выйти на потолок)")
+    args = parser.parse_args()
+    if args.soak and args.url:
+        parser.error("--soak measures the app in this process, it cannot be combined with --url")
+
+    mix = parse_mix(args.mix)
+    stubs = StubServers(make_stubs(args), port=args.stub_port)
+    base_urls = stubs.start()
+    print(f"PROVIDER_BASE_URLS='{json.dumps(base_urls)}'", file=sys.stderr)
+
+    tmpdir = None
+    if not args.url:
+        # Настройки читаются при импорте приложения - окружение задаём до него
+        os.environ["PROVIDER_BASE_URLS"] = json.dumps(base_urls)
+        if args.db:
+            os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.db)}"
+        else:
+            tmpdir = tempfile.TemporaryDirectory(prefix="load_test_")
+            os.environ["DATABASE_URL"] = f"sqlite:///{tmpdir.name}/load_test.db"
+        # Лимиты частоты рассчитаны на клиентов, а не на генератор нагрузки
+        os.environ.setdefault("RATE_LIMIT_IP", "1000000000")
+        os.environ.setdefault("RATE_LIMIT_EMAIL", "1000000000")
+        if args.cache_max_entries:
+            os.environ["CACHE_MAX_ENTRIES"] = str(args.cache_max_entries)
+
+    from app.config import settings
+    history = None
+    if args.history:
+        if not args.url:
+            from sqlalchemy import create_engine
+            fill_history(create_engine(os.environ["DATABASE_URL"]), args.history, args.seed)
+        from generate_history import HistoryModel
+        history = HistoryModel(seed=args.seed, customers=max(1000, args.history // 6))
+    load_kwargs = dict(
+        mix=mix,
+        api_key=args.api_key or settings.api_key,
+        concurrency=args.concurrency,
+        duration=None if args.requests else args.duration,
+        requests=args.requests,
+        rate=args.rate,
+        batch_size=args.batch_size,
+        seed=args.seed,
+        history=history,
+        returning_share=args.returning_share,
+    )
+    samples = None
+    try:
+        if args.url:
+            recorder = asyncio.run(run_remote(args.url, **load_kwargs))
+        elif args.soak:
+            from app.main import app
+            del load_kwargs["duration"], load_kwargs["requests"]
+            recorder, samples = asyncio.run(run_in_process(
+                app, runner=run_soak, duration=args.duration, sample_seconds=args.sample_seconds, on_sample=print_sample, **load_kwargs
+            ))
+        else:
+            from app.main import app
+            recorder = asyncio.run(run_in_process(app, **load_kwargs))
+    finally:
+        stubs.stop()
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+    report = recorder.report()
+    report.update(dropped=recorder.dropped, stubs=stubs.stats(), mix=mix, concurrency=args.concurrency, rate=args.rate)
+    print_report(report, report["stubs"], recorder.dropped)
+    problems = []
+    if samples is not None:
+        warmup = args.duration / 5 if args.warmup is None else args.warmup
+        problems = growth_verdict(samples, warmup, args.max_rss_growth, max_growth=args.max_structure_growth)
+        report.update(samples=samples, warmup=warmup, problems=problems)
+        print("memory: " + ("stable after warm-up" if not problems else "GROWTH - " + "; ".join(problems)))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Офлайн перескоринг: NDJSON CheckRequest (файл или stdin) -> NDJSON CheckResponse.
+Результаты не пишутся в БД: перескоринг прошлых броней не должен добавлять
+попытки в velocity живых проверок.
+Пример для ночного перескрининга:
+    python rescore_checks.py bookings.ndjson -o results.ndjson --workers 8
+"""
+import argparse
+import asyncio
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from pathlib import Path
+
+# Добавляем путь к приложению
+sys.path.append(str(Path(__file__).parent))
+
+from app.config import settings
+
+
+async def _collect(lines, first_line, concurrency):
+    from app.db import engine
+    from app.streaming import aiter_lines, score_ndjson
+    return [out async for out in score_ndjson(aiter_lines(lines), engine, concurrency=concurrency, first_line=first_line, persist=False)]
+
+
+def _score_chunk(lines, first_line, concurrency):
+    """Выполняется в воркер-процессе: свой event loop, свой движок правил."""
+    return asyncio.run(_collect(lines, first_line, concurrency))
+
+
+async def _run_single(source, output, concurrency):
+    from app.db import engine
+    from app.streaming import aiter_lines, score_ndjson
+    async for out in score_ndjson(aiter_lines(source), engine, concurrency=concurrency, persist=False):
+        output.write(out)
+
+
+def _run_parallel(source, output, workers, concurrency, chunk_size):
+    # Не больше 2 чанков на воркер в полёте - вход не буферизуется целиком
+    in_flight = set()
+    first_line = 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            while len(in_flight) < workers * 2:
+                chunk = list(islice(source, chunk_size))
+                if not chunk:
+                    break
+                in_flight.add(pool.submit(_score_chunk, chunk, first_line, concurrency))
+                first_line += len(chunk)
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                output.writelines(future.result())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перескоринг NDJSON CheckRequest")
+    parser.add_argument("input", nargs="?", default="-", help="NDJSON файл (по умолчанию stdin)")
+    parser.add_argument("-o", "--output", default="-", help="куда писать результаты (по умолчанию stdout)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="число процессов")
+    parser.add_argument("--concurrency", type=int, default=settings.stream_concurrency, help="параллельных проверок на процесс")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="строк на задание воркера")
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        if args.workers <= 1:
+            asyncio.run(_run_single(source, output, args.concurrency))
+        else:
+            _run_parallel(source, output, args.workers, args.concurrency, args.chunk_size)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
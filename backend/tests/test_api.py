@@ -1,3 +1,4 @@
+import json
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
@@ -5,6 +6,7 @@ from sqlalchemy.orm import sessionmaker
 from app.main import app
 from app.db import Base, get_db
 from app.config import settings
+from app.metrics import instrument_engine
 
 # Тестовая БД в памяти
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
@@ -23,6 +25,9 @@ app.dependency_overrides[get_db] = override_get_db
 # Создаём таблицы
 Base.metadata.create_all(bind=engine)
 
+# SQL тестовой БД - в метриках и Server-Timing, как у db.engine
+instrument_engine(engine)
+
 client = TestClient(app)
 
 API_KEY = "antifraud_dev_key_2024"
@@ -67,6 +72,81 @@ def test_check_without_api_key():
     assert response.status_code == 401
 
 
+def test_check_duplicate_submission_replayed():
+    payload = {"email": "replay@gmail.com", "ip": "9.9.9.9", "bin": "411111"}
+    first = client.post("/api/check", json=payload, headers=HEADERS)
+    second = client.post("/api/check", json=dict(reversed(list(payload.items()))), headers=HEADERS)
+    assert first.status_code == 200 and second.status_code == 200
+    assert second.json()["check_id"] == first.json()["check_id"]
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+
+
+def test_idempotency_key_reused_with_different_body():
+    headers = {**HEADERS, "Idempotency-Key": "order-42"}
+    first = client.post("/api/check", json={"email": "a@gmail.com", "ip": "9.9.9.8"}, headers=headers)
+    assert first.status_code == 200
+    conflict = client.post("/api/check", json={"email": "b@gmail.com", "ip": "9.9.9.8"}, headers=headers)
+    assert conflict.status_code == 422
+
+
+def test_idempotency_key_is_scoped_by_api_key(monkeypatch):
+    monkeypatch.setattr(settings, "api_key_profiles", {"partner_key": "standard"})
+    first = client.post("/api/check", json={"email": "a@gmail.com", "ip": "9.9.9.4"}, headers={**HEADERS, "Idempotency-Key": "order-7"})
+    # Другой клиент с тем же Idempotency-Key - своя проверка, а не чужой ответ или конфликт
+    other = client.post("/api/check", json={"email": "b@gmail.com", "ip": "9.9.9.4"}, headers={"X-API-Key": "partner_key", "Idempotency-Key": "order-7"})
+    assert first.status_code == 200 and other.status_code == 200
+    assert other.json()["check_id"] != first.json()["check_id"]
+    assert "Idempotent-Replayed" not in other.headers
+
+
+def test_check_pipeline_profiles():
+    payload = {"email": "profiles@gmail.com", "ip": "9.9.9.7", "bin": "411111", "typing_speed_ms_avg": 120}
+    full = client.post("/api/check", json=payload, headers={**HEADERS, "X-Pipeline-Profile": "full"})
+    assert full.status_code == 200
+    assert full.json()["ml_analysis"] is not None
+
+    lite = client.post("/api/check", json=payload, headers={**HEADERS, "X-Pipeline-Profile": "lite"})
+    assert lite.status_code == 200
+    assert lite.json().get("ml_analysis") is None
+    # Тот же запрос в другом профиле - не повтор
+    assert lite.json()["check_id"] != full.json()["check_id"]
+
+    unknown = client.post("/api/check", json=payload, headers={**HEADERS, "X-Pipeline-Profile": "turbo"})
+    assert unknown.status_code == 400
+
+
+def test_check_profile_bound_to_api_key(monkeypatch):
+    monkeypatch.setattr(settings, "api_key_profiles", {"search_key": "lite"})
+    response = client.post("/api/check", json={"email": "search@gmail.com", "ip": "9.9.9.6"}, headers={"X-API-Key": "search_key"})
+    assert response.status_code == 200
+    assert client.post("/api/check", json={"email": "x@gmail.com"}, headers={"X-API-Key": "other_key"}).status_code == 401
+
+
+def test_check_session_flow():
+    with TestClient(app) as session_client:
+        start = session_client.post("/api/check/session", json={"user_agent": "Mozilla/5.0"}, headers=HEADERS)
+        assert start.status_code == 200
+        session_id = start.json()["session_id"]
+
+        update = session_client.patch(f"/api/check/session/{session_id}", json={"email": "session@gmail.com", "ip": "9.9.9.5"}, headers=HEADERS)
+        assert update.status_code == 200
+        assert "email" in update.json()["started"]
+
+        final = session_client.post(f"/api/check/session/{session_id}/finalize", json={"email": "session@gmail.com", "ip": "9.9.9.5"}, headers=HEADERS)
+        assert final.status_code == 200
+        assert "check_id" in final.json()
+
+        # Ретрай submit после того, как сессия закрыта - исходный ответ
+        retry = session_client.post(f"/api/check/session/{session_id}/finalize", json={"email": "session@gmail.com", "ip": "9.9.9.5"}, headers=HEADERS)
+        assert retry.status_code == 200
+        assert retry.json()["check_id"] == final.json()["check_id"]
+        assert retry.headers["Idempotent-Replayed"] == "true"
+
+        missing = session_client.patch(f"/api/check/session/{session_id}", json={"bin": "411111"}, headers=HEADERS)
+        assert missing.status_code == 404
+
+
 def test_checks_list():
     response = client.get("/api/checks", headers=HEADERS)
     assert response.status_code == 200
@@ -74,6 +154,50 @@ def test_checks_list():
     assert isinstance(data, list)
 
 
+def test_prometheus_metrics():
+    client.post("/api/check", json={"email": "metrics@yopmail.com", "ip": "10.3.3.3"}, headers=HEADERS)
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'antifraud_rule_duration_seconds_bucket{le="0.0001",rule="email"}' in body
+    assert 'antifraud_rule_hits_total{flag="temporary_email",rule="email"}' in body
+    assert 'antifraud_stage_duration_seconds_count{stage="rules"}' in body
+    assert "antifraud_stored_checks" in body
+
+
+def test_failed_sql_statement_is_timed_as_error():
+    from sqlalchemy import text
+    from app.metrics import DB_DURATION
+    failing = create_engine("sqlite://")
+    instrument_engine(failing)
+    with failing.connect() as conn:
+        with pytest.raises(Exception):
+            conn.execute(text("SELECT * FROM missing_table"))
+        # Метка времени упавшего запроса снята, следующий запрос меряется как обычно
+        assert not conn.info["query_started"]
+        conn.execute(text("SELECT 1"))
+    assert DB_DURATION.labels("SELECT", "error")._sum.get() > 0
+    assert DB_DURATION.labels("SELECT", "ok")._sum.get() > 0
+
+
+def test_server_timing_counts_request_cost(monkeypatch):
+    # По умолчанию заголовка нет - публичный /api/check не раскрывает стоимость запроса
+    hidden = client.post("/api/check", json={"email": "timing0@gmail.com", "ip": "10.4.4.3"}, headers=HEADERS)
+    assert "server-timing" not in hidden.headers
+
+    monkeypatch.setattr(settings, "server_timing_enabled", True)
+    response = client.post("/api/check", json={"email": "timing@gmail.com", "ip": "10.4.4.4"}, headers=HEADERS)
+    assert response.status_code == 200
+    timing = dict(
+        (entry.split(";")[0].strip(), entry) for entry in response.headers["server-timing"].split(",")
+    )
+    assert set(timing) == {"sql", "redis", "http", "app"}
+    # velocity + blacklist - как минимум три SELECT
+    queries = int(timing["sql"].split('desc="')[1].split(" ")[0])
+    assert queries >= 3
+
+
 def test_blacklist_operations():
     # Добавляем IP в blacklist
     response = client.post("/api/blacklist", json={"ip": "1.2.3.4"}, headers=HEADERS)
@@ -85,3 +209,86 @@ def test_blacklist_operations():
     data = response.json()
     assert len(data) > 0
     assert any(entry["ip"] == "1.2.3.4" for entry in data)
+
+
+def test_batch_check_endpoint():
+    client.post("/api/blacklist", json={"ip": "9.9.9.9"}, headers=HEADERS)
+    checks = [
+        {"email": "batch@example.com", "ip": "9.9.9.9", "bin": "411111"},
+    ] + [{"email": "repeat@example.com", "ip": "8.8.4.4", "bin": "411111"} for _ in range(5)]
+    
+    response = client.post("/api/check/batch", json={"checks": checks}, headers=HEADERS)
+    assert response.status_code == 200
+    
+    results = response.json()["results"]
+    assert len(results) == len(checks)
+    assert len({r["check_id"] for r in results}) == len(checks)
+    assert "ip_blacklisted" in results[0]["fraud_flags"]
+    # Ранние элементы батча учитываются в velocity
+    assert "too_many_attempts" in results[-1]["fraud_flags"]
+    from app.models import FraudCheck
+    with TestingSessionLocal() as db:
+        assert db.get(FraudCheck, results[0]["check_id"]) is not None
+
+
+def test_batch_check_without_api_key():
+    response = client.post("/api/check/batch", json={"checks": [{"email": "test@gmail.com"}]})
+    assert response.status_code == 401
+
+
+def test_stream_check_endpoint():
+    lines = [
+        '{"email": "stream1@example.com", "ip": "8.8.8.8"}',
+        '',
+        '{"email": "stream2@yopmail.com"}',
+        'not json',
+    ]
+    response = client.post("/api/check/stream", content="\n".join(lines), headers=HEADERS)
+    assert response.status_code == 200
+    
+    out = [json.loads(line) for line in response.text.splitlines()]
+    by_line = {item["line"]: item for item in out}
+    assert set(by_line) == {1, 3, 4}
+    assert by_line[1]["check_id"] is not None
+    assert "temporary_email" in by_line[3]["fraud_flags"]
+    assert "error" in by_line[4]
+
+
+def test_stream_rescore_without_persist_and_oversized_line(monkeypatch):
+    from app.models import FraudCheck
+    monkeypatch.setattr(settings, "stream_max_line_bytes", 200)
+    lines = [
+        '{"email": "rescore@example.com", "ip": "8.8.4.4"}',
+        '{"email": "' + "x" * 500 + '@example.com"}',
+        '{"email": "rescore2@example.com", "ip": "8.8.4.4"}',
+    ]
+    # Маленькие чанки: длинная строка приходит частями и не должна копиться
+    chunks = [line[i:i + 64] for line in ("\n".join(lines),) for i in range(0, len(line), 64)]
+    response = client.post("/api/check/stream?persist=false", content=iter(c.encode() for c in chunks), headers=HEADERS)
+    assert response.status_code == 200
+
+    by_line = {item["line"]: item for item in map(json.loads, response.text.splitlines())}
+    assert set(by_line) == {1, 2, 3}
+    assert by_line[2]["error"] == "line exceeds 200 bytes"
+    # Без записи ID не выдаётся: его не было бы в БД
+    assert "check_id" not in by_line[1] and by_line[1]["risk_score"] >= 0
+    with TestingSessionLocal() as db:
+        assert db.query(FraudCheck).filter(FraudCheck.email == "rescore@example.com").count() == 0
+
+
+def test_stream_reports_invalid_utf8_and_persist_failures(monkeypatch):
+    import app.streaming as streaming
+
+    def broken_persist(bind, scored):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(streaming, "_persist", broken_persist)
+    body = b'{"email": "utf8-1@example.com"}\n{"email": "\xff\xfe@example.com"}\n{"email": "utf8-3@example.com"}\n'
+    response = client.post("/api/check/stream", content=body, headers=HEADERS)
+    assert response.status_code == 200
+
+    records = [json.loads(line) for line in response.text.splitlines()]
+    errors = {item["line"]: item["error"] for item in records if "error" in item}
+    assert errors[2] == "line is not valid UTF-8"
+    # Поток дошёл до конца: результаты отданы, несохранённые строки помечены
+    assert {item["line"] for item in records if "risk_score" in item} == {1, 3}
+    assert errors[1].startswith("not persisted: RuntimeError") and errors[3].startswith("not persisted")
@@ -0,0 +1,17 @@
+from benchmark_rules import compare, local_benchmarks, measure
+
+
+def test_every_local_benchmark_runs_on_generated_corpus():
+    benchmarks = local_benchmarks(size=50, seed=1)
+    assert {"check_email_reputation", "check_device", "aggregate_score_and_flags", "analyze_behavioral_patterns", "dsl_bot", "dsl_timezone", "dsl_device"} <= set(benchmarks)
+    for func, corpus in benchmarks.values():
+        result = measure(func, corpus, repeat=1)
+        assert result["calls"] == 50 and result["min_us"] > 0
+
+
+def test_compare_flags_rules_slower_than_tolerance():
+    baseline = {"results": {"email": {"min_us": 2.0}, "bot": {"min_us": 1.0}}}
+    results = {"email": {"min_us": 2.4}, "bot": {"min_us": 1.3}, "new_rule": {"min_us": 5.0}}
+    lines, regressions = compare(results, baseline, tolerance=0.25)
+    assert regressions == ["bot"]
+    assert len(lines) == 3
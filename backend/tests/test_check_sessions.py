@@ -0,0 +1,38 @@
+import asyncio
+from sqlalchemy import create_engine
+from app.cache import geo_cache
+from app.check_sessions import CheckSessionStore
+from app.db import Base
+from app.schemas import CheckRequest
+
+
+def test_lookups_start_when_inputs_arrive_and_match_on_finalize(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'sessions.db'}")
+    Base.metadata.create_all(bind=engine)
+    geo_cache.set(geo_cache._make_key("geo", "10.1.1.1"), "GB")
+    store = CheckSessionStore(ttl_seconds=60)
+
+    async def scenario():
+        session = store.start()
+        on_load = store.update(session, {"ip": "10.1.1.1"}, engine)
+        on_email = store.update(session, {"email": "early@gmail.com"}, engine)
+        again = store.update(session, {"email": "early@gmail.com"}, engine)
+        # Пользователь поменял email перед submit - email по старому значению не годятся
+        final = CheckRequest(email="changed@gmail.com", ip="10.1.1.1")
+        return on_load, on_email, again, await store.finalize(session.session_id, final), await store.finalize(session.session_id, final)
+
+    on_load, on_email, again, results, second = asyncio.run(scenario())
+    # Velocity и blacklist зависят от состояния на момент submit - не предрасчитываются
+    assert set(on_load) == {"ip_country"}
+    assert set(on_email) == {"email"}
+    assert again == []
+    assert results["ip_country"] == "GB"
+    assert set(results) == {"ip_country"}
+    assert second == {}
+    assert len(store) == 0
+
+
+def test_expired_session_is_dropped():
+    store = CheckSessionStore(ttl_seconds=0)
+    session = store.start()
+    assert store.get(session.session_id) is None
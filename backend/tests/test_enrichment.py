@@ -0,0 +1,74 @@
+import asyncio
+import json
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.db import Base
+from app.enrichment import Enricher, score_provisional
+from app.models import FraudCheck
+from app.profiles import PROFILES
+from app.schemas import CheckRequest
+from app.websocket_manager import websocket_manager
+
+
+def test_enrichment_rescores_same_check_and_revises_verdict(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'enrich.db'}")
+    Base.metadata.create_all(bind=engine)
+    email = "revised@gmail.com"
+    # История другого воркера: в памяти этого процесса попыток нет, в БД - есть
+    with Session(bind=engine) as db:
+        db.add_all([FraudCheck(email=email, ip="", bin="", user_agent="", risk_score=0, fraud_flags="[]") for _ in range(4)])
+        db.commit()
+
+    revisions = []
+
+    async def capture(data):
+        revisions.append(data)
+
+    monkeypatch.setattr(websocket_manager, "broadcast_verdict_revised", capture)
+    monkeypatch.setattr(settings, "threshold_review", 15)
+    payload = CheckRequest(email=email, typing_speed_ms_avg=120, session_duration_ms=60000, mouse_moves_count=40, first_click_delay_ms=2000)
+
+    async def scenario():
+        enricher = Enricher()
+        with Session(bind=engine) as db:
+            provisional = await score_provisional(payload, db, PROFILES["two_phase"])
+            db.add_all(provisional.rows())
+            db.commit()
+        enricher.schedule(provisional, engine)
+        await enricher.drain()
+        return provisional
+
+    provisional = asyncio.run(scenario())
+    assert provisional.response().provisional is True
+    assert "too_many_attempts" not in provisional.flags
+
+    with Session(bind=engine) as db:
+        stored = db.get(FraudCheck, provisional.check_id)
+        assert "too_many_attempts" in json.loads(stored.fraud_flags)
+        assert stored.risk_score > provisional.score
+    assert revisions and revisions[0]["check_id"] == provisional.check_id
+    assert revisions[0]["previous_recommendation"] == "allow"
+
+
+def test_enrichment_velocity_does_not_count_the_provisional_row(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'enrich.db'}")
+    Base.metadata.create_all(bind=engine)
+    email = "borderline@gmail.com"
+    with Session(bind=engine) as db:
+        db.add_all([FraudCheck(email=email, ip="", bin="", user_agent="", risk_score=0, fraud_flags="[]") for _ in range(3)])
+        db.commit()
+    payload = CheckRequest(email=email, typing_speed_ms_avg=120, session_duration_ms=60000, mouse_moves_count=40, first_click_delay_ms=2000)
+
+    async def scenario():
+        enricher = Enricher()
+        with Session(bind=engine) as db:
+            provisional = await score_provisional(payload, db, PROFILES["two_phase"])
+            # Предварительная строка уже записана к моменту пересчёта
+            db.add_all(provisional.rows())
+            db.commit()
+        return await enricher._rescore(provisional, engine)
+
+    final = asyncio.run(scenario())
+    # 3 попытки до этой проверки - не больше порога, как и при записи после пересчёта
+    assert "too_many_attempts" not in final.flags
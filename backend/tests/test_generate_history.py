@@ -0,0 +1,73 @@
+import json
+import pytest
+from datetime import datetime
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.ids import id_to_datetime
+from app.models import AnomalyDetection, AuditLog, BlacklistIP, FraudCheck
+from generate_history import generate_history
+
+
+def test_generated_history_is_consistent_and_realistic(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    now = datetime(2025, 3, 1, 12, 30)
+    written = generate_history(engine, 5000, days=7, audit_logs=200, blacklist_extra=100, seed=3, chunk=700, now=now)
+    assert written["fraud_checks"] == 5000 and written["audit_logs"] == 200
+
+    with Session(bind=engine) as db:
+        rows = db.execute(select(FraudCheck.id, FraudCheck.created_at, FraudCheck.email, FraudCheck.ip, FraudCheck.risk_score, FraudCheck.fraud_flags).order_by(FraudCheck.id)).all()
+        blacklisted = set(db.execute(select(BlacklistIP.ip)).scalars())
+        anomalies = db.execute(select(func.count()).select_from(AnomalyDetection)).scalar()
+        audit = db.execute(select(func.count()).select_from(AuditLog)).scalar()
+
+    # Snowflake ID идут в порядке времени и совпадают с created_at до миллисекунды
+    assert [r.created_at for r in rows] == sorted(r.created_at for r in rows)
+    assert abs((id_to_datetime(rows[0].id).replace(tzinfo=None) - rows[0].created_at).total_seconds()) < 0.01
+    assert rows[-1].created_at <= now
+    assert 0.8 * 5000 < anomalies < 5000 and audit == 200
+
+    # Скоринг по весам из настроек
+    for r in rows[:500]:
+        flags = json.loads(r.fraud_flags)
+        if flags == ["geo_mismatch"]:
+            assert r.risk_score == settings.score_geo_mismatch
+
+    # Постоянные клиенты и фрод-всплески с одного IP
+    per_email = {}
+    per_ip = {}
+    for r in rows:
+        per_email[r.email] = per_email.get(r.email, 0) + 1
+        per_ip[r.ip] = per_ip.get(r.ip, 0) + 1
+    assert max(per_email.values()) >= 10
+    burst_ips = {r.ip for r in rows if "too_many_attempts" in r.fraud_flags and r.email.startswith("f")}
+    assert burst_ips and any(ip in blacklisted for ip in burst_ips)
+
+
+def test_reset_regenerates_same_history_for_same_seed(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    now = datetime(2025, 3, 1, 12, 0)
+    generate_history(engine, 800, days=2, seed=5, now=now)
+    with Session(bind=engine) as db:
+        first = db.execute(select(FraudCheck.id, FraudCheck.email).order_by(FraudCheck.id)).all()
+    generate_history(engine, 800, days=2, seed=5, now=now, reset=True, drop_indexes=False)
+    with Session(bind=engine) as db:
+        assert db.execute(select(FraudCheck.id, FraudCheck.email).order_by(FraudCheck.id)).all() == first
+
+
+def test_indexes_are_restored_when_load_fails(tmp_path, monkeypatch):
+    import generate_history as module
+    from sqlalchemy import inspect
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    add = module.BulkWriter.add
+
+    def failing_add(self, table, row):
+        if table == "fraud_checks" and self.written["fraud_checks"] >= 100:
+            raise RuntimeError("disk full")
+        add(self, table, row)
+
+    monkeypatch.setattr(module.BulkWriter, "add", failing_add)
+    with pytest.raises(RuntimeError):
+        generate_history(engine, 1000, days=1, seed=1, chunk=50, now=datetime(2025, 3, 1, 12, 0))
+    expected = {index.name for index in FraudCheck.__table__.indexes}
+    assert expected <= {index["name"] for index in inspect(engine).get_indexes("fraud_checks")}
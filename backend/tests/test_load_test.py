@@ -0,0 +1,95 @@
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+from app.cache import SimpleCache
+from app.config import settings
+from app.main import app
+from app.rules.geo import bin_country_lookup, get_ip_country, provider_url
+from app.rate_limiter import RateLimiter
+from load_test import BIN_HOSTS, GEO_HOSTS, ProviderStub, StubServers, growth_verdict, percentile, run_in_process
+
+
+def test_provider_url_rewrites_only_overridden_hosts(monkeypatch):
+    monkeypatch.setattr(settings, "provider_base_urls", {"ipapi.co": "http://127.0.0.1:9101/"})
+    assert provider_url("https://ipapi.co/1.2.3.4/json/") == "http://127.0.0.1:9101/1.2.3.4/json/"
+    assert provider_url("https://ipinfo.io/1.2.3.4/json") == "https://ipinfo.io/1.2.3.4/json"
+
+
+def test_geo_and_bin_lookups_fall_back_across_stubs(monkeypatch):
+    # Основной geo API всегда отвечает 503 - страну отдаёт следующий в цепочке
+    stubs = [ProviderStub(host, latency_ms=1, jitter_ms=0) for host in GEO_HOSTS + BIN_HOSTS]
+    stubs[0].error_rate = 1.0
+    servers = StubServers(stubs)
+    monkeypatch.setattr(settings, "provider_base_urls", servers.start())
+    try:
+        assert asyncio.run(get_ip_country("10.20.30.41"))
+        assert asyncio.run(bin_country_lookup("987654"))
+    finally:
+        servers.stop()
+    stats = servers.stats()
+    assert stats["ipapi.co"] == {"requests": 1, "errors": 1, "timeouts": 0}
+    assert stats["ip-api.com"]["requests"] == 1
+    assert stats["lookup.binlist.net"]["requests"] == 1
+
+
+def test_in_process_run_reports_every_endpoint_of_the_mix(monkeypatch):
+    servers = StubServers([ProviderStub(host, latency_ms=1, jitter_ms=0) for host in GEO_HOSTS + BIN_HOSTS])
+    monkeypatch.setattr(settings, "provider_base_urls", servers.start())
+    monkeypatch.setattr(settings, "rate_limit_ip", 10**9)
+    monkeypatch.setattr(settings, "rate_limit_email", 10**9)
+    try:
+        mix = {"check": 1, "session": 1, "batch": 1, "stream": 1}
+        recorder = asyncio.run(run_in_process(app, mix=mix, api_key=settings.api_key, concurrency=4, requests=12, batch_size=3))
+    finally:
+        servers.stop()
+
+    report = recorder.report()
+    assert {"POST /api/check", "POST /api/check/session/{id}/finalize", "POST /api/check/batch", "POST /api/check/stream"} <= set(report["endpoints"])
+    assert all(row["errors"] == 0 for row in report["endpoints"].values())
+    row = report["endpoints"]["POST /api/check"]
+    assert row["p50_ms"] <= row["p95_ms"] <= row["p99_ms"] <= row["max_ms"]
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert (percentile(values, 50), percentile(values, 99), percentile(values, 100)) == (50, 99, 100)
+    assert percentile([], 95) == 0.0
+
+
+def _samples(rss, sizes):
+    return [{"t": 60.0 * i, "rss_mb": rss(i), "sizes": {"geo_cache": sizes(i), "gc_objects": 100000}} for i in range(12)]
+
+
+def test_growth_verdict_passes_plateau_and_flags_leaks():
+    plateau = _samples(lambda i: 150 + min(i, 3) * 4 + (i % 2) * 0.5, lambda i: min(5000, 2000 * i))
+    assert growth_verdict(plateau, warmup=180) == []
+
+    leaking = _samples(lambda i: 150 + 2 * i, lambda i: 1000 * i)
+    problems = growth_verdict(leaking, warmup=180)
+    assert any(p.startswith("rss grows") for p in problems)
+    assert any(p.startswith("geo_cache grows") for p in problems)
+    assert growth_verdict(plateau, warmup=600) and "need at least 3" in growth_verdict(plateau, warmup=600)[0]
+
+
+def test_long_lived_structures_stay_bounded():
+    cache = SimpleCache(name="test", max_entries=100)
+    for i in range(1000):
+        cache.set(f"k{i}", i)
+    assert len(cache._cache) <= 100 and cache.evictions >= 900
+    assert cache.get("k999") == 999 and cache.get("k0") is None
+
+    # LRU: запись, которую постоянно читают (счётчик отпечатка), переживает поток новых ключей
+    cache.set("hot", 1)
+    for i in range(1000):
+        cache.set(f"n{i}", i)
+        assert cache.get("hot") == 1
+
+    limiter = RateLimiter(sweep_every=50)
+    for i in range(200):
+        assert limiter.is_allowed(f"ip:{i}", limit=5)
+    stale = datetime.utcnow() - timedelta(minutes=5)
+    for key in list(limiter._requests)[:150]:
+        limiter._requests[key] = deque([stale])
+    for i in range(50):
+        limiter.is_allowed("ip:hot", limit=10 ** 6)
+    assert len(limiter._requests) == 51
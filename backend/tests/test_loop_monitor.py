@@ -0,0 +1,62 @@
+import asyncio
+import time
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.auth import create_access_token
+from app.loop_monitor import LoopMonitor, LoopTaskMiddleware
+from app.main import app
+from app.metrics import LOOP_LAG
+
+
+def hash_password_on_loop():
+    time.sleep(0.15)
+
+
+def test_blocking_handler_is_reported_with_frame_and_endpoint():
+    monitor = LoopMonitor(interval=0.01, threshold=0.05, debug=True)
+    demo = FastAPI()
+    demo.add_middleware(LoopTaskMiddleware, monitor=monitor)
+
+    @demo.post("/api/login")
+    async def login():
+        hash_password_on_loop()
+        return {"ok": True}
+
+    @demo.get("/api/fast")
+    async def fast():
+        await asyncio.sleep(0.05)
+        return {"ok": True}
+
+    @demo.on_event("startup")
+    async def start():
+        monitor.start()
+
+    @demo.on_event("shutdown")
+    async def stop():
+        await monitor.stop()
+
+    with TestClient(demo) as client:
+        assert client.get("/api/fast").status_code == 200
+        time.sleep(0.05)
+        assert monitor.blocks == 0
+        assert client.post("/api/login").status_code == 200
+        time.sleep(0.05)
+
+    reports = monitor.reports()
+    assert len(reports) == 1
+    report = reports[0]
+    assert (report["endpoint"], report["method"], report["path"]) == ("login", "POST", "/api/login")
+    assert report["frame"].endswith(":hash_password_on_loop")
+    assert report["stack"][-2].endswith(":login") and report["app_frame"] is None
+    assert report["blocked_ms"] >= 80
+    assert monitor.max_lag >= 0.08
+    assert LOOP_LAG._value.get() < 0.05
+
+
+def test_loop_blocks_endpoint_requires_admin():
+    client = TestClient(app)
+    analyst = {"Authorization": f"Bearer {create_access_token({'sub': 'analyst', 'role': 'analyst'})}"}
+    admin = {"Authorization": f"Bearer {create_access_token({'sub': 'admin', 'role': 'admin'})}"}
+    assert client.get("/api/admin/loop-blocks", headers=analyst).status_code == 403
+    body = client.get("/api/admin/loop-blocks", headers=admin).json()
+    assert body["debug"] is False and body["reports"] == []
@@ -0,0 +1,53 @@
+import sys
+from fastapi.testclient import TestClient
+from app.auth import create_access_token
+from app.cache import geo_cache
+from app.db import engine
+from app.main import app
+from app.memory import MemoryAccounting, approx_size, entry_counts
+
+ADMIN = {"Authorization": f"Bearer {create_access_token({'sub': 'admin', 'role': 'admin'})}"}
+
+
+def test_approx_size_samples_large_containers_close_to_exact():
+    values = {f"key-{i}": "x" * (1 + i % 37) for i in range(20000)}
+    exact = sys.getsizeof(values) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in values.items())
+    assert abs(approx_size(values) - exact) / exact < 0.1
+    # Общий объект считается один раз
+    shared = ["y" * 1000]
+    assert approx_size([shared, shared]) < approx_size([shared, ["y" * 1000]])
+
+
+def test_report_counts_cache_bytes_and_growth():
+    accounting = MemoryAccounting()
+    first = accounting.report(engine)
+    assert "growth_bytes_per_hour" not in first["structures"]["geo_cache"]
+    assert first["sqlalchemy"]["pool"]["class"]
+    try:
+        for i in range(2000):
+            geo_cache.set(f"memory-test:{i}", "US" * 20)
+        second = accounting.report(engine)
+    finally:
+        for i in range(2000):
+            geo_cache._cache.pop(f"memory-test:{i}", None)
+    row = second["structures"]["geo_cache"]
+    assert row["entries"] >= 2000 and row["bytes"] - first["structures"]["geo_cache"]["bytes"] > 2000 * 100
+    assert row["growth_bytes_per_hour"] > 0
+    assert entry_counts()["geo_cache"] == len(geo_cache._cache)
+
+
+def test_memory_endpoints_and_tracemalloc_diff():
+    client = TestClient(app)
+    analyst = {"Authorization": f"Bearer {create_access_token({'sub': 'analyst', 'role': 'analyst'})}"}
+    assert client.get("/api/admin/memory", headers=analyst).status_code == 403
+    assert "rate_limiter" in client.get("/api/admin/memory", headers=ADMIN).json()["structures"]
+
+    baseline = client.post("/api/admin/memory/snapshot", headers=ADMIN).json()
+    assert baseline["baseline"] and baseline["tracing"]
+    try:
+        kept = [bytearray(1000) for _ in range(2000)]
+        diff = client.post("/api/admin/memory/snapshot?top=5", headers=ADMIN).json()["diff"]
+        assert len(diff) <= 5 and any("test_memory.py" in row["where"][0] and row["size_diff_bytes"] > 1_000_000 for row in diff)
+        del kept
+    finally:
+        assert client.delete("/api/admin/memory/snapshot", headers=ADMIN).json() == {"tracing": False}
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+import time
+from fastapi.testclient import TestClient
+from app.auth import create_access_token
+from app.main import app
+from app.pipeline import score_check
+from app.profiler import SamplingProfiler, SlowCheckCapture, payload_shape
+from app.rules.result import NO_SIGNAL
+from app.schemas import CheckRequest
+
+
+def busy_rule_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampler_collects_collapsed_stacks_of_other_threads():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_rule_loop, args=(stop,), name="busy")
+    worker.start()
+    profiler = SamplingProfiler()
+    profiler.start(interval=0.001)
+    time.sleep(0.1)
+    collapsed = profiler.stop()
+    stop.set()
+    worker.join()
+
+    assert profiler.samples > 10
+    lines = collapsed.splitlines()
+    busy = [line for line in lines if line.startswith("busy;")]
+    assert busy and "test_profiler.py:busy_rule_loop" in busy[0]
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert not any(line.startswith("sampling-profiler;") for line in lines)
+
+
+def test_slow_check_keeps_rule_breakdown_and_payload_shape():
+    payload = CheckRequest(email="slow@gmail.com", device_info={"screen": {"width": 1920}}, user_agent="Mozilla/5.0")
+    scored = asyncio.run(score_check(payload, None, {"velocity": NO_SIGNAL, "blacklist": NO_SIGNAL, "ip_country": None, "bin_country": None}))
+    capture = SlowCheckCapture(threshold_ms=100)
+    assert not capture.observe(scored, 99)
+    assert capture.observe(scored, 150)
+
+    entry = capture.entries()[0]
+    assert entry["check_id"] == scored.check_id
+    assert "email" in entry["rule_ms"]
+    assert entry["payload_shape"]["email"] == "str[14]"
+    assert entry["payload_shape"]["device_info"] == {"screen": {"width": "int"}}
+    assert payload_shape([1, 2]) == "list[2]"
+
+
+def test_admin_endpoints_require_admin_role():
+    client = TestClient(app)
+    analyst = {"Authorization": f"Bearer {create_access_token({'sub': 'analyst', 'role': 'analyst'})}"}
+    admin = {"Authorization": f"Bearer {create_access_token({'sub': 'admin', 'role': 'admin'})}"}
+    assert client.get("/api/admin/slow-checks", headers=analyst).status_code == 403
+    assert client.post("/api/rules/reload", headers=analyst).status_code == 403
+
+    response = client.post("/api/admin/profile?seconds=0.05&interval_ms=1", headers=admin)
+    assert response.status_code == 200
+    assert int(response.headers["x-profile-samples"]) > 0
+    assert client.get("/api/admin/slow-checks", headers=admin).json()["threshold_ms"] >= 0
@@ -0,0 +1,99 @@
+import json
+import os
+import pytest
+from app.rule_dsl import DSLRules, RuleDSLError, RuleSet, dsl_rules
+from app.rule_engine import CheckContext
+from app.rules.bot import check_bot_activity
+from app.rules.timezone import check_timezone_mismatch
+from app.schemas import CheckRequest
+
+
+def _ctx(results=None, **fields):
+    return CheckContext(CheckRequest(email="user@gmail.com", **fields), results=results)
+
+
+def _parts(result):
+    return (result.score_delta, result.fraud_flag) if result else (0, None)
+
+
+@pytest.mark.parametrize("session, moves, click, typing", [
+    (5000, 10, 1000, 30),
+    (2000, 0, 500, 100),
+    (5000, 10, 100, 100),
+    (5000, 10, 1000, 100),
+    (None, 0, None, None),
+])
+def test_default_bot_rule_matches_handwritten(session, moves, click, typing):
+    ctx = _ctx(session_duration_ms=session, mouse_moves_count=moves, first_click_delay_ms=click, typing_speed_ms_avg=typing)
+    expected = check_bot_activity(session, moves, click, typing)
+    assert _parts(dsl_rules.current.evaluate("bot", ctx)) == (expected.score_delta, expected.fraud_flag)
+
+
+@pytest.mark.parametrize("country, tz", [("US", "Europe/London"), ("GB", "Europe/London"), ("ZZ", "UTC"), (None, "UTC")])
+def test_default_timezone_rule_matches_handwritten(country, tz):
+    ctx = _ctx(results={"ip_country": country}, timezone=tz)
+    expected = check_timezone_mismatch(country, tz)
+    assert _parts(dsl_rules.current.evaluate("timezone", ctx)) == (expected.score_delta, expected.fraud_flag)
+
+
+def _rules(threshold, score=20):
+    return json.dumps({"rules": [{"name": "bot", "cases": [
+        {"when": {"field": "typing_speed_ms_avg", "op": "lt", "value": threshold}, "score": score, "flag": "fast"},
+    ]}]})
+
+
+def test_reload_swaps_version_and_keeps_in_flight(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(_rules(40))
+    rules = DSLRules(str(path))
+    in_flight = rules.current
+    ctx = _ctx(typing_speed_ms_avg=50)
+
+    path.write_text(_rules(60, score=30))
+    os.utime(path, (0, 1))
+    assert rules.reload()
+    assert _parts(rules.current.evaluate("bot", ctx)) == (30, "fast")
+    assert rules.current.max_score("bot") == 30
+    # Проверка, начатая до перезагрузки, видит старые пороги
+    assert _parts(in_flight.evaluate("bot", ctx)) == (0, None)
+    assert not rules.reload()
+
+
+def test_invalid_reload_keeps_current_version(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(_rules(40))
+    rules = DSLRules(str(path))
+    version = rules.current.version
+
+    path.write_text(json.dumps({"rules": [{"name": "bot", "cases": [{"when": {"field": "typing_speed_ms_avg", "op": "approx", "value": 1}}]}]}))
+    with pytest.raises(RuleDSLError):
+        rules.reload(force=True)
+    assert rules.current.version == version
+
+
+def test_dependencies_inferred_from_results_fields():
+    ruleset = RuleSet.compile(json.dumps({"rules": [{"name": "tz", "cases": [
+        {"when": {"field": "timezone", "op": "contains_none", "lookup": {"field": "results.ip_country", "table": {"GB": ["Europe/London"]}}}, "score": 5},
+    ]}]}))
+    assert ruleset.depends_on("tz") == ("ip_country",)
+    with pytest.raises(RuleDSLError):
+        RuleSet.compile(json.dumps({"rules": [{"name": "x", "cases": [{"when": {"field": "nope", "op": "null"}}]}]}))
+
+
+def test_compiled_conditions_keep_null_and_regex_semantics():
+    ruleset = RuleSet.compile(json.dumps({"rules": [
+        {"name": "fast", "cases": [{"when": {"all": [
+            {"field": "session_duration_ms", "op": "not_null"},
+            {"field": "session_duration_ms", "op": "lt", "value": 3000},
+        ]}, "score": 5, "flag": "fast"}]},
+        {"name": "ua", "cases": [{"when": {"any": [
+            {"field": "user_agent", "op": "matches", "value": "(?i)curl"},
+            {"field": "user_agent", "op": "matches", "value": "wget"},
+        ]}, "score": 7, "flag": "ua"}]},
+    ]}))
+    assert ruleset.evaluate("fast", CheckContext(CheckRequest(email="a@b.c"))) is None
+    assert ruleset.evaluate("fast", CheckContext(CheckRequest(email="a@b.c", session_duration_ms=100))).score_delta == 5
+    # Шаблон с глобальным флагом не сливается в альтернацию, но работает
+    assert ruleset.evaluate("ua", CheckContext(CheckRequest(email="a@b.c", user_agent="CURL/8"))).fraud_flag == "ua"
+    assert ruleset.evaluate("ua", CheckContext(CheckRequest(email="a@b.c", user_agent="Wget"))).fraud_flag == "ua"
+    assert ruleset.evaluate("ua", CheckContext(CheckRequest(email="a@b.c"))) is None
@@ -0,0 +1,186 @@
+import asyncio
+import time
+import pytest
+from types import SimpleNamespace
+from app.rule_engine import RuleEngine, CheckContext
+from app.rules.bot import BotRuleResult
+
+
+def test_independent_rules_run_concurrently():
+    engine = RuleEngine(max_workers=2)
+
+    @engine.rule("slow_async")
+    async def slow_async(ctx):
+        await asyncio.sleep(0.2)
+        return BotRuleResult(score_delta=10, fraud_flag="a")
+
+    @engine.rule("slow_blocking", blocking=True)
+    def slow_blocking(ctx):
+        time.sleep(0.2)
+        return BotRuleResult(score_delta=5, fraud_flag="b")
+
+    ctx = CheckContext(payload=None)
+    start = time.perf_counter()
+    asyncio.run(engine.run(ctx))
+    elapsed = time.perf_counter() - start
+    engine.shutdown()
+
+    assert elapsed < 0.35
+    assert engine.score_parts(ctx) == [(10, "a"), (5, "b")]
+
+
+def test_dependent_rule_waits_only_for_its_inputs():
+    engine = RuleEngine()
+    seen = {}
+
+    @engine.rule("ip_country", scored=False)
+    async def ip_country(ctx):
+        return "US"
+
+    @engine.rule("bin_country", scored=False)
+    async def bin_country(ctx):
+        await asyncio.sleep(0.1)
+        return "GB"
+
+    @engine.rule("timezone", depends_on=("ip_country",))
+    def timezone(ctx):
+        seen["bin_done"] = "bin_country" in ctx.results
+        return BotRuleResult(score_delta=0)
+
+    ctx = CheckContext(payload=None)
+    results = asyncio.run(engine.run(ctx))
+    assert results["ip_country"] == "US"
+    assert seen["bin_done"] is False
+    assert engine.score_parts(ctx) == [(0, None)]
+
+
+def test_dependency_cycle_rejected():
+    engine = RuleEngine()
+    engine.rule("a", depends_on=("b",))(lambda ctx: None)
+    engine.rule("b", depends_on=("a",))(lambda ctx: None)
+    with pytest.raises(ValueError):
+        engine.rules
+
+
+def test_rules_missing_deadline_are_degraded():
+    engine = RuleEngine()
+
+    @engine.rule("ip_country", scored=False)
+    async def ip_country(ctx):
+        await asyncio.sleep(1)
+        return "US"
+
+    @engine.rule("timezone", depends_on=("ip_country",))
+    def timezone(ctx):
+        return BotRuleResult(score_delta=20 if ctx.results["ip_country"] else 0)
+
+    @engine.rule("email")
+    def email(ctx):
+        return BotRuleResult(score_delta=25, fraud_flag="temporary_email")
+
+    async def scenario():
+        ctx = CheckContext(payload=None, deadline=asyncio.get_running_loop().time() + 0.05)
+        start = time.perf_counter()
+        await engine.run(ctx)
+        return ctx, time.perf_counter() - start
+
+    ctx, elapsed = asyncio.run(scenario())
+    assert elapsed < 0.5
+    assert ctx.degraded == ["ip_country"]
+    assert engine.score_parts(ctx) == [(0, "degraded:ip_country"), (0, None), (25, "temporary_email")]
+
+
+def test_early_exit_stops_once_recommendation_is_final():
+    engine = RuleEngine()
+    calls = []
+
+    @engine.rule("blacklist", max_score=lambda: 40)
+    def blacklist(ctx):
+        calls.append("blacklist")
+        return BotRuleResult(score_delta=40, fraud_flag="ip_blacklisted")
+
+    @engine.rule("email", max_score=lambda: 50)
+    def email(ctx):
+        calls.append("email")
+        return BotRuleResult(score_delta=50, fraud_flag="temporary_email")
+
+    @engine.rule("velocity", blocking=True, max_score=lambda: 20)
+    def velocity(ctx):
+        calls.append("velocity")
+        return BotRuleResult(score_delta=0)
+
+    ctx = CheckContext(payload=None, early_exit=True)
+    asyncio.run(engine.run(ctx))
+    engine.shutdown()
+
+    assert "velocity" not in calls
+    assert ctx.decided
+    assert ctx.skipped == ["velocity"]
+    assert engine.score_parts(ctx) == [(40, "ip_blacklisted"), (50, "temporary_email")]
+
+
+def test_full_mode_runs_every_rule():
+    engine = RuleEngine()
+    engine.rule("blacklist", max_score=lambda: 100)(lambda ctx: BotRuleResult(score_delta=100))
+    engine.rule("velocity", max_score=lambda: 20)(lambda ctx: BotRuleResult(score_delta=0))
+
+    ctx = CheckContext(payload=None)
+    asyncio.run(engine.run(ctx))
+    assert set(ctx.results) == {"blacklist", "velocity"}
+    assert not ctx.decided
+
+
+def test_profile_subset_runs_selected_rules_with_dependencies():
+    engine = RuleEngine()
+    engine.rule("ip_country", scored=False)(lambda ctx: "US")
+    engine.rule("timezone", depends_on=("ip_country",))(lambda ctx: BotRuleResult(score_delta=20, fraud_flag="timezone_mismatch"))
+    engine.rule("velocity", blocking=True)(lambda ctx: BotRuleResult(score_delta=20, fraud_flag="velocity"))
+
+    ctx = CheckContext(payload=None, only=frozenset({"timezone"}))
+    asyncio.run(engine.run(ctx))
+    engine.shutdown()
+    assert set(ctx.results) == {"ip_country", "timezone"}
+    assert engine.score_parts(ctx) == [(20, "timezone_mismatch")]
+
+
+def test_memoized_rule_reuses_result_for_same_inputs():
+    engine = RuleEngine()
+    calls = []
+
+    @engine.rule("email", memo_inputs=("email",))
+    def email(ctx):
+        calls.append(ctx.payload.email)
+        return BotRuleResult(score_delta=10, fraud_flag="temporary_email")
+
+    for address in ("a@yopmail.com", "a@yopmail.com", "b@gmail.com"):
+        asyncio.run(engine.run(CheckContext(payload=SimpleNamespace(email=address))))
+
+    assert calls == ["a@yopmail.com", "b@gmail.com"]
+    stats = engine.memo_stats()["email"]
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 2, 2)
+
+
+def test_memo_key_distinguishes_dict_from_list_of_pairs():
+    engine = RuleEngine()
+    calls = []
+
+    @engine.rule("device_shape", memo_inputs=("device_info",))
+    def device_shape(ctx):
+        calls.append(ctx.payload.device_info)
+        return BotRuleResult(score_delta=0, fraud_flag=None)
+
+    for device_info in ({"platform": "Win32"}, [["platform", "Win32"]], [("platform", "Win32")]):
+        asyncio.run(engine.run(CheckContext(payload=SimpleNamespace(device_info=device_info))))
+
+    # Список пар - не тот же вход, что dict (список и кортеж в JSON неразличимы)
+    assert calls == [{"platform": "Win32"}, [["platform", "Win32"]]]
+
+
+def test_memoization_rejects_rules_with_side_effects_or_io():
+    engine = RuleEngine()
+    with pytest.raises(ValueError):
+        engine.rule("device", side_effects=True, memo_inputs=("user_agent",))(lambda ctx: None)
+    with pytest.raises(ValueError):
+        engine.rule("velocity", blocking=True, memo_inputs=("email",))(lambda ctx: None)
+    with pytest.raises(ValueError):
+        engine.rule("timezone", memo_inputs=("results.ip_country",))(lambda ctx: None)
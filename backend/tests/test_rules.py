@@ -51,3 +51,13 @@ def test_device_normal():
     result = check_device({"platform": "MacIntel"}, "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)")
     assert result.fraud_flag is None
     assert result.score_delta == 0
+
+
+def test_rule_results_share_no_signal_and_aggregate():
+    from app.risk_score import aggregate_results, aggregate_score_and_flags
+    from app.rules.result import NO_SIGNAL, RuleResult
+
+    assert check_bot_activity(60000, 40, 2000, 120) is NO_SIGNAL
+    results = [RuleResult(30, "geo_mismatch"), NO_SIGNAL, RuleResult(90, "geo_mismatch"), RuleResult(-5, None)]
+    assert aggregate_results(results) == aggregate_score_and_flags([(r.score_delta, r.fraud_flag) for r in results])
+    assert aggregate_results(results) == (100, ["geo_mismatch"])
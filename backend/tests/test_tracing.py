@@ -0,0 +1,94 @@
+import asyncio
+import json
+from fastapi.testclient import TestClient
+from app.config import settings
+from app.main import app
+from app.tracing import parse_traceparent, tracer, trusted_networks
+from app.websocket_manager import WebSocketManager
+from load_test import BIN_HOSTS, GEO_HOSTS, ProviderStub, StubServers
+
+CHECK = {"email": "trace@gmail.com", "ip": "10.1.2.3", "bin": "987654", "user_agent": "Mozilla/5.0", "timezone": "Europe/London"}
+
+
+def read_spans(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_sampled_check_is_written_as_one_zipkin_trace(tmp_path, monkeypatch):
+    stubs = [ProviderStub(host, latency_ms=1, jitter_ms=0) for host in GEO_HOSTS + BIN_HOSTS]
+    stubs[0].error_rate = 1.0
+    servers = StubServers(stubs)
+    monkeypatch.setattr(settings, "provider_base_urls", servers.start())
+    monkeypatch.setattr(settings, "rate_limit_ip", 10**9)
+    path = tmp_path / "traces.jsonl"
+    tracer.configure(path=str(path), sample_rate=1.0)
+    try:
+        response = TestClient(app).post("/api/check", json=CHECK, headers={"X-API-Key": settings.api_key})
+    finally:
+        tracer.configure(path="", sample_rate=0.0)
+        servers.stop()
+    assert response.status_code == 200
+
+    spans = read_spans(path)
+    root = spans[-1]
+    assert root["name"] == "POST /api/check" and root["kind"] == "SERVER" and "parentId" not in root
+    assert response.headers["x-trace-id"] == root["traceId"]
+    assert {s["traceId"] for s in spans} == {root["traceId"]}
+    by_id = {s["id"]: s for s in spans}
+    assert all(s["parentId"] in by_id for s in spans[:-1])
+
+    names = [s["name"] for s in spans]
+    assert "rule velocity" in names and "stage rules" in names
+    # SQL правила из пула потоков - дочерний спан этого правила
+    velocity = next(s for s in spans if s["name"] == "rule velocity")
+    assert any(s["name"] == "sql SELECT" and s["parentId"] == velocity["id"] and s["tags"]["db.statement"] for s in spans)
+    # Первый geo-провайдер отказал, ответил второй
+    geo = [s for s in spans if s["name"] == "GET geo"]
+    assert [(s["remoteEndpoint"]["serviceName"], s["tags"]["http.status_code"]) for s in geo] == [("ipapi.co", "503"), ("ip-api.com", "200")]
+    assert geo[1]["tags"]["answered"] == "True" and geo[1]["parentId"] == next(s["id"] for s in spans if s["name"] == "rule ip_country")
+
+
+def test_head_sampling_and_traceparent(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer.configure(path=str(path), sample_rate=0.0, trusted=trusted_networks(["10.0.0.0/8"]))
+    try:
+        assert tracer.start_trace("skipped") is None
+        # Флаг sampled от клиента не из доверенной сети запись не включает
+        assert tracer.start_trace("untrusted", "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01", client="203.0.113.5") is None
+        root = tracer.start_trace("forced", "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01", client="10.1.2.3")
+        manager = WebSocketManager()
+
+        class Connection:
+            async def send_text(self, text):
+                pass
+
+        manager.active_connections.append(Connection())
+        with root:
+            asyncio.run(manager.broadcast({"type": "fraud_alert"}))
+    finally:
+        tracer.configure(path="", sample_rate=0.0, trusted=[])
+
+    broadcast, forced = read_spans(path)
+    assert forced["traceId"] == "0af7651916cd43dd8448eb211c80319c" and forced["parentId"] == "b7ad6b7169203331"
+    assert broadcast["name"] == "websocket broadcast" and broadcast["tags"] == {"type": "fraud_alert", "connections": "1", "failed": "0"}
+    assert parse_traceparent("00-xyz-1-01") is None
+    assert parse_traceparent("00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-00")["sampled"] is False
+
+
+def test_span_cap_and_exact_path_match(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer.configure(path=str(path), sample_rate=1.0, max_spans=3)
+    try:
+        with tracer.start_trace("capped"):
+            for i in range(10):
+                with tracer.span(f"child {i}"):
+                    tracer.record("leaf", 0.001)
+        # /api/check/batch не совпадает с /api/check - не трассируется
+        response = TestClient(app).post("/api/check/batch", json={"checks": []}, headers={"X-API-Key": settings.api_key})
+    finally:
+        tracer.configure(path="", sample_rate=0.0, max_spans=settings.trace_max_spans)
+
+    spans = read_spans(path)
+    assert [s["name"] for s in spans] == ["leaf", "child 0", "child 1", "capped"]
+    assert spans[-1]["tags"]["spans.dropped"] == "17"
+    assert "x-trace-id" not in response.headers
@@ -0,0 +1,120 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from app.db import Base
+from app.models import FraudCheck
+from app.profiles import PROFILES
+from app.schemas import CheckRequest
+from app.trust import TRUSTED_PROFILE, TrustIndex, entity_key, observe_check, payload_key, select_profile, trust_index
+
+DEVICE = {"platform": "MacIntel", "screen": {"width": 1440, "height": 900}}
+UA = "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_0) Safari/605.1.15"
+DAY = 86400
+NOW = 1_700_000_000.0
+
+
+class FakeScored:
+    def __init__(self, payload, score, check_id, profile):
+        self.payload = payload
+        self.score = score
+        self.check_id = check_id
+        self.profile = profile
+
+
+def test_consecutive_low_risk_checks_earn_trust_and_high_risk_revokes_it():
+    index = TrustIndex(min_checks=3)
+    key = entity_key("Traveller@Gmail.com", "411111", DEVICE, UA)
+    other_card = entity_key("traveller@gmail.com", "550000", DEVICE, UA)
+    for check_id in range(3):
+        index.observe(key, "10.0.0.1", 5, check_id, now=NOW + check_id * DAY)
+    index.observe(key, "10.0.0.1", 5, 2, now=NOW + 3 * DAY)  # пересчёт той же проверки
+    index.observe(other_card, "10.0.0.2", 0, 10, now=NOW)
+    assert index.is_trusted(key, now=NOW + 3 * DAY)
+    assert not index.is_trusted(other_card, now=NOW)
+
+    index.observe(other_card, "10.0.0.2", 90, 11, now=NOW + 3 * DAY)
+    assert not index.is_trusted(key, now=NOW + 3 * DAY)
+    assert len(index) == 0
+
+
+def test_burst_of_low_risk_checks_does_not_earn_trust():
+    index = TrustIndex(min_checks=3)
+    key = entity_key("burst@gmail.com", "411111", DEVICE, UA)
+    for check_id in range(20):
+        index.observe(key, "10.0.0.1", 0, check_id, now=NOW + check_id * 60)
+    assert not index.is_trusted(key, now=NOW + DAY)
+
+    index.observe(key, "10.0.0.1", 0, 20, now=NOW + DAY)
+    index.observe(key, "10.0.0.1", 0, 21, now=NOW + 2 * DAY)
+    assert index.is_trusted(key, now=NOW + 2 * DAY)
+
+
+def test_trusted_results_do_not_extend_streak_and_full_profile_is_forced(monkeypatch):
+    payload = CheckRequest(email="loyal@gmail.com", ip="10.0.0.1", bin="411111", user_agent=UA, device_info=DEVICE)
+    monkeypatch.setattr(trust_index, "min_checks", 1)
+    monkeypatch.setattr(trust_index, "full_every", 3)
+    key = payload_key(payload)
+    try:
+        # Без заработанного доверия результаты сокращённого профиля связку не создают
+        observe_check(FakeScored(payload, 0, 1, TRUSTED_PROFILE))
+        assert key not in trust_index._entries
+
+        observe_check(FakeScored(payload, 0, 2, PROFILES["standard"]))
+        profiles = [select_profile(payload, PROFILES["standard"]) for _ in range(6)]
+        assert profiles == [TRUSTED_PROFILE, TRUSTED_PROFILE, PROFILES["standard"]] * 2
+
+        streak = trust_index._entries[key].low_streak
+        observe_check(FakeScored(payload, 0, 3, TRUSTED_PROFILE))
+        assert trust_index._entries[key].low_streak == streak
+
+        # Высокий score полной проверки отзывает доверие
+        observe_check(FakeScored(payload, 90, 4, PROFILES["standard"]))
+        assert select_profile(payload, PROFILES["standard"]) is PROFILES["standard"]
+    finally:
+        trust_index.invalidate_email("loyal@gmail.com")
+
+
+def test_blacklist_change_invalidates_entities_seen_on_ip():
+    index = TrustIndex(min_checks=1)
+    key = entity_key("a@gmail.com", "411111", DEVICE, UA)
+    index.observe(key, "10.0.0.1", 0, 1)
+    assert index.invalidate_ip("10.9.9.9") == 0
+    assert index.invalidate_ip("10.0.0.1") == 1
+    assert not index.is_trusted(key)
+
+
+def test_rebuild_from_history(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'trust.db'}")
+    Base.metadata.create_all(bind=engine)
+    payload = CheckRequest(email="repeat@gmail.com", ip="10.0.0.1", bin="411111", user_agent=UA, device_info=DEVICE)
+    started = datetime.utcnow() - timedelta(days=6)
+    with Session(bind=engine) as db:
+        db.add_all([
+            FraudCheck(email=payload.email, ip=payload.ip, bin=payload.bin, user_agent=UA, device_info=json.dumps(DEVICE), risk_score=0, fraud_flags="[]", created_at=started + timedelta(days=day))
+            for day in range(5)
+        ])
+        db.commit()
+
+    index = TrustIndex(min_checks=5)
+    index.rebuild(engine, batch_size=2)
+    assert index.is_trusted(payload_key(payload))
+    # Ограничение по строкам - только последние проверки окна
+    index.rebuild(engine, max_rows=3)
+    assert not index.is_trusted(payload_key(payload))
+
+    index = TrustIndex(min_checks=5)
+    asyncio.run(index.rebuild_async(engine))
+    assert index.is_trusted(payload_key(payload))
+
+
+def test_trusted_entity_gets_shortened_profile(monkeypatch):
+    payload = CheckRequest(email="fast@gmail.com", ip="10.0.0.1", bin="411111", user_agent=UA, device_info=DEVICE)
+    monkeypatch.setattr(trust_index, "min_checks", 1)
+    trust_index.observe(payload_key(payload), payload.ip, 0, 1)
+    try:
+        assert select_profile(payload, PROFILES["standard"]) is TRUSTED_PROFILE
+        assert select_profile(payload, PROFILES["full"]) is PROFILES["full"]
+    finally:
+        trust_index.invalidate_email("fast@gmail.com")
@@ -0,0 +1,83 @@
+import asyncio
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from app.db import Base
+from app.models import AuditLog, FraudCheck, AnomalyDetection
+from app.write_behind import WriteBehindWriter
+
+
+def _engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'wb.db'}")
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def test_rows_are_batched_and_drained_on_stop(tmp_path):
+    engine = _engine(tmp_path)
+    writer = WriteBehindWriter(batch_size=50, flush_interval_ms=50)
+    flushes = []
+    original = writer._write_batch
+    writer._write_batch = lambda bind, units: (flushes.append(len(units)), original(bind, units))
+
+    async def scenario():
+        await writer.start()
+        for i in range(20):
+            await writer.submit(AuditLog(action=f"action_{i}"), bind=engine)
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert sum(flushes) == 20
+    assert len(flushes) < 20
+    with Session(bind=engine) as db:
+        assert db.query(AuditLog).count() == 20
+
+
+def test_wait_returns_id_and_links_children(tmp_path):
+    engine = _engine(tmp_path)
+    writer = WriteBehindWriter(batch_size=10, flush_interval_ms=1)
+
+    async def scenario():
+        await writer.start()
+        row = FraudCheck(email="a@b.com", ip="1.1.1.1", risk_score=0, fraud_flags="[]")
+        check_id = await writer.submit(
+            row, bind=engine,
+            children=lambda log: [AnomalyDetection(check_id=log.id, anomaly_score=0.0, anomaly_type="none")],
+            wait=True,
+        )
+        await writer.stop()
+        return check_id
+
+    check_id = asyncio.run(scenario())
+    with Session(bind=engine) as db:
+        assert db.query(AnomalyDetection).one().check_id == check_id
+
+
+def test_failing_row_is_isolated_and_rest_of_batch_is_written(tmp_path, caplog):
+    engine = _engine(tmp_path)
+    with Session(bind=engine) as db:
+        db.add(FraudCheck(id=7, email="old@b.com", ip="1.1.1.1", risk_score=0, fraud_flags="[]"))
+        db.commit()
+    writer = WriteBehindWriter(batch_size=50, flush_interval_ms=50)
+
+    async def scenario():
+        await writer.start()
+        futures = []
+        for i in range(1, 11):
+            futures.append(asyncio.ensure_future(writer.submit(
+                FraudCheck(id=i, email=f"u{i}@b.com", ip="1.1.1.1", risk_score=0, fraud_flags="[]"), bind=engine,
+                children=lambda row: [AnomalyDetection(check_id=row.id, anomaly_score=0.0, anomaly_type="none")],
+                wait=True,
+            )))
+            futures.append(asyncio.ensure_future(writer.submit(AuditLog(action=f"action_{i}"), bind=engine, wait=True)))
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        await writer.stop()
+        return results
+
+    results = asyncio.run(scenario())
+    assert sum(isinstance(r, Exception) for r in results) == 1
+    with Session(bind=engine) as db:
+        assert db.query(FraudCheck).count() == 10
+        assert db.query(AnomalyDetection).count() == 9
+        assert db.query(AuditLog).count() == 10
+    dead = [r for r in caplog.records if r.name == "antifraud.write_behind.dead_letter"]
+    assert len(dead) == 1 and '"id": 7' in dead[0].getMessage()
@@ -50,7 +50,7 @@
   }
 
   function attachFraudCheck(options) {
-    // options: { form, emailInput, cardInput, endpointUrl, onResult }
+    // options: { form, emailInput, cardInput, endpointUrl, sessionUrl, apiKey, onResult }
     if (!options || !options.form) throw new Error('form is required');
     var form = (typeof options.form === 'string') ? document.querySelector(options.form) : options.form;
     if (!form) throw new Error('form not found');
@@ -60,6 +60,74 @@
 
     var endpointUrl = options.endpointUrl || 'http://localhost:8000/api/check';
     var onResult = typeof options.onResult === 'function' ? options.onResult : function () {};
+    // Сессия проверки: lookup'ы на сервере идут, пока пользователь заполняет форму.
+    // sessionUrl: null - без сессии, только /api/check на submit
+    var sessionUrl = options.sessionUrl !== undefined ? options.sessionUrl
+      : (/\/api\/check$/.test(endpointUrl) ? endpointUrl + '/session' : null);
+    var apiKey = options.apiKey || null;
+
+    function requestHeaders() {
+      var headers = { 'Content-Type': 'application/json' };
+      if (apiKey) headers['X-API-Key'] = apiKey;
+      return headers;
+    }
+
+    var ipPromise = fetchIP();
+
+    async function startSession() {
+      if (!sessionUrl) return null;
+      try {
+        var resp = await fetch(sessionUrl, {
+          method: 'POST',
+          headers: requestHeaders(),
+          body: JSON.stringify({
+            ip: await ipPromise,
+            user_agent: navigator.userAgent || '',
+            timezone: getTimezone(),
+            language: getLanguage(),
+            device_info: collectDeviceInfo(),
+          }),
+        });
+        if (!resp.ok) return null;
+        var data = await resp.json();
+        return data && data.session_id ? data.session_id : null;
+      } catch (e) {
+        return null;
+      }
+    }
+
+    var sessionPromise = startSession();
+
+    async function updateSession(fields) {
+      var sessionId = await sessionPromise;
+      if (!sessionId) return;
+      try {
+        await fetch(sessionUrl + '/' + encodeURIComponent(sessionId), {
+          method: 'PATCH',
+          headers: requestHeaders(),
+          body: JSON.stringify(fields),
+        });
+      } catch (e) {
+        // Не критично: finalize посчитает недостающее сам
+      }
+    }
+
+    var lastEmail = null;
+    var lastBin = null;
+
+    function handleEmailChange() {
+      var email = emailEl ? (emailEl.value || '').trim() : '';
+      if (!email || email === lastEmail) return;
+      lastEmail = email;
+      updateSession({ email: email });
+    }
+
+    function handleCardInput() {
+      var bin = normalizeBIN(cardEl ? cardEl.value : '');
+      if (!bin || bin === lastBin) return;
+      lastBin = bin;
+      updateSession({ bin: bin });
+    }
 
     // Сбор поведенческих метрик
     var startTs = nowMs();
@@ -91,6 +159,8 @@
 
     if (emailEl) emailEl.addEventListener('keydown', handleKeydown, true);
     if (cardEl) cardEl.addEventListener('keydown', handleKeydown, true);
+    if (emailEl) emailEl.addEventListener('change', handleEmailChange, false);
+    if (cardEl) cardEl.addEventListener('input', handleCardInput, false);
 
     async function handleSubmit(ev) {
       try {
@@ -106,7 +176,7 @@
           email: emailEl ? (emailEl.value || '') : '',
           bin: normalizeBIN(cardEl ? cardEl.value : ''),
           user_agent: navigator.userAgent || '',
-          ip: await fetchIP(),
+          ip: await ipPromise,
           timezone: getTimezone(),
           language: getLanguage(),
           session_duration_ms: sessionDurationMs,
@@ -116,9 +186,12 @@
           device_info: collectDeviceInfo(),
         };
 
-        var resp = await fetch(endpointUrl, {
+        // Есть сессия - финальная проверка только сливает предрасчитанные результаты
+        var sessionId = await sessionPromise;
+        var url = sessionId ? sessionUrl + '/' + encodeURIComponent(sessionId) + '/finalize' : endpointUrl;
+        var resp = await fetch(url, {
           method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
+          headers: requestHeaders(),
           body: JSON.stringify(payload),
         });
         var data = null;
@@ -137,6 +210,8 @@
         document.removeEventListener('click', handleClickOnce, true);
         if (emailEl) emailEl.removeEventListener('keydown', handleKeydown, true);
         if (cardEl) cardEl.removeEventListener('keydown', handleKeydown, true);
+        if (emailEl) emailEl.removeEventListener('change', handleEmailChange, false);
+        if (cardEl) cardEl.removeEventListener('input', handleCardInput, false);
         form.removeEventListener('submit', handleSubmit, false);
       }
     };